@@ -1,8 +1,4 @@
-import re
-import json
-import sys
-import traceback
-
+from checks import compile_check, compile_plan
 from logger import setup_logger
 logger = setup_logger(__name__)
 
@@ -18,173 +14,77 @@ class Agent():
     def __init__(self):
         pass
 
-    def evaluate_response(self, request):
-        expected = request.expected
-        response = request.response
+    def evaluate_response(self, request, response=None):
+        response = request.response if response is None else response
+        plan = request.plan if request.plan is not None else compile_plan(request.expected)
+        values = plan.resolve(response)
         result = []
-        for propiedad in expected.keys():
-            for test in expected[propiedad]:
-                logger.debug(f"Evaluating <{propiedad}> response property on <{test}> condition")
-                check = list(test.keys()).pop(0)
-                result.append(self.prepare_and_assert(propiedad, check, test[check], response[propiedad]))
+        for prop, check in plan:
+            current_value = values[prop]
+            logger.debug("Evaluating <%s> response property on <%s> condition", prop, check.name)
+            result.append(self.record(AssertionResult(check.evaluate(current_value), prop, check, current_value)))
+        return result
+
+    def record(self, result):
+        # The result itself is the argument, its message is only rendered if the record is emitted
+        if result.status:
+            logger.info("Assertion passed: %s", result, extra={'passed': True})
+        else:
+            logger.error("Assertion failed: %s", result)
         return result
 
     def assert_and_go(self, condition, message=None):
-        logger.debug(f"Asserting: {message}")
-        try:
-            assert condition, message
-
-        except AssertionError as e:
-            exc_type, exc_value, exc_traceback = sys.exc_info()
-            tb = traceback.extract_tb(exc_traceback)
-            filename, line, func, text = tb[-1]
-
-            details = f"Assertion failed on line {line} in {filename}:\n"
-            details += f"    {text}\n"
-            if message:
-                details += f"Message: {message}\n"
-
-            logger.error(f"Assertion failed: {message}")
-            return {
-                "status": False,
-                "message": f"Assertion failed: {message}",
-                "details": details
-            }
-
-        logger.info(f"Assertion passed: {message}")
-        return {
-            "status": True,
-            "message": f"Assertion passed: {message}",
-            "details": ""
-        }
+        logger.debug("Asserting: %s", message)
+        return self.record(AssertionResult(condition, description=message))
 
     def prepare_and_assert(self, prop, test, expected_value, current_value):
         logger.debug(
-            f"Preparing and asserting <{prop}>, for <{test}> test, with expected value <{expected_value}> and current value <{current_value}>")
-
-        if test == 'contains':
-            if type(expected_value) == dict:
-                condition = all(item in current_value.items() for item in expected_value.items())
-            elif type(expected_value) == list:
-                condition = all(item in current_value for item in expected_value)
-            else:
-                condition = expected_value in current_value
-
-            result = self.assert_and_go(
-                condition=condition,
-                message=f"Expected <{prop}> to contain <{expected_value}>, got <{current_value}>"
-            )
-            return result
-
-        elif test == 'includes':
-            try:
-                if type(expected_value) == dict:
-                    condition = all(item in current_value.items() for item in expected_value.items())
-                    message = f"Expected <{prop}> to include <{expected_value}>, got <{current_value}>"
-                else:
-                    condition = expected_value in current_value
-                    message = f"Expected <{prop}> to include <{expected_value}>, got <{current_value}>"
-            except AttributeError or TypeError:
-                condition = False
-                message = f"Expected <{prop}> to include <{expected_value}>, got <{current_value}>"
-
-            result = self.assert_and_go(
-                condition=condition,
-                message=message
-            )
-            return result
-
-        elif test == 'equals':
-            if type(expected_value) == dict:
-                norm_expected = re.sub(r'[\n\r\t\s]+', '', json.dumps(expected_value, sort_keys=True))
-                norm_current = re.sub(r'[\n\r\t\s]+', '', json.dumps(current_value, sort_keys=True))
-                condition = norm_expected == norm_current
-                message = f"Expected <{prop}> to be {norm_expected}, got {norm_current}"
-            else:
-                condition = expected_value == current_value
-                message = f"Expected <{prop}> to be <{expected_value}>, got <{current_value}>"
-            result = self.assert_and_go(
-                condition=condition,
-                message=message
-            )
-            return result
-
-        elif test == 'greater':
-            result = self.assert_and_go(
-                condition=current_value > expected_value,
-                message=f"Expected <{prop}> to be greater than <{expected_value}>, got <{current_value}>"
-            )
-            return result
-
-        elif test == 'lower':
-            result = self.assert_and_go(
-                condition=current_value < expected_value,
-                message=f"Expected <{prop}> to be lower than <{expected_value}>, got <{current_value}>"
-            )
-            return result
-
-        elif test == 'exists':
-            result = self.assert_and_go(
-                condition=current_value is not None,
-                message=f"Expected <{prop}> to exist, got <{current_value}>"
-            )
-            return result
-
-        elif test == 'not_exists':
-            result = self.assert_and_go(
-                condition=current_value is None,
-                message=f"Expected <{prop}> to not exist, got <{current_value}>"
-            )
-            return result
-
-        elif test == 'type':
-            result = self.assert_and_go(
-                condition=type(current_value) == expected_value,
-                message=f"Expected <{prop}> to be of type <{expected_value}>, got {type(current_value)}"
-            )
-            return result
-
-        elif test == 'length':
-            result = self.assert_and_go(
-                condition=len(current_value) == expected_value,
-                message=f"Expected <{prop}> to have length <{expected_value}>, got {len(current_value)}"
-            )
-            return result
-
-        elif test == 'empty':
-            result = self.assert_and_go(
-                condition=len(current_value) == 0,
-                message=f"Expected <{prop}> to be empty, got <{current_value}>"
-            )
-            return result
-
-        elif test == 'not_empty':
-            result = self.assert_and_go(
-                condition=len(current_value) > 0,
-                message=f"Expected <{prop}> to not be empty, got <{current_value}>"
-            )
-            return result
-
-        elif test == "in_range":
-            window = sorted(expected_value.split(":"))
-
-            try:
-                condition = int(window[0]) <= int(current_value) <= int(window[1])
-            except ValueError:
-                condition = False
-
-            result = self.assert_and_go(
-                condition=condition,
-                message=f"Expected <{prop}> to be in range <{expected_value}>, got <{current_value}>"
-            )
-            return result
-
-        elif test == "matches":
-            result = self.assert_and_go(
-                condition=re.fullmatch(expected_value, str(current_value)),
-                message=f"Expected <{prop}> to match <{expected_value}>, got <{current_value}>"
-            )
-            return result
+            "Preparing and asserting <%s>, for <%s> test, with expected value <%s> and current value <%s>",
+            prop, test, expected_value, current_value)
 
-        else:
-            return False, f"Unknown test type: {test}"
\ No newline at end of file
+        try:
+            check = compile_check(test, expected_value)
+        except ValueError as e:
+            return False, str(e)
+
+        return self.record(AssertionResult(check.evaluate(current_value), prop, check, current_value))
+
+
+class AssertionResult:
+    """
+    Outcome of a single check. The message is only rendered when it is read, which for
+    passing checks usually never happens.
+    """
+    __slots__ = ('status', 'prop', 'check', 'current', '_description')
+
+    def __init__(self, status, prop=None, check=None, current=None, description=None):
+        self.status = bool(status)
+        self.prop = prop
+        self.check = check
+        self.current = current
+        self._description = description
+
+    @property
+    def check_id(self):
+        return f"{self.prop}.{self.check.name}" if self.check else None
+
+    @property
+    def description(self):
+        if self._description is None and self.check is not None:
+            return self.check.message(self.prop, self.current)
+        return self._description
+
+    def __str__(self):
+        return str(self.description)
+
+    @property
+    def message(self):
+        return f"Assertion {'passed' if self.status else 'failed'}: {self.description}"
+
+    @property
+    def details(self):
+        return "" if self.status else f"Message: {self.description}\n"
+
+    def __getitem__(self, key):
+        # Results used to be plain dicts
+        return getattr(self, key)
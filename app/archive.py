@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import threading
+import zlib
+
+from requests.structures import CaseInsensitiveDict
+
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+DATA_FILE = 'responses.bin'
+INDEX_FILE = 'index.json'
+# Headers that change between runs without changing the request
+VOLATILE_HEADERS = ('authorization',)
+
+
+def fingerprint(request):
+    """
+    Stable key of a request: method, url, headers and payload, without credentials
+    """
+    headers = sorted((key.lower(), str(value)) for key, value in (request.headers or {}).items()
+                     if key.lower() not in VOLATILE_HEADERS)
+    key = json.dumps([request.method, request.url, headers, request.json, request.data], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+class Recorder:
+    """
+    Append each outcome, compressed, to a single data file and keep an index of
+    fingerprint -> (offset, length), written when the recorder is closed
+    """
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.index = {}
+        self.lock = threading.Lock()
+        self.file = open(os.path.join(directory, DATA_FILE), 'wb')
+
+    def add(self, request, outcome):
+        record = dict(outcome, headers=dict(outcome.get('headers') or {}))
+        blob = zlib.compress(json.dumps(record, default=str).encode())
+        with self.lock:
+            offset = self.file.tell()
+            self.file.write(blob)
+            self.index[fingerprint(request)] = (offset, len(blob))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+            with open(os.path.join(self.directory, INDEX_FILE), 'w') as f:
+                json.dump(self.index, f)
+        logger.info("Recorded %s responses in %s", len(self.index), self.directory)
+
+
+class Replayer:
+    """
+    Serve recorded outcomes by fingerprint, without any network I/O
+    """
+    def __init__(self, directory):
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.fd = os.open(os.path.join(directory, DATA_FILE), os.O_RDONLY)
+        logger.info("Loaded %s recorded responses from %s", len(self.index), directory)
+
+    def get(self, request):
+        entry = self.index.get(fingerprint(request))
+        if entry is None:
+            logger.error("No recorded response for request %s: %s %s", request.id, request.method, request.url)
+            return {
+                "body": "",
+                "headers": {},
+                "status_code": "",
+                "error": "No recorded response",
+            }
+
+        offset, length = entry
+        # pread keeps concurrent reads independent of a shared file position
+        outcome = json.loads(zlib.decompress(os.pread(self.fd, length, offset)))
+        outcome['headers'] = CaseInsensitiveDict(outcome['headers'])
+        return outcome
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,347 @@
+import re
+
+from compare import first_difference, scalars_equal
+from jsonpath import PathSet
+
+# Properties of the response outcome that can be asserted in an `expect` block. The body
+# can also be asserted on a path inside it, e.g. `body.$.items[*].id`
+BODY_PATH_PREFIX = 'body.'
+RESPONSE_PROPERTIES = (
+    'body', 'headers', 'status_code', 'error',
+    'elapsed_ms', 'ttfb_ms', 'connect_ms', 'tls_ms', 'size_bytes',
+)
+
+# Properties that can only be known after downloading the response body
+BODY_PROPERTIES = ('body', 'size_bytes')
+
+TYPES = {
+    'str': (str,), 'string': (str,),
+    'int': (int,), 'integer': (int,),
+    'float': (float,), 'number': (int, float),
+    'bool': (bool,), 'boolean': (bool,),
+    'dict': (dict,), 'object': (dict,),
+    'list': (list,), 'array': (list,),
+    'null': (type(None),), 'none': (type(None),),
+}
+
+
+class Check:
+    """
+    A single compiled condition of an `expect` block. Everything that only depends on the
+    expected value is prepared in the constructor, so `evaluate` does no parsing.
+    """
+    name = None
+    # Extra keys accepted next to the test name, e.g. `unordered` for `equals`
+    options = ()
+
+    def __init__(self, expected):
+        self.expected = expected
+
+    def evaluate(self, current):
+        raise NotImplementedError
+
+    def message(self, prop, current):
+        raise NotImplementedError
+
+
+class Contains(Check):
+    name = 'contains'
+
+    def __init__(self, expected):
+        super().__init__(expected)
+        if isinstance(expected, dict):
+            self.items = tuple(expected.items())
+        elif isinstance(expected, list):
+            self.items = tuple(expected)
+        else:
+            self.items = None
+
+    def evaluate(self, current):
+        try:
+            if isinstance(self.expected, dict):
+                current_items = current.items()
+                return all(item in current_items for item in self.items)
+            if self.items is not None:
+                return all(item in current for item in self.items)
+            return self.expected in current
+        except (AttributeError, TypeError):
+            return False
+
+    def message(self, prop, current):
+        return f"Expected <{prop}> to contain <{self.expected}>, got <{current}>"
+
+
+class Includes(Contains):
+    name = 'includes'
+
+    def evaluate(self, current):
+        try:
+            if isinstance(self.expected, dict):
+                current_items = current.items()
+                return all(item in current_items for item in self.items)
+            return self.expected in current
+        except (AttributeError, TypeError):
+            return False
+
+    def message(self, prop, current):
+        return f"Expected <{prop}> to include <{self.expected}>, got <{current}>"
+
+
+class Equals(Check):
+    name = 'equals'
+    options = ('unordered',)
+
+    def __init__(self, expected, unordered=False):
+        super().__init__(expected)
+        self.unordered = bool(unordered)
+        self.structural = isinstance(expected, (dict, list))
+
+    def evaluate(self, current):
+        if not self.structural:
+            return scalars_equal(self.expected, current)
+        return first_difference(self.expected, current, self.unordered) is None
+
+    def message(self, prop, current):
+        message = f"Expected <{prop}> to be <{self.expected}>"
+        difference = first_difference(self.expected, current, self.unordered)
+        if difference:
+            path, reason = difference
+            message += f", first difference at {path}: {reason}"
+        return message
+
+
+class Greater(Check):
+    name = 'greater'
+
+    def evaluate(self, current):
+        try:
+            return current > self.expected
+        except TypeError:
+            return False
+
+    def message(self, prop, current):
+        return f"Expected <{prop}> to be greater than <{self.expected}>, got <{current}>"
+
+
+class Lower(Check):
+    name = 'lower'
+
+    def evaluate(self, current):
+        try:
+            return current < self.expected
+        except TypeError:
+            return False
+
+    def message(self, prop, current):
+        return f"Expected <{prop}> to be lower than <{self.expected}>, got <{current}>"
+
+
+class Exists(Check):
+    name = 'exists'
+
+    def evaluate(self, current):
+        return current is not None
+
+    def message(self, prop, current):
+        return f"Expected <{prop}> to exist, got <{current}>"
+
+
+class NotExists(Check):
+    name = 'not_exists'
+
+    def evaluate(self, current):
+        return current is None
+
+    def message(self, prop, current):
+        return f"Expected <{prop}> to not exist, got <{current}>"
+
+
+class Type(Check):
+    name = 'type'
+
+    def __init__(self, expected):
+        super().__init__(expected)
+        if isinstance(expected, type):
+            self.types = (expected,)
+        elif str(expected).lower() in TYPES:
+            self.types = TYPES[str(expected).lower()]
+        else:
+            raise ValueError(f"Unknown type <{expected}>, expected one of {sorted(TYPES)}")
+
+    def evaluate(self, current):
+        return type(current) in self.types
+
+    def message(self, prop, current):
+        return f"Expected <{prop}> to be of type <{self.expected}>, got {type(current)}"
+
+
+class Length(Check):
+    name = 'length'
+
+    def __init__(self, expected):
+        super().__init__(expected)
+        if isinstance(expected, bool) or not isinstance(expected, int):
+            raise ValueError(f"Length must be an integer, got <{expected}>")
+
+    def evaluate(self, current):
+        try:
+            return len(current) == self.expected
+        except TypeError:
+            return False
+
+    def message(self, prop, current):
+        try:
+            length = len(current)
+        except TypeError:
+            length = None
+        return f"Expected <{prop}> to have length <{self.expected}>, got {length}"
+
+
+class Empty(Check):
+    name = 'empty'
+
+    def evaluate(self, current):
+        try:
+            return len(current) == 0
+        except TypeError:
+            return False
+
+    def message(self, prop, current):
+        return f"Expected <{prop}> to be empty, got <{current}>"
+
+
+class NotEmpty(Check):
+    name = 'not_empty'
+
+    def evaluate(self, current):
+        try:
+            return len(current) > 0
+        except TypeError:
+            return False
+
+    def message(self, prop, current):
+        return f"Expected <{prop}> to not be empty, got <{current}>"
+
+
+class InRange(Check):
+    name = 'in_range'
+
+    def __init__(self, expected):
+        super().__init__(expected)
+        bounds = expected if isinstance(expected, (list, tuple)) else str(expected).split(":")
+        try:
+            self.low, self.high = sorted(int(bound) for bound in bounds)
+        except ValueError:
+            raise ValueError(f"Range must look like <low:high>, got <{expected}>")
+
+    def evaluate(self, current):
+        try:
+            return self.low <= int(current) <= self.high
+        except (TypeError, ValueError):
+            return False
+
+    def message(self, prop, current):
+        return f"Expected <{prop}> to be in range <{self.expected}>, got <{current}>"
+
+
+class Matches(Check):
+    name = 'matches'
+
+    def __init__(self, expected):
+        super().__init__(expected)
+        try:
+            self.pattern = re.compile(expected)
+        except (re.error, TypeError) as e:
+            raise ValueError(f"Invalid regular expression <{expected}>: {e}")
+
+    def evaluate(self, current):
+        return self.pattern.fullmatch(str(current)) is not None
+
+    def message(self, prop, current):
+        return f"Expected <{prop}> to match <{self.expected}>, got <{current}>"
+
+
+CHECKS = {check.name: check for check in (
+    Contains, Includes, Equals, Greater, Lower, Exists, NotExists,
+    Type, Length, Empty, NotEmpty, InRange, Matches,
+)}
+
+
+def compile_check(test, expected_value, options=None):
+    if test not in CHECKS:
+        raise ValueError(f"Unknown test type: {test}")
+    check = CHECKS[test]
+    options = options or {}
+    unknown = [option for option in options if option not in check.options]
+    if unknown:
+        raise ValueError(f"Unknown options {unknown} for <{test}>")
+    return check(expected_value, **options)
+
+
+class Plan:
+    """
+    The compiled form of an `expect` block: the (property, check) pairs to evaluate, and the
+    body paths they need, resolved together in a single traversal of the body
+    """
+    def __init__(self, checks=None, paths=None):
+        self.checks = checks or []
+        self.paths = paths or PathSet()
+        self.needs_body = any(prop in BODY_PROPERTIES or prop.startswith(BODY_PATH_PREFIX) for prop, _ in self.checks)
+
+    def __iter__(self):
+        return iter(self.checks)
+
+    def __len__(self):
+        return len(self.checks)
+
+    def resolve(self, response):
+        """
+        :return: dict of property -> current value for every property asserted in the plan
+        """
+        values = {prop: response.get(prop) for prop, _ in self.checks if not prop.startswith(BODY_PATH_PREFIX)}
+        if len(self.paths):
+            for expression, value in self.paths.resolve(response.get('body')).items():
+                values[BODY_PATH_PREFIX + expression] = value
+        return values
+
+
+def compile_plan(expected):
+    """
+    Turn an `expect` block into a Plan of (property, check) pairs, failing on malformed entries
+    :param expected: dict of property -> list of {test: expected_value}
+    :return:
+    """
+    checks = []
+    paths = PathSet()
+    for prop, tests in (expected or {}).items():
+        if prop.startswith(BODY_PATH_PREFIX):
+            try:
+                paths.add(prop[len(BODY_PATH_PREFIX):])
+            except ValueError as e:
+                raise ValueError(f"Invalid body path <{prop}>: {e}")
+        elif prop not in RESPONSE_PROPERTIES:
+            raise ValueError(f"Unknown response property <{prop}>, expected one of {list(RESPONSE_PROPERTIES)}")
+        if not isinstance(tests, list):
+            raise ValueError(f"Expectations for <{prop}> must be a list of tests")
+
+        for test in tests:
+            if not isinstance(test, dict) or not test:
+                raise ValueError(f"Malformed test for <{prop}>: <{test}>")
+            # The check is the key naming one, whatever its position, the other keys are its options
+            names = [key for key in test if key in CHECKS]
+            if len(names) > 1:
+                raise ValueError(f"Malformed test for <{prop}>: more than one check in <{test}>")
+            name = names[0] if names else next(iter(test))
+            try:
+                checks.append((prop, compile_check(name, test[name], {option: value for option, value in test.items()
+                                                                      if option != name})))
+            except ValueError as e:
+                raise ValueError(f"Invalid <{name}> test for <{prop}>: {e}")
+    return Plan(checks, paths)
+
+
+def needs_body(plan):
+    """
+    Whether a compiled plan asserts anything that requires downloading the response body
+    """
+    return plan is None or plan.needs_body
@@ -1,12 +1,22 @@
 import itertools
+import math
+from collections import defaultdict
 import random
 import re
 import string
-from request import Request
+import threading
+import zlib
+from checks import compile_plan
+from graph import DependencyGraph, ancestors, check_dependencies, flows_of
+from metrics import Metrics
+import tagexpr
+from report import result_of
+from request import Request, RequestTemplate
+from ratelimit import RateLimiter
+from session import SessionPool
 from urllib.parse import urlparse
-import globals
 
-from logger import setup_logger
+from logger import REPORT, setup_logger
 logger = setup_logger(__name__)
 
 
@@ -23,13 +33,33 @@ class Collection:
         logger.info("Initializing Collection")
         self.id_counter = 1
         self.requests = {}
-        self.tags = []
-        self.suites = []
+        self.index = Index()
+        self.templates = []
+        self.template_index = Index()
+        self.defaults = {}
+        self.bypass_proxy = []
+        self.bypass_hosts = {}
+        # suite -> suites whose captures it uses, and suite -> the group of suites linked to it
+        self.dependencies = {}
+        self.flows = {}
+        self.lock = threading.Lock()
+        self.counters = {'requests': 0, 'assertions': 0, 'failed': 0, 'passed': 0, 'retries': 0, 'retry_ms': 0.0}
+        self.failing = {}
+        self.writers = []
+        # Connection and throttling stats of the worker processes, see merge_stats
+        self.worker_connections = {}
+        self.worker_throttled = {}
 
         if data:
             self.parse_requests_in(data)
 
-        self.working_set = list(self.requests.keys())
+    @property
+    def tags(self):
+        return sorted(self.index.by_tag)
+
+    @property
+    def suites(self):
+        return sorted(self.index.by_suite)
 
     def get_items(self):
         return self.requests
@@ -37,43 +67,42 @@ class Collection:
     def append(self, request: Request, tags=None, suite=None):
         if suite:
             request.suite = suite
-            self.suites.append(suite)
         if tags:
             request.tags = tags
-            self.tags.extend(tags)
 
         # Use the id_counter as the unique key
         request.id = self.id_counter
         self.requests[self.id_counter] = request
+        self.index.add(request.id, request.tags, request.suite)
         self.id_counter += 1  # Increment the counter
 
     def filter_requests(self, tags=None, suites=None):
         """
-        Filter the requests list by tags and suites
-        :param tags:
+        Filter the requests list by tags and suites. The requests already recorded are not kept.
+        :param tags: list of tags that must all be present, or a boolean tag expression
         :param suites:
         :return:
         """
-        filtered_requests = {}
-        for request in self.requests.values():
-            if tags and not set(tags).issubset(set(request.tags)):
-                continue
-            if suites and request.suite not in suites:
-                continue
-            filtered_requests[request.id] = request
-        return filtered_requests
+        return {request_id: self.requests[request_id] for request_id in self.index.select(tags, suites)
+                if request_id in self.requests}
 
     def parse_requests_in(self, data):
         """
-        Read, interpret and return the requests list
+        Read and interpret the requests list into templates. The requests themselves are only
+        created when the templates are expanded, see iter_requests
         :return:
         """
         logger.info("Loading requests list...")
         defaults = data.get('defaults', {}).get('request', {})
         requests_list = data.get('requests', [])
+        SessionPool().configure(defaults.get('pool', {}))
+        RateLimiter().configure(defaults.get('rate_limit'))
+        self.defaults = defaults
+        self.bypass_proxy = data.get('defaults', {}).get('bypass_proxy', []) or []
+        oauth2_providers = data.get('defaults', {}).get('oauth2', {}) or {}
 
         for item in requests_list:
-            logger.debug(f"Instantiating the requests for [{item.get('name')}] suite - ({self.id_counter})")
+            logger.debug(f"Loading the template for [{item.get('name')}] suite - ({len(self.templates) + 1})")
             invoke = item.get('invoke', {})
 
             attributes = {
@@ -86,68 +115,320 @@ class Collection:
                 'summary': item.get('summary', ''),
                 'suite': slugify(item.get('name', rand(7))),
                 'expected' : item.get('expect', {}),
+                'plan': compile_plan(item.get('expect', {})),
                 'timeout': item.get('timeout', defaults.get('timeout', 10)),
+                'retry': item.get('retry', defaults.get('retry')),
+                'interval': item.get('interval', defaults.get('interval')),
+                'capture': item.get('capture'),
+                'depends_on': [slugify(name) for name in as_list(item.get('depends_on'))],
+                'max_body_bytes': item.get('max_body_bytes', defaults.get('max_body_bytes')),
                 'tags': [item.get('tags')] if isinstance(item.get('tags'), str) else item.get('tags', []),
             }
 
             pattern = re.compile(r'^Bearer \{\{(\w+)}}$')
 
+            # The token itself is only looked up when the request is sent, so it can be refreshed
             if 'authorization' in attributes['headers']:
                 match = re.search(pattern, attributes['headers']['authorization'])
                 if match:
-                    token = globals.tokens.get(match.group(1), None)
-                    if token:
-                        attributes['headers']['authorization'] = f"Bearer {token}"
-                    else:
-                        logger.error(f"Token not found for provider: {match.group(1)}")
-                        raise ValueError(f"Token not found for provider: {match.group(1)}")
-
-            urls = url_combos(invoke, defaults)
-            for url in urls:
-                attributes['url'] = url
-                request = Request(attributes)
-                self.append(request)
+                    provider = match.group(1)
+                    if not oauth2_providers.get(provider, {}).get('enabled'):
+                        logger.error(f"Token not found for provider: {provider}")
+                        raise ValueError(f"Token not found for provider: {provider}")
+                    attributes['auth_provider'] = provider
+
+            # Fail at load time rather than half way through the expansion
+            if not ('url' in invoke or 'url' in defaults or ('url_values' in invoke and 'url_template' in defaults)):
+                logger.error("No URL provided for request")
+                raise ValueError("No URL provided for request")
+
+            if attributes['depends_on']:
+                self.dependencies.setdefault(attributes['suite'], set()).update(attributes['depends_on'])
+
+            self.template_index.add(len(self.templates), attributes['tags'], attributes['suite'])
+            self.templates.append({
+                'attributes': attributes,
+                'request': RequestTemplate(attributes),
+                'invoke': invoke,
+                'proxy': invoke.get('proxy', defaults.get('proxy', {})),
+            })
+
+        check_dependencies(self.dependencies, self.template_index.by_suite)
+        self.flows = flows_of(self.dependencies)
+        logger.info(f"Unique tags in all requests: {sorted(self.template_index.by_tag)}")
+
+    def select_templates(self, tags=None, suites=None):
+        """
+        Filter the templates by tags and suites, before any of them is expanded. The suites the
+        selected ones depend on are selected too.
+        :param tags: list of tags that must all be present, or a boolean tag expression
+        :param suites:
+        :return:
+        """
+        positions = self.template_index.select(tags, suites)
+        if self.dependencies and (tags or suites):
+            selected = {self.templates[position]['attributes']['suite'] for position in positions}
+            required = {dependency for suite in selected for dependency in ancestors(self.dependencies, suite)}
+            if required - selected:
+                positions = sorted(set(positions).union(
+                    *(self.template_index.by_suite[suite] for suite in required - selected)))
+        return [self.templates[position] for position in positions]
+
+    def graph(self, tags=None, suites=None, shard=None):
+        """
+        The dependencies between the selected suites, for the Executor to start each suite once
+        the suites it depends on are done
+        :param shard: (by, index, count) as in iter_requests
+        :return: DependencyGraph, or None if none of the selected suites depends on another
+        """
+        templates = self.select_templates(tags, suites)
+        dependencies = {}
+        for template in templates:
+            if template['attributes'].get('depends_on'):
+                dependencies.setdefault(template['attributes']['suite'], set()).update(template['attributes']['depends_on'])
+        if not dependencies:
+            return None
+
+        required = set().union(*dependencies.values())
+        counts = dict.fromkeys(required, 0)
+        captures = {suite: set() for suite in required}
+        for template in templates:
+            suite = template['attributes']['suite']
+            if suite not in required:
+                continue
+            if template['request'].capture:
+                captures[suite].update(template['request'].capture.names)
+            if not shard or in_shard(suite, None, *shard, flow=self.flows.get(suite)):
+                counts[suite] += count_url_combos(template['invoke'], self.defaults)
+        return DependencyGraph(dependencies, counts, captures)
 
-                hostname = urlparse(attributes['url']).hostname
-                bypass_proxy = False
-                for substring in data.get('defaults', {}).get('bypass_proxy', {}):
-                    if f"{substring}" in hostname:
-                        bypass_proxy = True
-                        break
-                if bypass_proxy:
-                    attributes['proxy'] = {}
-                else:
-                    attributes['proxy'] = invoke.get('proxy', defaults.get('proxy', {}))
-
-        list_of_unique_tags_in_all_requests = list(
-            set(itertools.chain.from_iterable(request.tags for request in self.requests.values() if request.tags)))
-        list_of_unique_tags_in_all_requests = [tag for tag in list_of_unique_tags_in_all_requests if tag]
-        logger.info(f"Unique tags in all requests: {list_of_unique_tags_in_all_requests}")
-
-
-    # TODO: return json if not run as script
-    def build_report(self):
-        logger.info("Building report...")
-        lines = []
+    def providers(self, tags=None, suites=None):
+        """
+        OAuth2 providers referenced by the selected templates
+        """
+        return {template['attributes']['auth_provider'] for template in self.select_templates(tags, suites)
+                if template['attributes'].get('auth_provider')}
 
-        total_requests = len(self.requests)
-        lines.append(f"  > Total requests: {total_requests}")
+    def count(self, tags=None, suites=None):
+        """
+        Number of requests the selected templates expand to, without expanding them
+        """
+        return sum(count_url_combos(template['invoke'], self.defaults) for template in self.select_templates(tags, suites))
 
-        total_assertions = sum([len(request.expected) for request in self.requests.values()])
-        lines.append(f"  > Total assertions: {total_assertions}")
+    def iter_requests(self, tags=None, suites=None, shard=None):
+        """
+        Lazily expand the selected templates into requests. Each request is appended to the
+        collection right before it is yielded, so ids follow the expansion order.
+        :param tags:
+        :param suites:
+        :param shard: (by, index, count) to only yield the requests of one shard, see shard_of.
+        The ids are the same as without sharding, so the results of the shards can be merged.
+        Suites linked by dependencies always end up in the same shard.
+        :return:
+        """
+        for template in self.select_templates(tags, suites):
+            for url in url_combos(template['invoke'], self.defaults):
+                suite = template['attributes']['suite']
+                if shard and not in_shard(suite, url, *shard, flow=self.flows.get(suite)):
+                    self.id_counter += 1
+                    continue
+                proxies = {} if self.bypasses_proxy(url) else template['proxy']
+                request = Request.expand(template['request'], url, proxies)
+                self.append(request)
+                yield request
 
-        total_failed_assertions = sum(len([assertion for assertion in request.assertions if assertion['status'] == False]) for request in self.requests.values())
-        lines.append(f"  > Total failed assertions: {total_failed_assertions}")
+    def bypasses_proxy(self, url):
+        hostname = urlparse(url).hostname or ''
+        if hostname not in self.bypass_hosts:
+            self.bypass_hosts[hostname] = any(f"{substring}" in hostname for substring in self.bypass_proxy)
+        return self.bypass_hosts[hostname]
 
-        total_passed_assertions = sum(len([assertion for assertion in request.assertions if assertion['status'] == True]) for request in self.requests.values())
-        lines.append(f"  > Total passed assertions: {total_passed_assertions}")
+    def compiled_state(self):
+        """
+        Everything parse_requests_in derives from the collection file, to be cached
+        """
+        return {
+            'templates': self.templates,
+            'template_index': self.template_index,
+            'defaults': self.defaults,
+            'bypass_proxy': self.bypass_proxy,
+            'dependencies': self.dependencies,
+            'flows': self.flows,
+        }
+
+    def load_compiled(self, state):
+        """
+        Restore the templates from compiled_state instead of parsing the collection again
+        """
+        self.templates = state['templates']
+        self.template_index = state['template_index']
+        self.defaults = state['defaults']
+        self.bypass_proxy = state['bypass_proxy']
+        self.dependencies = state['dependencies']
+        self.flows = state['flows']
+        SessionPool().configure(self.defaults.get('pool', {}))
+        RateLimiter().configure(self.defaults.get('rate_limit'))
+
+    def reset_results(self):
+        """
+        Forget the requests and results of the last run, keeping the templates
+        """
+        with self.lock:
+            self.id_counter = 1
+            self.requests = {}
+            self.index = Index()
+            self.counters = dict.fromkeys(self.counters, 0)
+            self.failing = {}
+            self.worker_connections = {}
+            self.worker_throttled = {}
+
+    def add_writer(self, writer):
+        self.writers.append(writer)
+
+    def record(self, request):
+        """
+        Account for a processed request as soon as its assertions are known, so the report
+        does not need another pass over all the requests
+        :param request:
+        :return:
+        """
+        failed = sum(1 for assertion in request.assertions if not assertion.status)
+        result = result_of(request) if self.writers else None
+        response = request.response or {}
+        if Metrics().enabled:
+            Metrics().record_request(request)
+        self.tally(request.id, request.name, len(request.assertions), failed,
+                   response.get('retries', 0), response.get('retry_ms', 0.0), result)
+        # The report only needs the counters, so finished requests and their responses are not
+        # kept, and the memory of a run does not grow with the number of requests
+        with self.lock:
+            self.requests.pop(request.id, None)
+
+    def merge(self, result):
+        """
+        Account for a request processed by a worker process, from its result_of
+        """
+        failed = sum(1 for assertion in result['assertions'] if not assertion['status'])
+        if Metrics().enabled:
+            Metrics().record_result(result)
+        self.tally(result['id'], result['name'], len(result['assertions']), failed,
+                   result.get('retries', 0), result.get('retry_ms', 0.0), result)
+
+    def merge_stats(self, connections, throttled):
+        """
+        Add the SessionPool and RateLimiter stats of a worker process to the report
+        """
+        with self.lock:
+            for host, stats in connections.items():
+                merged = self.worker_connections.setdefault(host, {'requests': 0, 'connections': 0, 'reused': 0})
+                for key in merged:
+                    merged[key] += stats.get(key, 0)
+            for host, count in throttled.items():
+                self.worker_throttled[host] = self.worker_throttled.get(host, 0) + count
+
+    def tally(self, request_id, name, assertions, failed, retries, retry_ms, result):
+        with self.lock:
+            self.counters['requests'] += 1
+            self.counters['retries'] += retries
+            self.counters['retry_ms'] += retry_ms
+            self.counters['assertions'] += assertions
+            self.counters['failed'] += failed
+            self.counters['passed'] += assertions - failed
+            if failed:
+                self.failing[request_id] = name
+            for writer in self.writers:
+                writer.write(result)
+
+    def close_writers(self, summary=None):
+        for writer in self.writers:
+            writer.close(summary)
+        self.writers = []
+
+    def build_report(self, total=None):
+        """
+        :param total: number of requests that were selected, to report the ones never sent
+        :return:
+        """
+        logger.info("Building report...")
+        lines = []
 
-        requests_for_review = {request.id: request.name for request in self.requests.values() if len([assertion for assertion in request.assertions if assertion['status'] == False]) > 0}
+        report = {
+            "total_requests": self.counters['requests'],
+            "total_assertions": self.counters['assertions'],
+            "failed_assertions": self.counters['failed'],
+            "passed_assertions": self.counters['passed'],
+            "failing_requests": dict(sorted(self.failing.items())),
+            "retries": self.counters['retries'],
+            "retry_ms": round(self.counters['retry_ms'], 3),
+            "not_sent": total - self.counters['requests'] if total is not None else 0,
+            "connections": SessionPool().stats(),
+            "throttled": RateLimiter().stats(),
+        }
+        # The stats of the worker processes, if the requests were sharded
+        for host, stats in self.worker_connections.items():
+            merged = report['connections'].setdefault(host, {'requests': 0, 'connections': 0, 'reused': 0})
+            for key in merged:
+                merged[key] += stats[key]
+        for host, count in self.worker_throttled.items():
+            report['throttled'][host] = report['throttled'].get(host, 0) + count
+
+        lines.append(f"  > Total requests: {report['total_requests']}")
+        lines.append(f"  > Total assertions: {report['total_assertions']}")
+        lines.append(f"  > Total failed assertions: {report['failed_assertions']}")
+        lines.append(f"  > Total passed assertions: {report['passed_assertions']}")
         lines.append(f"  > Requests with failed assertions:")
-        for request_id, value in requests_for_review.items():
+        for request_id, value in report['failing_requests'].items():
             lines.append(f"    >> ({request_id}): {value}")
+        if report['retries']:
+            lines.append(f"  > Retries: {report['retries']} ({report['retry_ms']} ms lost)")
+        if report['not_sent']:
+            lines.append(f"  > Requests not sent (deadline reached or a dependency failed): {report['not_sent']}")
+
+        if report['connections']:
+            lines.append("  > Connection reuse per host:")
+            for host, stats in sorted(report['connections'].items()):
+                lines.append(f"    >> {host}: {stats['requests']} requests over {stats['connections']} connections ({stats['reused']} reused)")
+
+        if report['throttled']:
+            lines.append("  > Throttled responses (429/503) per host:")
+            for host, count in sorted(report['throttled'].items()):
+                lines.append(f"    >> {host}: {count}")
+
+        logger.log(REPORT, "\n" + "\n".join(lines))
+        return report
+
+class Index:
+    """
+    Inverted indexes of tag -> ids and suite -> ids, kept up to date as items are added
+    """
+    def __init__(self):
+        self.ids = set()
+        self.by_tag = defaultdict(set)
+        self.by_suite = defaultdict(set)
+
+    def add(self, key, tags=None, suite=None):
+        self.ids.add(key)
+        for tag in tags or []:
+            if tag:
+                self.by_tag[tag].add(key)
+        if suite:
+            self.by_suite[suite].add(key)
+
+    def select(self, tags=None, suites=None):
+        """
+        :param tags: list of tags that must all be present, or a boolean tag expression
+        :param suites: list of suites, any of them matches
+        :return: sorted list of the matching ids
+        """
+        selected = self.ids
+        if suites:
+            selected = set().union(*(self.by_suite.get(suite, set()) for suite in suites))
+        if tags:
+            expression = tags if isinstance(tags, str) else tagexpr.from_args(tags)
+            # Only the ids already selected by suite are considered, `not` included
+            selected = selected & tagexpr.select(tagexpr.compile_expression(expression), self.by_tag, selected)
+        return sorted(selected)
 
-        logger.info("\n" + "\n".join(lines))
 
 def rand(length=7):
     letters = string.ascii_letters + string.digits
@@ -156,27 +437,51 @@ def rand(length=7):
 def slugify(text):
     return text.lower().replace(' ', '-')
 
+def as_list(value):
+    if not value:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+def shard_of(key, count):
+    # crc32 rather than hash(), which changes between processes
+    return zlib.crc32(str(key).encode()) % count
+
+
+def in_shard(suite, url, by, index, count, flow=None):
+    """
+    :param by: 'suite' keeps the requests of a suite together, 'host' the requests to a host
+    :param flow: group of suites linked by dependencies, kept together whatever `by` is
+    """
+    if flow:
+        return shard_of(flow, count) == index
+    key = urlparse(url).netloc if by == 'host' else suite
+    return shard_of(key, count) == index
+
+
 def url_combos(invoke, defaults):
+    """
+    Yield the urls of a request one by one, without building the whole cross product of url_values
+    """
     if 'url' in invoke:
-        return [invoke['url']]
+        yield invoke['url']
 
     elif 'url' in defaults:
-        return [defaults['url']]
+        yield defaults['url']
 
     elif 'url_values' in invoke and 'url_template' in defaults:
         processed_dict = {k: [v] if isinstance(v, str) else v for k, v in invoke['url_values'].items()}
-        keys = processed_dict.keys()
-        value_lists = processed_dict.values()
-        combinations = list(itertools.product(*value_lists))
-        all_options = [dict(zip(keys, combo)) for combo in combinations]
-        logger.debug(f"All options are: {all_options}")
-
-        options = []
-        for option in all_options:
-            options.append(defaults['url_template'].format(**option))
-
-        return options
+        keys = list(processed_dict.keys())
+        for combo in itertools.product(*processed_dict.values()):
+            yield defaults['url_template'].format(**dict(zip(keys, combo)))
 
     else:
         logger.error("No URL provided for request")
         raise ValueError("No URL provided for request")
+
+
+def count_url_combos(invoke, defaults):
+    if 'url' in invoke or 'url' in defaults:
+        return 1
+    if 'url_values' in invoke and 'url_template' in defaults:
+        return math.prod(1 if isinstance(v, str) else len(v) for v in invoke['url_values'].values())
+    return 0
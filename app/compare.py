@@ -0,0 +1,91 @@
+from collections import Counter
+from collections.abc import Mapping
+
+
+def first_difference(expected, current, unordered=False):
+    """
+    Walk both values and stop at the first mismatch
+    :param expected:
+    :param current:
+    :param unordered: compare lists as multisets instead of sequences
+    :return: None if both values are equal, otherwise (JSON path, reason) of the first difference
+    """
+    difference = _difference(expected, current, unordered)
+    if difference is None:
+        return None
+
+    steps, reason = difference
+    # Steps are collected while unwinding, so the path is only built for a mismatch
+    path = '$' + ''.join(f"[{step}]" if isinstance(step, int) else f".{step}" for step in reversed(steps))
+    return path, reason
+
+
+def _difference(expected, current, unordered):
+    if isinstance(expected, dict):
+        if not isinstance(current, Mapping):
+            return [], f"expected an object, got <{current}>"
+        for key, value in expected.items():
+            if key not in current:
+                return [key], "missing"
+            difference = _difference(value, current[key], unordered)
+            if difference:
+                difference[0].append(key)
+                return difference
+        if len(current) != len(expected):
+            for key in current:
+                if key not in expected:
+                    return [key], f"unexpected <{current[key]}>"
+        return None
+
+    if isinstance(expected, list):
+        if not isinstance(current, list):
+            return [], f"expected a list, got <{current}>"
+        if len(expected) != len(current):
+            return [], f"expected {len(expected)} items, got {len(current)}"
+        if unordered:
+            return _unordered_difference(expected, current)
+        for index, (expected_item, current_item) in enumerate(zip(expected, current)):
+            difference = _difference(expected_item, current_item, unordered)
+            if difference:
+                difference[0].append(index)
+                return difference
+        return None
+
+    if not scalars_equal(expected, current):
+        return [], f"expected <{expected}>, got <{current}>"
+    return None
+
+
+def _unordered_difference(expected, current):
+    if all(is_scalar(item) for item in expected) and all(is_scalar(item) for item in current):
+        missing = Counter(scalar_key(item) for item in expected)
+        missing.subtract(scalar_key(item) for item in current)
+        for index, item in enumerate(expected):
+            if missing[scalar_key(item)] > 0:
+                return [index], f"no match for <{item}>"
+        return None
+
+    remaining = list(current)
+    for index, item in enumerate(expected):
+        for position, candidate in enumerate(remaining):
+            if _difference(item, candidate, True) is None:
+                del remaining[position]
+                break
+        else:
+            return [index], f"no match for <{item}>"
+    return None
+
+
+def scalars_equal(expected, current):
+    # In JSON true/false are not numbers, so 1 must not match true
+    if isinstance(expected, bool) or isinstance(current, bool):
+        return type(expected) is type(current) and expected == current
+    return expected == current
+
+
+def is_scalar(value):
+    return not isinstance(value, (dict, list))
+
+
+def scalar_key(value):
+    return type(value) is bool, value
@@ -0,0 +1,85 @@
+import hashlib
+import importlib
+import os
+import pickle
+import re
+
+from collection import Collection
+
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'http-control', 'collections')
+# Modules whose classes end up in the cache, a change in any of them invalidates it
+COMPILED_MODULES = ('agent', 'checks', 'collection', 'compare', 'graph', 'jsonpath', 'request', 'retry')
+VARIABLE = re.compile(r'\$\{(\w+)}')
+
+
+def cache_key(collection_path, env_path):
+    """
+    Hash of everything the compiled collection depends on: the collection file, the .env file,
+    the environment variables it references and the code that compiles it
+    """
+    digest = hashlib.sha256()
+    with open(collection_path, 'rb') as f:
+        source = f.read()
+    digest.update(source)
+
+    if env_path and os.path.exists(env_path):
+        with open(env_path, 'rb') as f:
+            digest.update(f.read())
+
+    for name in sorted(set(VARIABLE.findall(source.decode(errors='replace')))):
+        digest.update(f"{name}={os.environ.get(name, '')}".encode())
+
+    for name in COMPILED_MODULES:
+        module = importlib.import_module(name)
+        digest.update(f"{name}:{os.path.getmtime(module.__file__)}".encode())
+
+    return digest.hexdigest()[:32]
+
+
+def load_collection(collection_path, env_path=".env", cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Load the collection from its compiled cache, or parse it and store the result
+    :param collection_path: YAML collection file
+    :param env_path: .env file used for the substitutions
+    :param cache_dir: where compiled collections are kept, None to always parse
+    :return: the collection `defaults` section and the Collection
+    """
+    cache_path = None
+    if cache_dir:
+        key = cache_key(collection_path, env_path)
+        cache_path = os.path.join(cache_dir, f"{os.path.basename(collection_path)}-{key}.pickle")
+        try:
+            with open(cache_path, 'rb') as f:
+                defaults, state = pickle.load(f)
+            logger.debug("Compiled collection loaded: %s", cache_path)
+            collection = Collection()
+            collection.load_compiled(state)
+            return defaults, collection
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Ignoring unreadable compiled collection %s: %s", cache_path, e)
+
+    # Only needed when the compiled collection is missing or stale
+    from configobj import Config
+
+    data = Config(collection_path, env_path).items()
+    logger.debug("Configuration file loaded: %s", collection_path)
+    collection = Collection(data)
+    defaults = data.get('defaults', {}) or {}
+
+    if cache_path:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            temporary = f"{cache_path}.tmp"
+            # The defaults include the OAuth2 client secrets, keep the file private to the user
+            with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+                pickle.dump((defaults, collection.compiled_state()), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, cache_path)
+        except (OSError, pickle.PicklingError) as e:
+            logger.warning("Could not write the compiled collection %s: %s", cache_path, e)
+
+    return defaults, collection
@@ -0,0 +1,137 @@
+import os
+import signal
+import threading
+import time
+
+from agent import Agent
+from compiled import load_collection
+from executor import Executor
+from metrics import Metrics
+from ratelimit import RateLimiter
+from tokens import TokenStore
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+# Seconds between the checks of the collection file for changes
+RELOAD_CHECK_INTERVAL = 5
+
+
+class Daemon:
+    """
+    Run the collection again and again in one process, so the parsed collection, the OAuth2
+    tokens and the pooled connections stay warm between runs. Each suite runs on its own
+    schedule: the `interval` of its requests, or the default interval. The collection is
+    loaded again when the collection or .env file changes on disk.
+    """
+    def __init__(self, collection_path, env_path=".env", cache_dir=None, interval=60, tags=None, suites=None,
+                 concurrency=1, deadline=None, writer=None, metrics_file=None):
+        self.collection_path = collection_path
+        self.env_path = env_path
+        self.cache_dir = cache_dir
+        self.interval = interval
+        self.tags = tags
+        self.suites = suites
+        self.concurrency = concurrency
+        self.deadline = deadline
+        # JsonLinesWriter kept open across the runs, with a summary line after each of them
+        self.writer = writer
+        # Prometheus textfile rewritten after each run
+        self.metrics_file = metrics_file
+        self.stopping = threading.Event()
+        self.collection = None
+        self.mtimes = None
+        self.schedule = {}
+
+    def stop(self, *args):
+        logger.info("Stopping after the current run")
+        self.stopping.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        self.reload()
+        checked = time.monotonic()
+
+        while not self.stopping.is_set():
+            now = time.monotonic()
+            if now - checked >= RELOAD_CHECK_INTERVAL:
+                checked = now
+                if self.mtimes != self.file_mtimes():
+                    self.safe_reload()
+
+            due = sorted(suite for suite, (_, next_run) in self.schedule.items() if next_run <= now)
+            if due:
+                self.run_suites(due)
+                for suite in due:
+                    interval, next_run = self.schedule[suite]
+                    # Skip the runs that were missed, rather than running them back to back
+                    while next_run <= time.monotonic():
+                        next_run += interval
+                    self.schedule[suite] = (interval, next_run)
+                continue
+
+            next_run = min((next_run for _, next_run in self.schedule.values()), default=now + self.interval)
+            self.stopping.wait(max(0.0, min(next_run - now, RELOAD_CHECK_INTERVAL)))
+
+        if self.writer:
+            self.writer.close()
+
+    def file_mtimes(self):
+        return tuple(os.path.getmtime(path) if path and os.path.exists(path) else None
+                     for path in (self.collection_path, self.env_path))
+
+    def safe_reload(self):
+        """
+        Reload, or keep running the previous version of the collection if the new one is invalid
+        """
+        # The Collection is a singleton, a failed load leaves it half initialized
+        state = self.collection.compiled_state()
+        try:
+            self.reload()
+        except Exception as e:
+            logger.error("Could not reload %s, keeping the previous version: %s", self.collection_path, e)
+            self.collection.__init__()
+            self.collection.load_compiled(state)
+            if self.writer:
+                self.collection.add_writer(self.writer)
+
+    def reload(self):
+        """
+        Load the collection and work out the schedule of each selected suite. Suites that
+        were already scheduled keep their next run time.
+        """
+        self.mtimes = self.file_mtimes()
+        defaults, self.collection = load_collection(self.collection_path, self.env_path, self.cache_dir)
+        logger.info("Collection loaded: %s", self.collection_path)
+        TokenStore(defaults.get('oauth2', {}) or {}, defaults.get('token_cache')).fetch(
+            self.collection.providers(self.tags, self.suites))
+        if self.writer:
+            self.collection.add_writer(self.writer)
+
+        intervals = {}
+        for template in self.collection.select_templates(self.tags, self.suites):
+            attributes = template['attributes']
+            interval = float(attributes.get('interval') or self.interval)
+            suite = attributes['suite']
+            intervals[suite] = min(interval, intervals.get(suite, interval))
+
+        now = time.monotonic()
+        self.schedule = {suite: (interval, self.schedule.get(suite, (None, now))[1])
+                         for suite, interval in intervals.items()}
+        logger.info("Scheduled %s suites", len(self.schedule))
+
+    def run_suites(self, suites):
+        collection = self.collection
+        total = collection.count(self.tags, suites)
+        logger.info("Running %s requests of %s suites", total, len(suites))
+        limiter = RateLimiter() if RateLimiter().enabled else None
+        executor = Executor(Agent(), self.concurrency, on_result=collection.record, limiter=limiter,
+                            deadline=self.deadline, graph=collection.graph(self.tags, suites))
+        executor.run(collection.iter_requests(self.tags, suites), total)
+
+        report = collection.build_report(total)
+        if self.writer:
+            self.writer.write_summary(report)
+        if self.metrics_file:
+            Metrics().write_textfile(self.metrics_file)
+        collection.reset_results()
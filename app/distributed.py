@@ -0,0 +1,276 @@
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+import globals
+
+# The app modules are imported by the functions below, once the worker process has the
+# same logging settings as the coordinator (see configure_worker)
+
+# Times a shard is sent again after its worker died, before it is reported as lost
+MAX_SHARD_ATTEMPTS = 3
+# Frames are a 4 bytes big-endian length followed by that many bytes of UTF-8 JSON
+FRAME_HEADER = struct.Struct('>I')
+# What a remote worker takes from a coordinator, anything else in the spec is ignored
+REMOTE_SPEC_KEYS = ('collection_text', 'env_text', 'tags', 'suites', 'by', 'index', 'count', 'concurrency', 'deadline')
+
+
+def configure_worker(verbose, quiet, structured):
+    globals.verbose = verbose
+    globals.quiet = quiet
+    globals.structured = structured
+
+
+class ShardWriter:
+    """
+    Keep the results of a shard in memory, to send them back to the coordinator
+    """
+    def __init__(self):
+        self.results = []
+
+    def write(self, result):
+        self.results.append(result)
+
+    def close(self, summary=None):
+        pass
+
+
+def run_shard(spec):
+    """
+    Load the collection and process the requests of one shard, in a worker process
+    :param spec: dict with the collection and env paths (or their contents, for remote
+    workers), the selection (tags, suites), the shard (by, index, count) and the executor
+    settings (concurrency, deadline)
+    :return: the result_of of each request, and the connection and throttling stats
+    """
+    from agent import Agent
+    from compiled import DEFAULT_CACHE_DIR, load_collection
+    from executor import Executor
+    from ratelimit import RateLimiter
+    from session import SessionPool
+    from tokens import TokenStore
+
+    with tempfile.TemporaryDirectory() as directory:
+        collection_path, env_path = spec['collection'], spec['env']
+        # Remote workers get the files themselves
+        if 'collection_text' in spec:
+            collection_path = os.path.join(directory, os.path.basename(collection_path))
+            with open(collection_path, 'w') as f:
+                f.write(spec['collection_text'])
+            env_path = os.path.join(directory, '.env')
+            with open(env_path, 'w') as f:
+                f.write(spec.get('env_text') or '')
+        defaults, collection = load_collection(collection_path, env_path, spec.get('cache_dir', DEFAULT_CACHE_DIR))
+
+    shard = (spec['by'], spec['index'], spec['count'])
+    TokenStore(defaults.get('oauth2', {}) or {}, defaults.get('token_cache')).fetch(
+        collection.providers(spec['tags'], spec['suites']))
+
+    writer = ShardWriter()
+    collection.add_writer(writer)
+    limiter = RateLimiter() if RateLimiter().enabled else None
+    executor = Executor(Agent(), spec['concurrency'], on_result=collection.record, limiter=limiter,
+                        deadline=spec.get('deadline'), graph=collection.graph(spec['tags'], spec['suites'], shard))
+    executor.run(collection.iter_requests(spec['tags'], spec['suites'], shard))
+    outcome = {
+        'results': writer.results,
+        'connections': SessionPool().stats(),
+        'throttled': RateLimiter().stats(),
+    }
+    # The process may get another shard, its stats must not count twice
+    SessionPool().close()
+    return outcome
+
+
+class Coordinator:
+    """
+    Split the selected requests in shards, by suite or by host, and process them in a pool
+    of worker processes and on remote workers. The results are merged into the collection
+    as each shard finishes. A shard whose worker dies is queued again.
+    """
+    def __init__(self, spec, shards, processes=0, remotes=()):
+        self.spec = spec
+        self.shards = shards
+        self.processes = processes
+        self.remotes = list(remotes)
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def run(self, collection):
+        from logger import setup_logger
+        logger = setup_logger(__name__)
+
+        if self.processes:
+            self.pool = self.new_pool()
+        pending = queue.Queue()
+        finished = queue.Queue()
+        for index in range(self.shards):
+            pending.put((index, 1))
+
+        runners = [threading.Thread(target=self.runner, args=(self.run_local, pending, finished, logger), daemon=True)
+                   for _ in range(self.processes)]
+        runners += [threading.Thread(target=self.runner, args=(self.remote_runner(address), pending, finished, logger),
+                                     daemon=True) for address in self.remotes]
+        if not runners:
+            raise ValueError("Sharding needs at least one worker process or remote worker")
+        logger.info("Running %s shards by %s on %s processes and %s remote workers",
+                    self.shards, self.spec['by'], self.processes, len(self.remotes))
+        for runner in runners:
+            runner.start()
+
+        try:
+            for _ in range(self.shards):
+                index, outcome = finished.get()
+                if outcome is None:
+                    logger.error("Shard %s lost after %s attempts", index, MAX_SHARD_ATTEMPTS)
+                    continue
+                for result in outcome['results']:
+                    collection.merge(result)
+                collection.merge_stats(outcome['connections'], outcome['throttled'])
+                logger.info("Shard %s done: %s requests", index, len(outcome['results']))
+        finally:
+            for _ in runners:
+                pending.put(None)
+            if self.pool:
+                self.pool.shutdown()
+
+    def runner(self, run, pending, finished, logger):
+        while True:
+            item = pending.get()
+            if item is None:
+                return
+            index, attempt = item
+            try:
+                finished.put((index, run(dict(self.spec, index=index, count=self.shards))))
+            except Exception as e:
+                # Whatever the error, the shard must end up in `finished`, or run() waits forever
+                logger.warning("Shard %s failed on attempt %s: %s", index, attempt, e)
+                if attempt < MAX_SHARD_ATTEMPTS:
+                    pending.put((index, attempt + 1))
+                else:
+                    finished.put((index, None))
+
+    def new_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            # Threads are already running here (logging, runners), forking would copy their locks
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=configure_worker,
+            initargs=(globals.verbose, globals.quiet, globals.structured),
+        )
+
+    def run_local(self, spec):
+        pool = self.pool
+        try:
+            return pool.submit(run_shard, spec).result()
+        except BrokenProcessPool:
+            # A worker died and took the pool with it, the shards in flight are queued again
+            with self.lock:
+                if self.pool is pool:
+                    pool.shutdown(wait=False)
+                    self.pool = self.new_pool()
+            raise
+
+    def remote_runner(self, address):
+        host, _, port = address.rpartition(':')
+        remote_spec = dict(self.spec)
+        with open(self.spec['collection']) as f:
+            remote_spec['collection_text'] = f.read()
+        if self.spec['env'] and os.path.exists(self.spec['env']):
+            with open(self.spec['env']) as f:
+                remote_spec['env_text'] = f.read()
+        remote_spec.pop('cache_dir', None)
+
+        def run(spec):
+            with socket.create_connection((host or 'localhost', int(port))) as connection:
+                send_frame(connection, dict(remote_spec, index=spec['index'], count=spec['count']))
+                answer = receive_frame(connection)
+            if not answer.get('ok'):
+                raise ValueError(f"Remote worker {address}: {answer.get('error')}")
+            return answer['result']
+        return run
+
+
+def send_frame(connection, message):
+    payload = json.dumps(message, default=str).encode()
+    connection.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def receive_frame(connection):
+    header = receive_exactly(connection, FRAME_HEADER.size)
+    return json.loads(receive_exactly(connection, FRAME_HEADER.unpack(header)[0]))
+
+
+def receive_exactly(connection, size):
+    chunks = []
+    while size:
+        chunk = connection.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Connection closed in the middle of a frame")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def remote_spec(spec):
+    """
+    Keep only what a remote worker may be sent: the contents of the files, never a path of
+    the worker host to open, nor a cache directory to unpickle collections from
+    """
+    if not isinstance(spec, dict) or not isinstance(spec.get('collection_text'), str):
+        raise ValueError("The shard spec must include the collection itself (collection_text)")
+    safe = {key: spec.get(key) for key in REMOTE_SPEC_KEYS}
+    safe.update({'collection': 'collection.yaml', 'env': None, 'cache_dir': None})
+    return safe
+
+
+class WorkerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            spec = remote_spec(receive_frame(self.request))
+            result = self.server.pool.submit(run_shard, spec).result()
+            answer = {'ok': True, 'result': result}
+        except BrokenProcessPool as e:
+            self.server.pool = self.server.new_pool()
+            answer = {'ok': False, 'error': f"worker process died: {e}"}
+        except Exception as e:
+            answer = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        send_frame(self.request, answer)
+
+
+def serve_worker(address, processes=1):
+    """
+    Process the shards sent by coordinators on other hosts. The protocol has neither
+    authentication nor encryption, only listen on trusted networks.
+    :param address: host:port to listen on, the loopback interface if the host is left out
+    :param processes: shards processed at the same time, each in its own process
+    """
+    from logger import setup_logger
+    logger = setup_logger(__name__)
+
+    host, _, port = address.rpartition(':')
+    host = host or '127.0.0.1'
+
+    def new_pool():
+        return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=configure_worker,
+                                   initargs=(globals.verbose, globals.quiet, globals.structured))
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    with socketserver.ThreadingTCPServer((host, int(port)), WorkerHandler) as server:
+        server.daemon_threads = True
+        server.new_pool = new_pool
+        server.pool = new_pool()
+        logger.info("Worker listening on %s:%s with %s processes", host, port, processes)
+        try:
+            server.serve_forever()
+        finally:
+            server.pool.shutdown()
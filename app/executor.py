@@ -0,0 +1,206 @@
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from graph import WAITING
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+
+class Executor:
+    def __init__(self, agent, concurrency=1, on_result=None, recorder=None, replayer=None, limiter=None, deadline=None,
+                 graph=None):
+        self.agent = agent
+        self.concurrency = max(1, concurrency or 1)
+        # Called with each request once its assertions are known, e.g. Collection.record
+        self.on_result = on_result
+        # Store every outcome in an archive, or take the outcomes from one instead of the network
+        self.recorder = recorder
+        self.replayer = replayer
+        # RateLimiter applying the per host and per suite limits, if any are configured
+        self.limiter = limiter
+        # Seconds the whole run may take, no request is sent after that
+        self.deadline = deadline
+        # DependencyGraph holding back the requests that use values captured by other requests
+        self.graph = graph
+        self.expires = None
+        self.timed_out = False
+
+    def run(self, requests, total=None):
+        """
+        Invoke and evaluate the requests as they come out of the iterable. Results are stored
+        on each request, so the report order does not depend on the order in which the
+        responses arrive.
+        :param requests: iterable of requests, usually the lazy Collection.iter_requests
+        :param total: number of requests expected, only used for logging
+        :return:
+        """
+        self.expires = time.monotonic() + self.deadline if self.deadline else None
+        if self.graph:
+            requests = self.graph.schedule(requests)
+        if self.concurrency == 1:
+            for request in requests:
+                if self.expired():
+                    return
+                self.process(request, total)
+            return
+
+        logger.info(f"Dispatching requests with concurrency {self.concurrency}")
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="executor") as pool:
+            if self.limiter:
+                self.dispatch(requests, total, pool)
+                return
+
+            # Only pull a few requests ahead of the workers, so the expansion stays lazy
+            pending = set()
+            for request in requests:
+                if self.expired():
+                    break
+                if request is WAITING:
+                    # The remaining requests depend on the ones in flight
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                    continue
+                pending.add(pool.submit(self.process, request, total))
+                if len(pending) >= self.concurrency * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        # Surface unexpected errors from the worker threads
+                        future.result()
+
+            for future in pending:
+                future.result()
+
+    def dispatch(self, requests, total, pool):
+        """
+        Keep a queue of requests per host and take turns between the hosts that are ready,
+        so a slow or throttled host does not hold back the requests to the others
+        """
+        queues = {}
+        buffered = 0
+        pending = {}
+        requests = iter(requests)
+        exhausted = False
+        while True:
+            if self.expired():
+                # Let the requests in flight finish, within their timeouts cut to the deadline.
+                # Throttled requests are not sent again, but their last response still counts.
+                for queue in queues.values():
+                    for request, attempt in queue:
+                        if attempt:
+                            self.evaluate(request)
+                queues.clear()
+                exhausted = True
+                if not pending:
+                    return
+            # Look a few requests ahead, so there is something to send to the other hosts
+            while not exhausted and buffered < self.concurrency * 4:
+                request = next(requests, None)
+                if request is None:
+                    exhausted = True
+                    break
+                if request is WAITING:
+                    break
+                queues.setdefault(self.limiter.host_of(request), deque()).append((request, 0))
+                buffered += 1
+
+            # One request per host and per pass, until the hosts are all busy or throttled
+            submitted = True
+            wait_for = None
+            while submitted and len(pending) < self.concurrency:
+                submitted = False
+                wait_for = None
+                for host in list(queues):
+                    if len(pending) >= self.concurrency:
+                        break
+                    request, attempt = queues[host][0]
+                    delay = self.limiter.try_acquire(request)
+                    if delay == 0:
+                        queue = queues.pop(host)
+                        queue.popleft()
+                        buffered -= 1
+                        # Back of the line for this host
+                        if queue:
+                            queues[host] = queue
+                        pending[pool.submit(self.attempt, request, attempt, total)] = request
+                        submitted = True
+                    elif delay is not None:
+                        wait_for = delay if wait_for is None else min(wait_for, delay)
+
+            if not pending:
+                if exhausted and not queues:
+                    return
+                if wait_for is None:
+                    # Only possible if a limit does not allow any request in flight
+                    raise RuntimeError("Rate limits do not allow any request to be sent")
+                # Nothing in flight to wait for, wait() would return at once
+                if self.expires is not None:
+                    wait_for = min(wait_for, max(self.expires - time.monotonic(), 0))
+                time.sleep(wait_for)
+                continue
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            for future in done:
+                request = pending.pop(future)
+                next_attempt = future.result()
+                if next_attempt is not None:
+                    # The host is paused by the limiter, the request goes first once it resumes
+                    queues.setdefault(self.limiter.host_of(request), deque()).appendleft((request, next_attempt))
+                    buffered += 1
+
+    def attempt(self, request, attempt, total=None):
+        """
+        Send the request once, and evaluate it unless it was throttled and should be sent again
+        :return: None, or the number of the next attempt
+        """
+        try:
+            self.fetch(request, total)
+        finally:
+            retry_in = self.limiter.release(request, request.response, attempt)
+        if retry_in is not None:
+            return attempt + 1
+        self.evaluate(request)
+        return None
+
+    def process(self, request, total=None):
+        attempt = 0
+        while self.limiter:
+            if attempt and self.expired():
+                # Throttled, and there is no time left to send it again
+                return self.evaluate(request)
+            self.limiter.acquire(request)
+            if self.attempt(request, attempt, total) is None:
+                return request
+            attempt += 1
+
+        self.fetch(request, total)
+        return self.evaluate(request)
+
+    def fetch(self, request, total=None):
+        logger.info("New request!\n    Processing %s/%s - %s", request.id, total or '?', request.name)
+        if self.replayer:
+            request.response = self.replayer.get(request)
+        else:
+            # The whole body is recorded, so it can be asserted on later
+            request.invoke(read_body=True if self.recorder else None, deadline=self.expires)
+            if self.recorder:
+                self.recorder.add(request, request.response)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Response message: %s", request.response['body'])
+
+    def expired(self):
+        if self.expires is None or time.monotonic() < self.expires:
+            return False
+        if not self.timed_out:
+            logger.warning("Run deadline of %ss reached, the remaining requests are not sent", self.deadline)
+            self.timed_out = True
+        return True
+
+    def evaluate(self, request):
+        request.assertions = self.agent.evaluate_response(request)
+        if self.graph:
+            self.graph.done(request)
+        if self.on_result:
+            self.on_result(request)
+        return request
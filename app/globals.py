@@ -1,3 +1,7 @@
 verbose = 0
 token = None
-tokens = {}
\ No newline at end of file
+tokens = {}
+
+# Logging modes, see logger.setup_logger
+quiet = False
+structured = False
@@ -0,0 +1,272 @@
+import threading
+from collections import defaultdict
+
+from checks import BODY_PATH_PREFIX, BODY_PROPERTIES, RESPONSE_PROPERTIES
+from jsonpath import PathSet
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+# Yielded by DependencyGraph.schedule when no request can start before one in flight is done
+WAITING = object()
+
+# Sources of a captured value
+PROPERTY = 'property'
+HEADER = 'header'
+PATH = 'path'
+HEADERS_PREFIX = 'headers.'
+
+
+class Captures:
+    """
+    The compiled form of a `capture` block: the variables to take from a response, each from
+    a response property, a header (`headers.<name>`) or a body path (`body.id`, `body.$.items[0].id`)
+    """
+    def __init__(self, sources, paths):
+        self.sources = sources
+        self.paths = paths
+        self.needs_body = len(paths) > 0 or any(key in BODY_PROPERTIES for kind, key in sources.values()
+                                                if kind == PROPERTY)
+
+    @property
+    def names(self):
+        return set(self.sources)
+
+    def resolve(self, response):
+        """
+        :return: dict of variable -> value, for the variables found in the response
+        """
+        found = self.paths.resolve(response.get('body')) if len(self.paths) else {}
+        values = {}
+        for name, (kind, key) in self.sources.items():
+            if kind == PATH:
+                value = found.get(key)
+            elif kind == HEADER:
+                value = next((value for header, value in (response.get('headers') or {}).items()
+                              if header.lower() == key), None)
+            else:
+                value = response.get(key)
+            if value is not None and value != "":
+                values[name] = value
+        return values
+
+
+def compile_captures(capture):
+    """
+    :param capture: dict of variable -> where to take its value from
+    :return: Captures, or None if there is nothing to capture
+    """
+    if not capture:
+        return None
+    if not isinstance(capture, dict):
+        raise ValueError(f"Captures must be a mapping of variable -> response property, got <{capture}>")
+
+    sources = {}
+    paths = PathSet()
+    for name, source in capture.items():
+        if not str(name).isidentifier():
+            raise ValueError(f"Invalid variable name <{name}>")
+        source = str(source)
+        if source.startswith(BODY_PATH_PREFIX):
+            # body.id is short for body.$.id
+            path = source[len(BODY_PATH_PREFIX):]
+            path = path if path.startswith('$') else f"$.{path}"
+            try:
+                paths.add(path)
+            except ValueError as e:
+                raise ValueError(f"Invalid body path <{source}> for <{name}>: {e}")
+            sources[name] = (PATH, path)
+        elif source.startswith(HEADERS_PREFIX):
+            sources[name] = (HEADER, source[len(HEADERS_PREFIX):].lower())
+        elif source in RESPONSE_PROPERTIES:
+            sources[name] = (PROPERTY, source)
+        else:
+            raise ValueError(f"Unknown response property <{source}> for <{name}>")
+    return Captures(sources, paths)
+
+
+def check_dependencies(dependencies, suites):
+    """
+    Fail on dependencies to unknown suites and on cycles
+    :param dependencies: suite -> set of the suites it depends on
+    :param suites: all the suites of the collection
+    """
+    for suite, required in dependencies.items():
+        unknown = required - set(suites)
+        if unknown:
+            raise ValueError(f"<{suite}> depends on unknown requests: {sorted(unknown)}")
+    for suite in dependencies:
+        if suite in ancestors(dependencies, suite):
+            raise ValueError(f"<{suite}> depends on itself, through {ancestors(dependencies, suite)}")
+
+
+def ancestors(dependencies, suite):
+    """
+    :return: the suites a suite depends on, directly or not, each one after its own dependencies
+    """
+    ordered = []
+    visiting = set()
+
+    def visit(current):
+        for dependency in sorted(dependencies.get(current, ())):
+            if dependency in visiting:
+                continue
+            visiting.add(dependency)
+            visit(dependency)
+            ordered.append(dependency)
+
+    visit(suite)
+    return ordered
+
+
+def flows_of(dependencies):
+    """
+    Group the suites linked by dependencies, so they can be kept in the same shard
+    :return: suite -> name of the first suite of its group, for the suites in a group only
+    """
+    parent = {}
+
+    def root(suite):
+        while parent.setdefault(suite, suite) != suite:
+            suite = parent[suite]
+        return suite
+
+    for suite, required in dependencies.items():
+        for dependency in required:
+            first, second = sorted((root(suite), root(dependency)))
+            parent[second] = first
+    return {suite: root(suite) for suite in parent}
+
+
+class DependencyGraph:
+    """
+    Suites that need the values captured by other suites. A suite is started once all the
+    suites it depends on are done, while the requests that do not depend on anything go on,
+    so the independent branches of the graph run concurrently.
+    """
+    def __init__(self, dependencies, counts, captures):
+        """
+        :param dependencies: suite -> set of the suites it depends on
+        :param counts: requests to expect from each suite the others depend on
+        :param captures: suite -> names of the variables that suite must capture
+        """
+        self.dependencies = dependencies
+        self.remaining = dict(counts)
+        self.expected = captures
+        # suite -> variable -> (request id, value), the last request of an expansion wins
+        self.captured = defaultdict(dict)
+        # A suite that has no requests cannot capture anything
+        self.failed = {suite for suite, count in counts.items() if not count and captures.get(suite)}
+        self.lock = threading.Lock()
+        self.started = 0
+        self.finished = 0
+
+    def schedule(self, requests):
+        """
+        Yield the requests as soon as the suites they depend on are done, with their variables
+        substituted. The requests that have to wait are kept aside, and WAITING is yielded
+        when they are all that is left and some requests are still in flight.
+        :param requests: iterable of requests, usually the lazy Collection.iter_requests
+        """
+        parked = defaultdict(list)
+        for request in requests:
+            yield from self.release(parked)
+            ready = self.ready(request.suite)
+            if ready is None:
+                parked[request.suite].append(request)
+            elif ready:
+                yield self.start(request)
+            else:
+                self.skip(request)
+
+        while parked:
+            # Read before the release: a request done in between would release its dependents
+            # next time, while nothing in flight now means nothing can release them anymore
+            with self.lock:
+                in_flight = self.started > self.finished
+            released = list(self.release(parked))
+            if released:
+                yield from released
+            elif in_flight:
+                yield WAITING
+            else:
+                # Only possible if a dependency has fewer requests than counted
+                for suite, waiting in parked.items():
+                    for request in waiting:
+                        self.skip(request)
+                return
+
+    def release(self, parked):
+        for suite in list(parked):
+            ready = self.ready(suite)
+            if ready is None:
+                continue
+            for request in parked.pop(suite):
+                if ready:
+                    yield self.start(request)
+                else:
+                    self.skip(request)
+
+    def ready(self, suite):
+        """
+        :return: True if the requests of the suite can be sent, False if they never will
+        because a dependency failed, None if they have to wait
+        """
+        required = self.dependencies.get(suite)
+        if not required:
+            return True
+        with self.lock:
+            if any(self.remaining.get(dependency) for dependency in required):
+                return None
+            return not any(dependency in self.failed for dependency in required)
+
+    def start(self, request):
+        variables = self.variables(request.suite)
+        if variables:
+            request.bind(variables)
+        with self.lock:
+            self.started += 1
+        return request
+
+    def variables(self, suite):
+        """
+        The values captured by the suites a suite depends on, directly or not
+        """
+        variables = {}
+        with self.lock:
+            for dependency in ancestors(self.dependencies, suite):
+                variables.update({name: value for name, (_, value) in self.captured[dependency].items()})
+        return variables
+
+    def done(self, request):
+        """
+        Take the captures of a request once it is evaluated, and release its dependents when
+        it was the last request of its suite
+        """
+        values = {}
+        if request.suite in self.remaining and request.capture:
+            values = request.capture.resolve(request.response or {})
+        with self.lock:
+            self.finished += 1
+            self.complete(request, values)
+
+    def skip(self, request):
+        logger.error("Request %s not sent: a request it depends on failed", request.id)
+        with self.lock:
+            self.failed.add(request.suite)
+            self.complete(request, {})
+
+    def complete(self, request, values):
+        suite = request.suite
+        if suite not in self.remaining:
+            return
+        captured = self.captured[suite]
+        for name, value in values.items():
+            if request.id >= captured.get(name, (0, None))[0]:
+                captured[name] = (request.id, value)
+        self.remaining[suite] -= 1
+        if self.remaining[suite] <= 0:
+            missing = self.expected.get(suite, set()) - set(captured)
+            if missing and suite not in self.failed:
+                logger.error("<%s> did not capture %s, the requests depending on it are not sent", suite,
+                             sorted(missing))
+                self.failed.add(suite)
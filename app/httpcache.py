@@ -0,0 +1,162 @@
+import json
+import sqlite3
+import threading
+import time
+
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+DEFAULT_PATH = '.http_cache.sqlite'
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+CACHEABLE_METHODS = ('GET', 'HEAD')
+# Bumped when the table changes, older cache files are emptied
+SCHEMA_VERSION = 1
+
+
+class CacheEntry:
+    __slots__ = ('status_code', 'headers', 'body', 'encoding', 'etag', 'last_modified')
+
+    def __init__(self, status_code, headers, body, encoding, etag, last_modified):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.encoding = encoding
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+# Singleton class
+class HttpCache:
+    """
+    Persistent cache of responses with validators (ETag / Last-Modified), so unchanged
+    resources are revalidated with a conditional request instead of downloaded again.
+    Entries are keyed by method and url, with one variant per set of values of the headers
+    listed in the Vary of the response, so requests only match the variant of their own values.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(HttpCache, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, 'enabled'):
+            self.enabled = False
+            self.connection = None
+            self.lock = threading.Lock()
+
+    def configure(self, settings, path=None):
+        """
+        Open the cache described by the `defaults.http_cache` section. It stays disabled
+        unless `enabled` is set there or a path is given on the command line.
+        :param settings: dict with optional `enabled`, `path`, `max_entries` and `max_bytes` keys
+        :param path: overrides the configured path and enables the cache
+        :return:
+        """
+        settings = settings or {}
+        if not (path or settings.get('enabled')):
+            return
+
+        self.path = path or settings.get('path', DEFAULT_PATH)
+        self.max_entries = int(settings.get('max_entries', DEFAULT_MAX_ENTRIES))
+        self.max_bytes = int(settings.get('max_bytes', DEFAULT_MAX_BYTES))
+
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.connection.execute("DROP TABLE IF EXISTS entries")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT, vary TEXT, etag TEXT, last_modified TEXT, status INTEGER,"
+            " headers TEXT, body BLOB, encoding TEXT, size INTEGER, used REAL, PRIMARY KEY (key, vary))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        self.entries, self.size = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        self.enabled = True
+        logger.info("HTTP cache enabled: %s (%s entries)", self.path, self.entries)
+
+    def lookup(self, method, url, headers):
+        if not self.enabled or method.upper() not in CACHEABLE_METHODS:
+            return None
+
+        key = f"{method.upper()} {url}"
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT vary, etag, last_modified, status, headers, body, encoding FROM entries WHERE key = ?",
+                (key,)).fetchall()
+            # The variant whose Vary headers have the values of this request
+            row = next((row for row in rows if matches(json.loads(row[0]), headers)), None)
+            if row is None:
+                return None
+            vary, etag, last_modified, status, cached_headers, body, encoding = row
+            # Committed with the next store or on close
+            self.connection.execute("UPDATE entries SET used = ? WHERE key = ? AND vary = ?", (time.time(), key, vary))
+
+        return CacheEntry(status, json.loads(cached_headers), body, encoding, etag, last_modified)
+
+    def store(self, method, url, headers, response, content):
+        """
+        Keep a full response if it carries a validator and may be stored
+        :param headers: headers of the request, to remember the values of the Vary headers
+        :param response: the requests response
+        :param content: the body, as bytes
+        :return:
+        """
+        if not self.enabled or method.upper() not in CACHEABLE_METHODS or response.status_code != 200:
+            return
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+        vary = [name.strip().lower() for name in response.headers.get('vary', '').split(',') if name.strip()]
+        if not (etag or last_modified) or '*' in vary or 'no-store' in response.headers.get('cache-control', ''):
+            return
+
+        key = f"{method.upper()} {url}"
+        size = len(content)
+        if size > self.max_bytes:
+            return
+
+        variant = json.dumps(vary_values(vary, headers), sort_keys=True)
+        with self.lock:
+            previous = self.connection.execute("SELECT size FROM entries WHERE key = ? AND vary = ?",
+                                               (key, variant)).fetchone()
+            if previous:
+                self.entries -= 1
+                self.size -= previous[0]
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, variant, etag, last_modified, response.status_code,
+                 json.dumps(dict(response.headers)), content, response.encoding, size, time.time()))
+            self.entries += 1
+            self.size += size
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        # Least recently used entries go first
+        while self.entries > self.max_entries or self.size > self.max_bytes:
+            row = self.connection.execute("SELECT rowid, size FROM entries ORDER BY used LIMIT 1").fetchone()
+            if row is None:
+                break
+            self.connection.execute("DELETE FROM entries WHERE rowid = ?", (row[0],))
+            self.entries -= 1
+            self.size -= row[1]
+
+    def close(self):
+        if self.connection is not None:
+            with self.lock:
+                self.connection.commit()
+                self.connection.close()
+            self.connection = None
+        self.enabled = False
+
+
+def matches(variant, headers):
+    return variant == vary_values(variant, headers)
+
+
+def vary_values(names, headers):
+    lowered = {key.lower(): value for key, value in (headers or {}).items()}
+    return {name: lowered.get(name) for name in names}
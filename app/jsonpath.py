@@ -0,0 +1,101 @@
+import re
+from functools import lru_cache
+
+# Steps of a compiled path
+KEY = 'key'
+INDEX = 'index'
+WILDCARD = 'wildcard'
+
+TOKENS = re.compile(r"""
+    \.(?P<key>[^.\[\]]+)             # .name or .*
+  | \[(?P<index>-?\d+)]              # [0]
+  | \[(?P<star>\*)]                  # [*]
+  | \[(?P<quote>['"])(?P<quoted>.*?)(?P=quote)]   # ['name']
+""", re.VERBOSE)
+
+
+@lru_cache(maxsize=None)
+def compile_path(expression):
+    """
+    Compile a JSONPath subset ($, .name, ['name'], [n], [*], .*) into a tuple of steps
+    :param expression: e.g. "$.items[*].id"
+    :return:
+    """
+    if not expression.startswith('$'):
+        raise ValueError(f"Path must start with '$', got <{expression}>")
+
+    steps = []
+    position = 1
+    while position < len(expression):
+        match = TOKENS.match(expression, position)
+        if not match:
+            raise ValueError(f"Invalid path <{expression}> at position {position}")
+        if match.group('key') == '*' or match.group('star'):
+            steps.append((WILDCARD, None))
+        elif match.group('key') is not None:
+            steps.append((KEY, match.group('key')))
+        elif match.group('index') is not None:
+            steps.append((INDEX, int(match.group('index'))))
+        else:
+            steps.append((KEY, match.group('quoted')))
+        position = match.end()
+    return tuple(steps)
+
+
+class PathSet:
+    """
+    A trie of compiled paths, so all the paths asserted on one document are answered
+    with a single traversal of it
+    """
+    def __init__(self):
+        self.root = {}
+        self.paths = {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, expression):
+        steps = compile_path(expression)
+        self.paths[expression] = any(kind == WILDCARD for kind, _ in steps)
+        node = self.root
+        for step in steps:
+            node = node.setdefault(step, {})
+        node.setdefault(None, []).append(expression)
+
+    def resolve(self, document):
+        """
+        :return: dict of expression -> value. Paths with a wildcard give the list of all
+        matches, the others give the value or None when it does not exist.
+        """
+        found = {}
+        self._walk(self.root, document, found)
+
+        values = {}
+        for expression, wildcard in self.paths.items():
+            matches = found.get(expression, [])
+            if wildcard:
+                values[expression] = matches
+            else:
+                values[expression] = matches[0] if matches else None
+        return values
+
+    def _walk(self, node, value, found):
+        for step, child in node.items():
+            if step is None:
+                for expression in child:
+                    found.setdefault(expression, []).append(value)
+                continue
+
+            kind, key = step
+            if kind == KEY:
+                if isinstance(value, dict) and key in value:
+                    self._walk(child, value[key], found)
+            elif kind == INDEX:
+                if isinstance(value, list) and -len(value) <= key < len(value):
+                    self._walk(child, value[key], found)
+            elif isinstance(value, dict):
+                for item in value.values():
+                    self._walk(child, item, found)
+            elif isinstance(value, list):
+                for item in value:
+                    self._walk(child, item, found)
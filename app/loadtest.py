@@ -0,0 +1,126 @@
+import math
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from logger import REPORT, setup_logger
+logger = setup_logger(__name__)
+
+
+class SuiteStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+    def record(self, latency_ms, failed):
+        self.latencies.append(latency_ms)
+        if failed:
+            self.errors += 1
+
+    def summary(self, wall_time):
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        return {
+            "requests": count,
+            "throughput": count / wall_time if wall_time else 0.0,
+            "error_rate": self.errors / count if count else 0.0,
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else 0.0,
+        }
+
+
+class LoadRunner:
+    """
+    Replay the working set at a fixed arrival rate (open model), independently of how fast
+    the responses come back. Latencies are measured from the scheduled send time, so the
+    time spent waiting for a free in-flight slot is part of the reported latency.
+    """
+    def __init__(self, agent, rate, duration=None, iterations=None, max_in_flight=32):
+        if not rate or rate <= 0:
+            raise ValueError("Rate must be a positive number of requests per second")
+        self.agent = agent
+        self.rate = rate
+        self.duration = duration
+        self.iterations = iterations if iterations or duration else 1
+        self.max_in_flight = max(1, max_in_flight)
+        self.lock = threading.Lock()
+        self.stats = defaultdict(SuiteStats)
+
+    def run(self, requests):
+        # Every iteration replays the same requests, so they are expanded only once
+        requests = list(requests)
+        if not requests:
+            return {}
+
+        limit = self.iterations * len(requests) if self.iterations else None
+        interval = 1.0 / self.rate
+        slots = threading.BoundedSemaphore(self.max_in_flight)
+        logger.info(f"Starting load run at {self.rate} req/s with up to {self.max_in_flight} requests in flight")
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="load") as pool:
+            sent = 0
+            while limit is None or sent < limit:
+                scheduled = start + sent * interval
+                if self.duration and scheduled - start >= self.duration:
+                    break
+
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+                slots.acquire()
+                pool.submit(self.fire, requests[sent % len(requests)], scheduled, slots)
+                sent += 1
+        wall_time = time.perf_counter() - start
+
+        return self.build_report(wall_time)
+
+    def fire(self, request, scheduled, slots):
+        try:
+            outcome = request.send()
+            latency_ms = (time.perf_counter() - scheduled) * 1000
+            assertions = self.agent.evaluate_response(request, outcome)
+            failed = bool(outcome['error']) or any(not assertion.status for assertion in assertions)
+        except Exception as e:
+            logger.error("Load request %s failed: %s", request.id, e)
+            latency_ms = (time.perf_counter() - scheduled) * 1000
+            failed = True
+        finally:
+            slots.release()
+
+        with self.lock:
+            self.stats[request.suite].record(latency_ms, failed)
+
+    def build_report(self, wall_time):
+        logger.info("Building load report...")
+        total = SuiteStats()
+        for stats in self.stats.values():
+            total.latencies.extend(stats.latencies)
+            total.errors += stats.errors
+
+        report = {suite: stats.summary(wall_time) for suite, stats in sorted(self.stats.items())}
+        report["all"] = total.summary(wall_time)
+
+        lines = [f"  > Duration: {wall_time:.2f}s"]
+        for suite, summary in report.items():
+            lines.append(
+                f"  > {suite}: {summary['requests']} requests, {summary['throughput']:.2f} req/s, "
+                f"error rate {summary['error_rate']:.2%}, p50 {summary['p50']:.1f}ms, p90 {summary['p90']:.1f}ms, "
+                f"p99 {summary['p99']:.1f}ms, max {summary['max']:.1f}ms"
+            )
+        logger.log(REPORT, "\n" + "\n".join(lines))
+        return report
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
@@ -1,6 +1,15 @@
+import atexit
+import json
 import logging
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener
 import globals
+
+# Level of the final reports, so they are still shown in quiet mode
+REPORT = 25
+logging.addLevelName(REPORT, 'REPORT')
+
 class ColoredFormatter(logging.Formatter):
     COLORS = {
         'DEBUG': '\033[94m',    # Blue
@@ -13,7 +22,8 @@ class ColoredFormatter(logging.Formatter):
     }
 
     def format(self, record):
-        if record.levelname == 'INFO' and record.msg.startswith('Assertion passed'):
+        # Passed assertions are flagged by the agent with extra={'passed': True}
+        if getattr(record, 'passed', False):
             color = self.COLORS['INFO_GREEN']
         else:
             color = self.COLORS.get(record.levelname, self.COLORS['RESET'])
@@ -21,13 +31,74 @@ class ColoredFormatter(logging.Formatter):
         log_message = super().format(record)
         return f"{color}{log_message}{self.COLORS['RESET']}"
 
+class StructuredFormatter(logging.Formatter):
+    """
+    One compact JSON object per record
+    """
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    Hand the record over as is, so the message is formatted by the listener thread
+    instead of the thread that logs it
+    """
+    def prepare(self, record):
+        return record
+
+_queue = None
+_listener = None
+
+def queue_handler(level):
+    """
+    Shared handler that puts records on a queue drained by a background thread
+    """
+    global _queue, _listener
+    if _listener is None:
+        _queue = queue.SimpleQueue()
+        stdout_handler = logging.StreamHandler(sys.stdout)
+        if globals.structured:
+            stdout_handler.setFormatter(StructuredFormatter())
+        else:
+            stdout_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        _listener = QueueListener(_queue, stdout_handler)
+        _listener.start()
+        atexit.register(stop_logging)
+
+    handler = DeferredQueueHandler(_queue)
+    handler.setLevel(level)
+    return handler
+
+def stop_logging():
+    """
+    Flush the records still in the queue and stop the background thread
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
 def setup_logger(name='project_logger', level=None):
     level = logging.DEBUG if globals.verbose else logging.INFO
+    if globals.quiet:
+        level = REPORT
     logger = logging.getLogger(name)
     logger.setLevel(level)
 
     # Check if the logger already has handlers
     if not logger.handlers:
+        if globals.quiet or globals.structured:
+            logger.addHandler(queue_handler(level))
+            return logger
+
         # Create stdout handler
         stdout_handler = logging.StreamHandler(sys.stdout)
         stdout_handler.setLevel(level)
@@ -41,4 +112,4 @@ def setup_logger(name='project_logger', level=None):
         # Add handler to logger
         logger.addHandler(stdout_handler)
 
-    return logger
\ No newline at end of file
+    return logger
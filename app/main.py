@@ -1,6 +1,4 @@
 import argparse
-from configobj import Config
-from light_token_manager import LightTokenManager
 import globals
 
 def main():
@@ -8,68 +6,158 @@ def main():
     parser = argparse.ArgumentParser(description="Run the application")
     parser.add_argument("collection", nargs='?', help="Configuration file")
     parser.add_argument("-v", "--verbose", action="count", default=0, help="Increase output verbosity")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Only log warnings, errors and reports, from a background thread")
+    parser.add_argument("--structured", action="store_true", help="Log compact JSON records from a background thread")
     parser.add_argument("-t", "--tags", nargs='+', help="Filter requests by tags")
     parser.add_argument("-s", "--suites", nargs='+', help="Filter requests by suites")
+    parser.add_argument("-c", "--concurrency", type=int, default=1, help="Number of requests to run in parallel")
+    parser.add_argument("--jsonl", help="Write each result to this JSON Lines file as soon as it finishes")
+    parser.add_argument("--junit", help="Write each result to this JUnit XML file as soon as it finishes")
+    parser.add_argument("--record", metavar="DIR", help="Store every response in an archive in this directory")
+    parser.add_argument("--replay", metavar="DIR", help="Evaluate the responses stored in this directory instead of calling the endpoints")
+    parser.add_argument("--http-cache", metavar="PATH", help="Revalidate responses against a persistent HTTP cache stored in this file")
+    parser.add_argument("--compiled-cache", metavar="DIR", help="Directory of the compiled collections cache")
+    parser.add_argument("--no-compiled-cache", action="store_true", help="Always parse the collection file")
+    parser.add_argument("--deadline", type=float, help="Stop sending requests after this many seconds")
+    parser.add_argument("--serve", action="store_true", help="Keep running the collection on a schedule, reloading it when it changes")
+    parser.add_argument("--interval", type=float, default=60, help="Serve mode: seconds between the runs of a suite without its own interval")
+    parser.add_argument("--metrics-listen", metavar="HOST:PORT", help="Serve mode: expose Prometheus metrics on http://HOST:PORT/metrics. "
+                        "Listens on the loopback interface unless HOST is given")
+    parser.add_argument("--metrics-file", metavar="PATH", help="Write Prometheus metrics to this file after each run, for a textfile collector")
+    parser.add_argument("--workers", type=int, default=0, help="Shard the requests across this many worker processes")
+    parser.add_argument("--remote", metavar="HOST:PORT", action="append", default=[], help="Also send shards to this remote worker")
+    parser.add_argument("--shard-by", choices=("suite", "host"), default="suite", help="Keep the requests of a suite or of a host in the same shard")
+    parser.add_argument("--shards", type=int, help="Number of shards, twice the number of workers by default")
+    parser.add_argument("--listen", metavar="HOST:PORT", help="Run as a remote worker, processing the shards sent by coordinators. "
+                        "Listens on the loopback interface unless HOST is given")
+    parser.add_argument("--rate", type=float, help="Load mode: replay the working set at this many requests per second")
+    parser.add_argument("--duration", type=float, help="Load mode: run for this many seconds")
+    parser.add_argument("--iterations", type=int, help="Load mode: replay the working set this many times")
+    parser.add_argument("--max-in-flight", type=int, default=32, help="Load mode: maximum number of concurrent requests")
     args = parser.parse_args()
+    if args.record and args.replay:
+        parser.error("--record and --replay cannot be used together")
+    sharded = bool(args.workers or args.remote)
+    if sharded and (args.record or args.replay or args.http_cache or args.rate):
+        parser.error("--workers and --remote cannot be used with --record, --replay, --http-cache or --rate")
+    if args.rate and (args.record or args.replay):
+        parser.error("--rate cannot be used with --record or --replay, load mode always calls the endpoints")
+    if args.rate and (args.http_cache or args.jsonl or args.junit or args.deadline):
+        parser.error("--rate cannot be used with --http-cache, --jsonl, --junit or --deadline, use --duration to bound a load run")
+    if args.serve and (sharded or args.record or args.replay or args.rate or args.junit):
+        parser.error("--serve cannot be used with --workers, --remote, --record, --replay, --rate or --junit")
+    if args.metrics_listen and not args.serve:
+        parser.error("--metrics-listen needs --serve, use --metrics-file for a single run")
+    if not args.collection and not args.listen:
+        parser.error("the collection file is required")
 
     globals.verbose = args.verbose
+    globals.quiet = args.quiet
+    globals.structured = args.structured
 
     from agent import Agent
-    from collection import Collection
+    from archive import Recorder, Replayer
+    from httpcache import HttpCache
+    from compiled import DEFAULT_CACHE_DIR, load_collection
+    from daemon import Daemon
+    from distributed import Coordinator, serve_worker
+    from executor import Executor
+    from loadtest import LoadRunner
+    from metrics import Metrics, serve_metrics
+    from ratelimit import RateLimiter
+    from report import JsonLinesWriter, JUnitWriter
+    from tokens import TokenStore
     from logger import setup_logger
     logger = setup_logger(__name__)
 
-    # Load configuration files
-    collection_file = Config(args.collection, ".env").items()
-    logger.debug(f"Configuration file loaded: {args.collection}")
-
-    oauth2_providers = collection_file.get('defaults').get('oauth2')
-    for provider, provider_details in oauth2_providers.items():
-        if provider_details.get('enabled'):
-            logger.debug(f"Fetching token from provider: {provider}")
-            ltm = LightTokenManager(
-                provider_details['token_url'],
-                provider_details['client_id'],
-                provider_details['client_secret'],
-                provider_details['scope'],
-                provider_details['grant_type'],
-            )
-            # create new entry in globals, using the provider name as key
-            globals.tokens[provider] = ltm.get_token()
-            print(f"token: {globals.tokens}")
+    if args.listen:
+        serve_worker(args.listen, args.workers or 1)
+        return
+
+    Metrics().enabled = bool(args.metrics_listen or args.metrics_file)
+
+    # Load configuration files, from the compiled cache when they did not change
+    cache_dir = None if args.no_compiled_cache else (args.compiled_cache or DEFAULT_CACHE_DIR)
+    defaults, collection = load_collection(args.collection, ".env", cache_dir)
 
     # Run the control operator
     logger.info("Setting up the agent")
     agent = Agent()
 
-    collection = Collection(collection_file)
-    logger.debug(f"Collection length: {len(collection.requests)}")
+    logger.debug(f"Collection length: {len(collection.templates)}")
 
-    if len(collection.requests) == 0:
+    if len(collection.templates) == 0:
         logger.error("No requests found")
         return
 
-    logger.debug(f"Collection: {collection.requests}")
-
-    if args.tags or args.suites:
-        logger.info("Filtering requests")
-        collection.working_set = collection.filter_requests(args.tags, args.suites)
-
-    logger.debug(f"Filtered collection length: {len(collection.working_set)}")
-
-    # for counter, (index, request) in enumerate(collection.requests.items()):
-    for index in collection.working_set:
-        request = collection.requests[index]
-        logger.info(f"New request!\n    Processing {index}/{len(collection.requests)} - {request.name}")
-        request.invoke()
-        logger.debug(f"Response message: {request.response['body']}")
-
-        result = agent.evaluate_response(request)
-        request.assertions = result
+    # Only contact the identity providers the selected requests need, none when replaying
+    token_store = TokenStore(defaults.get('oauth2', {}) or {}, defaults.get('token_cache'))
+    if not args.replay:
+        token_store.fetch(collection.providers(args.tags, args.suites))
+
+    total = collection.count(args.tags, args.suites)
+    logger.debug(f"Filtered collection length: {total}")
+    requests = collection.iter_requests(args.tags, args.suites)
+
+    if args.rate:
+        if collection.graph(args.tags, args.suites):
+            # Each iteration sends the same requests again, captured values would be stale
+            parser.error("--rate cannot be used with requests that depend on other requests")
+        runner = LoadRunner(agent, args.rate, args.duration, args.iterations, args.max_in_flight)
+        runner.run(requests)
+        return
 
-    logger.info("All requests have been processed")
+    if args.serve:
+        HttpCache().configure(defaults.get('http_cache'), args.http_cache)
+        writer = JsonLinesWriter(args.jsonl) if args.jsonl else None
+        daemon = Daemon(args.collection, ".env", cache_dir, args.interval, args.tags, args.suites,
+                        args.concurrency, args.deadline, writer, args.metrics_file)
+        metrics_server = serve_metrics(args.metrics_listen) if args.metrics_listen else None
+        try:
+            daemon.run()
+        finally:
+            HttpCache().close()
+            if metrics_server:
+                metrics_server.shutdown()
+        return
 
-    collection.build_report()
+    if args.jsonl:
+        collection.add_writer(JsonLinesWriter(args.jsonl))
+    if args.junit:
+        collection.add_writer(JUnitWriter(args.junit))
+
+    HttpCache().configure(defaults.get('http_cache'), args.http_cache)
+    recorder = Recorder(args.record) if args.record else None
+    replayer = Replayer(args.replay) if args.replay else None
+
+    # Recorded responses are served locally, there is nothing to rate limit
+    limiter = RateLimiter() if RateLimiter().enabled and not replayer else None
+
+    executor = Executor(agent, args.concurrency, on_result=collection.record, recorder=recorder, replayer=replayer,
+                        limiter=limiter, deadline=args.deadline, graph=collection.graph(args.tags, args.suites))
+    try:
+        if sharded:
+            # The workers load the collection and send the requests themselves
+            spec = {
+                'collection': args.collection, 'env': ".env", 'cache_dir': cache_dir,
+                'tags': args.tags, 'suites': args.suites, 'by': args.shard_by,
+                'concurrency': args.concurrency, 'deadline': args.deadline,
+            }
+            shards = args.shards or 2 * (args.workers + len(args.remote))
+            Coordinator(spec, shards, args.workers, args.remote).run(collection)
+        else:
+            executor.run(requests, total)
+        logger.info("All requests have been processed")
+    finally:
+        if recorder:
+            recorder.close()
+        if replayer:
+            replayer.close()
+        HttpCache().close()
+        report = collection.build_report(total)
+        collection.close_writers(report)
+        if args.metrics_file:
+            Metrics().write_textfile(args.metrics_file)
 
 # TODO: make it run as script but also as a module
 if __name__ == "__main__":
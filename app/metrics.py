@@ -0,0 +1,215 @@
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HELP = {
+    'http_control_requests_total': ('counter', "Requests processed, by suite and status code"),
+    'http_control_retries_total': ('counter', "Requests sent again by the retry policy, by suite"),
+    'http_control_assertions_total': ('counter', "Assertions evaluated, by suite, check type and result"),
+    'http_control_tag_assertions_total': ('counter', "Assertions evaluated, by request tag and result"),
+    'http_control_request_duration_seconds': ('histogram', "Time to the full response, by host"),
+}
+
+
+# Singleton class
+class Metrics:
+    """
+    Counters and histograms in the Prometheus text format. Each thread updates its own
+    shard without any lock, the shards are only added up when the metrics are rendered.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(Metrics, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, 'enabled'):
+            self.enabled = False
+            self.lock = threading.Lock()
+            self.collect_lock = threading.Lock()
+            self.local = threading.local()
+            # (thread, counters, histograms) of every thread that recorded something
+            self.shards = []
+            # Totals of the threads that are gone
+            self.retired = ({}, {})
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = ({}, {})
+            with self.lock:
+                self.shards.append((threading.current_thread(), *shard))
+            self.local.shard = shard
+            return shard
+
+    def inc(self, name, labels, value=1):
+        counters = self.shard()[0]
+        key = (name, labels)
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        histograms = self.shard()[1]
+        key = (name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            # One count per bucket, one for +Inf, then the sum
+            histogram = histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        histogram[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        histogram[-1] += value
+
+    def record(self, suite, tags, url, status_code, elapsed_ms, retries, checks):
+        """
+        Account for a processed request
+        :param checks: (check name, passed) of each assertion
+        """
+        suite = suite or ''
+        self.inc('http_control_requests_total', (('suite', suite), ('status', str(status_code or 'error'))))
+        if retries:
+            self.inc('http_control_retries_total', (('suite', suite),), retries)
+        for check, passed in checks:
+            result = 'passed' if passed else 'failed'
+            self.inc('http_control_assertions_total', (('suite', suite), ('check', check), ('result', result)))
+            for tag in tags or ():
+                if tag:
+                    self.inc('http_control_tag_assertions_total', (('tag', tag), ('result', result)))
+        if elapsed_ms is not None:
+            self.observe('http_control_request_duration_seconds', (('host', urlparse(url).netloc),), elapsed_ms / 1000)
+
+    def record_request(self, request):
+        response = request.response or {}
+        self.record(request.suite, request.tags, request.url, response.get('status_code'), response.get('elapsed_ms'),
+                    response.get('retries', 0),
+                    [(assertion.check.name if assertion.check else 'assert', assertion.status)
+                     for assertion in request.assertions])
+
+    def record_result(self, result):
+        # The check ids of result_of are "<property>.<check>"
+        self.record(result['suite'], result['tags'], result['url'], result['status_code'], result['elapsed_ms'],
+                    result.get('retries', 0),
+                    [((assertion['check'] or 'assert.assert').rsplit('.', 1)[-1], assertion['status'])
+                     for assertion in result['assertions']])
+
+    def collect(self):
+        """
+        Add up the shards of all the threads
+        :return: counters and histograms, keyed by (name, labels)
+        """
+        with self.collect_lock:
+            with self.lock:
+                dead = [shard for shard in self.shards if not shard[0].is_alive()]
+                self.shards = [shard for shard in self.shards if shard[0].is_alive()]
+                alive = list(self.shards)
+            # Fold the shards of finished threads, so the list does not grow with every thread pool
+            for _, counters, histograms in dead:
+                merge_shard(self.retired, counters, histograms)
+
+            totals = (dict(self.retired[0]), {key: list(value) for key, value in self.retired[1].items()})
+            for _, counters, histograms in alive:
+                merge_shard(totals, counters, histograms)
+        return totals
+
+    def render(self):
+        """
+        :return: the metrics in the Prometheus text exposition format
+        """
+        counters, histograms = self.collect()
+        families = {}
+        for (name, labels), value in sorted(counters.items()):
+            families.setdefault(name, []).append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(histograms.items()):
+            lines = families.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip((*LATENCY_BUCKETS, '+Inf'), histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {round(histogram[-1], 6)}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+        output = []
+        for name in sorted(families):
+            kind, description = HELP[name]
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(families[name])
+        return "\n".join(output) + "\n"
+
+    def write_textfile(self, path):
+        """
+        Export for the node_exporter textfile collector, replaced atomically
+        """
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as f:
+            f.write(self.render())
+        os.replace(temporary, path)
+        logger.debug("Metrics written to %s", path)
+
+
+def snapshot(values):
+    # The owning thread may add keys meanwhile, which makes the copy fail
+    while True:
+        try:
+            return list(values.items())
+        except RuntimeError:
+            continue
+
+
+def merge_shard(totals, counters, histograms):
+    for key, value in snapshot(counters):
+        totals[0][key] = totals[0].get(key, 0) + value
+    for key, value in snapshot(histograms):
+        merged = totals[1].setdefault(key, [0] * len(value))
+        for position, count in enumerate(value):
+            merged[position] += count
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = Metrics().render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_metrics(address):
+    """
+    Serve /metrics from a background thread
+    :param address: host:port to listen on, the loopback interface if host is empty
+    :return: the server
+    """
+    host, _, port = address.rpartition(':')
+    host = host or '127.0.0.1'
+    server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Metrics available on http://%s:%s/metrics", host, server.server_address[1])
+    return server
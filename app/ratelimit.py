@@ -0,0 +1,199 @@
+import email.utils
+import threading
+import time
+from urllib.parse import urlparse
+
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+# Statuses that ask the client to slow down
+THROTTLED_STATUSES = (429, 503)
+DEFAULT_BACKOFF = 1.0
+DEFAULT_MAX_BACKOFF = 60.0
+DEFAULT_RETRIES = 3
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average, with bursts of up to `burst` requests
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now):
+        """
+        Seconds until a token is available, 0 if there is one already
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class Limit:
+    """
+    Rate, concurrency and backoff state of a single host or suite
+    """
+    def __init__(self, settings):
+        rate = settings.get('rate')
+        self.bucket = TokenBucket(rate, settings.get('burst')) if rate else None
+        self.max_in_flight = int(settings.get('max_in_flight') or 0)
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        # Consecutive throttled responses, the backoff doubles with each of them
+        self.throttled = 0
+        self.total_throttled = 0
+
+    def delay(self, now):
+        """
+        :return: 0 if a request can be sent now, the seconds to wait, or None if it has to
+        wait for a request in flight to finish
+        """
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return None
+        return self.bucket.delay(now) if self.bucket else 0.0
+
+
+# Singleton class
+class RateLimiter:
+    """
+    Token-bucket rate limits and max-in-flight caps per host and per suite, configured in
+    the `defaults.request.rate_limit` section. Hosts answering 429 or 503 are paused for
+    their Retry-After, or an exponential backoff, and the request is sent again.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(RateLimiter, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self):
+        if not hasattr(self, 'enabled'):
+            self.lock = threading.Lock()
+            self.configure(None)
+
+    def configure(self, settings):
+        """
+        :param settings: dict with optional `per_host` and `per_suite` limits (`rate`, `burst`,
+        `max_in_flight`), `hosts` and `suites` overrides by name, and `backoff`,
+        `max_backoff` and `retries` for the throttled responses
+        :return:
+        """
+        settings = settings or {}
+        self.enabled = bool(settings)
+        self.per_host = settings.get('per_host') or {}
+        self.per_suite = settings.get('per_suite') or {}
+        self.host_settings = settings.get('hosts') or {}
+        self.suite_settings = settings.get('suites') or {}
+        self.backoff = float(settings.get('backoff', DEFAULT_BACKOFF))
+        self.max_backoff = float(settings.get('max_backoff', DEFAULT_MAX_BACKOFF))
+        self.retries = int(settings.get('retries', DEFAULT_RETRIES))
+        self.hosts = {}
+        self.suites = {}
+
+    @staticmethod
+    def host_of(request):
+        return urlparse(request.url).netloc
+
+    def limits(self, request):
+        # Called with the lock held
+        host = self.host_of(request)
+        if host not in self.hosts:
+            self.hosts[host] = Limit({**self.per_host, **self.host_settings.get(host, {})})
+        suite = request.suite
+        if suite not in self.suites:
+            self.suites[suite] = Limit({**self.per_suite, **self.suite_settings.get(suite, {})})
+        return self.hosts[host], self.suites[suite]
+
+    def try_acquire(self, request):
+        """
+        Take a slot for the request if both its host and its suite allow it
+        :return: 0 if the request can be sent, otherwise what Limit.delay returned for the
+        most restrictive of the two
+        """
+        with self.lock:
+            now = time.monotonic()
+            limits = self.limits(request)
+            delays = [limit.delay(now) for limit in limits]
+            if None in delays:
+                return None
+            delay = max(delays)
+            if delay > 0:
+                return delay
+            for limit in limits:
+                if limit.bucket:
+                    limit.bucket.take()
+                limit.in_flight += 1
+            return 0.0
+
+    def acquire(self, request):
+        """
+        Block until the request can be sent
+        """
+        while True:
+            delay = self.try_acquire(request)
+            if delay == 0:
+                return
+            time.sleep(delay if delay is not None else 0.01)
+
+    def release(self, request, response, attempt=0):
+        """
+        Give the slot back once the response is in, and pause the host if it was throttled
+        :param attempt: number of times the request was already sent again
+        :return: None, or the seconds after which the request should be sent again
+        """
+        response = response or {}
+        status = response.get('status_code')
+        with self.lock:
+            host, suite = self.limits(request)
+            host.in_flight -= 1
+            suite.in_flight -= 1
+            if status not in THROTTLED_STATUSES:
+                host.throttled = 0
+                return None
+
+            host.throttled += 1
+            host.total_throttled += 1
+            delay = retry_after(response.get('headers') or {})
+            if delay is None:
+                delay = self.backoff * 2 ** (host.throttled - 1)
+            delay = min(delay, self.max_backoff)
+            host.blocked_until = max(host.blocked_until, time.monotonic() + delay)
+
+        if attempt >= self.retries:
+            logger.warning("Request %s throttled with status %s, giving up after %s retries", request.id, status, attempt)
+            return None
+        logger.warning("Request %s throttled with status %s, retrying in %.1fs", request.id, status, delay)
+        return delay
+
+    def stats(self):
+        """
+        Throttled responses per host
+        """
+        with self.lock:
+            return {host: limit.total_throttled for host, limit in self.hosts.items() if limit.total_throttled}
+
+
+def retry_after(headers):
+    """
+    Seconds requested by the Retry-After header, given either as seconds or as an HTTP date
+    """
+    value = headers.get('retry-after') or headers.get('Retry-After')
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, date.timestamp() - time.time())
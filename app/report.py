@@ -0,0 +1,99 @@
+import json
+from xml.sax.saxutils import escape, quoteattr
+
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+
+def result_of(request):
+    """
+    Serialisable summary of a processed request, as written by the report writers
+    """
+    response = request.response or {}
+    return {
+        "id": request.id,
+        "name": request.name,
+        "suite": request.suite,
+        "tags": list(request.tags or []),
+        "method": request.method,
+        "url": request.url,
+        "status_code": response.get("status_code"),
+        "error": response.get("error", ""),
+        "elapsed_ms": response.get("elapsed_ms"),
+        "retries": response.get("retries", 0),
+        "retry_ms": response.get("retry_ms", 0.0),
+        "passed": all(assertion.status for assertion in request.assertions),
+        # Messages are only rendered for the failed assertions
+        "assertions": [
+            {"check": assertion.check_id, "status": assertion.status, "message": None if assertion.status else assertion.message}
+            for assertion in request.assertions
+        ],
+    }
+
+
+class JsonLinesWriter:
+    """
+    Write one JSON object per request as soon as it finishes, so results can be tailed
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, result):
+        self.file.write(json.dumps(result, default=str) + "\n")
+        self.file.flush()
+
+    def write_summary(self, summary):
+        self.file.write(json.dumps({"summary": summary}, default=str) + "\n")
+        self.file.flush()
+
+    def close(self, summary=None):
+        if summary is not None:
+            self.write_summary(summary)
+        self.file.close()
+
+
+class JUnitWriter:
+    """
+    Stream JUnit XML test cases as the requests finish. The counters of the test suite are
+    not known upfront, so room is reserved for them and they are patched on close.
+    """
+    # Room reserved in the <testsuite> tag for the counters, padded with whitespace
+    COUNTERS_WIDTH = 120
+
+    def __init__(self, path, name="http-control"):
+        self.path = path
+        self.tests = 0
+        self.failures = 0
+        self.time = 0.0
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write('<?xml version="1.0" encoding="UTF-8"?>\n<testsuites>\n')
+        self.file.write(f'<testsuite name={quoteattr(name)} ')
+        self.counters_offset = self.file.tell()
+        self.file.write(self.counters() + '>\n')
+        self.file.flush()
+
+    def counters(self):
+        counters = f'tests="{self.tests}" failures="{self.failures}" errors="0" time="{self.time:.3f}"'
+        return counters.ljust(self.COUNTERS_WIDTH)
+
+    def write(self, result):
+        self.tests += 1
+        elapsed = (result["elapsed_ms"] or 0) / 1000
+        self.time += elapsed
+        name = f"({result['id']}) {result['name']} {result['method']} {result['url']}"
+        self.file.write(f'  <testcase classname={quoteattr(str(result["suite"]))} name={quoteattr(name)} time="{elapsed:.3f}"')
+
+        failed = [assertion["message"] for assertion in result["assertions"] if not assertion["status"]]
+        if not failed:
+            self.file.write('/>\n')
+        else:
+            self.failures += 1
+            self.file.write(f'>\n    <failure message={quoteattr(failed[0])}>{escape(chr(10).join(failed))}</failure>\n  </testcase>\n')
+        self.file.flush()
+
+    def close(self, summary=None):
+        self.file.write('</testsuite>\n</testsuites>\n')
+        self.file.seek(self.counters_offset)
+        self.file.write(self.counters())
+        self.file.close()
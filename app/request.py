@@ -1,42 +1,57 @@
 import requests
 import json
-from urllib.parse import urlparse, parse_qs, urlencode
+import re
+import time
+from urllib.parse import quote
 import urllib3
+from requests.structures import CaseInsensitiveDict
+from checks import needs_body
+from graph import compile_captures
+from retry import retry_policy
+from httpcache import HttpCache
+from session import SessionPool, last_timings, reset_timings
+from tokens import TokenStore
 from logger import setup_logger
 logger = setup_logger(__name__)
 
 # TODO: should I leave it here?????
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-class Request:
-    def __init__(self, attributes, variables=None):
-        logger.debug("Initializing Request")
-
-
-        self.id = None
-        self.name = ''
-        self.summary = ''
-        self.suite = None
-        self.tags = []
-        self.groups = []
-        self.method = ''
-        self.data = None
-        self.json = None
-        self.expected = {}
-        self.response = {}
-        self.timeout = 10
-        self.assertions = []
+CHUNK_SIZE = 64 * 1024
+# Unread bodies up to this size are drained, so the connection can go back to the pool
+DRAIN_LIMIT = 64 * 1024
+DEFAULT_TIMEOUT = 10
+# Captured variables are referenced as $name in the url, headers and payload
+VARIABLE = re.compile(r'\$(\w+)')
 
-        for key, value in attributes.items():
-            if key not in ['url', 'payload', 'keystore', 'truststore', 'proxies']:
-                setattr(self, key, value)
+class RequestTemplate:
+    """
+    Attributes shared by every request expanded from the same collection item. It is
+    referenced, not copied, by those requests, so it must not be modified once built.
+    """
+    __slots__ = ('name', 'summary', 'suite', 'tags', 'groups', 'method', 'headers', 'data', 'json',
+                 'expected', 'plan', 'auth_provider', 'timeout', 'total_timeout', 'retry', 'max_body_bytes',
+                 'verify', 'cert', 'capture')
 
+    def __init__(self, attributes):
+        self.name = attributes.get('name', '')
+        self.summary = attributes.get('summary', '')
+        self.suite = attributes.get('suite')
+        self.tags = attributes.get('tags', [])
+        self.groups = attributes.get('groups', [])
         self.method = attributes.get('method', 'GET')
         self.headers = attributes.get('headers', {})
-        self.url = self.replace_variables(attributes['url'], variables)
+        self.expected = attributes.get('expected', {})
+        self.plan = attributes.get('plan')
+        self.auth_provider = attributes.get('auth_provider')
+        self.timeout, self.total_timeout = parse_timeout(attributes.get('timeout', DEFAULT_TIMEOUT))
+        self.retry = retry_policy(attributes.get('retry'))
+        self.max_body_bytes = attributes.get('max_body_bytes')
         self.verify = attributes.get('truststore', False)
         self.cert = attributes.get('keystore', [])
-        self.proxies = attributes.get('proxy', None)
+        self.capture = compile_captures(attributes.get('capture'))
+        self.json = None
+        self.data = None
 
         # Either "json" or "data" can be used, but not both
         if 'payload' in attributes and attributes['payload']:
@@ -47,57 +62,287 @@ class Request:
         else:
             self.data = attributes.get('payload', None)
 
-    def invoke(self):
-        logger.info(f"Sending {self.method} request to {self.url}")
+
+class Request:
+    """
+    A request only holds what is specific to it: its url, proxies, id and results. Everything
+    else is read from its template, unless it is set on the request (suite and tags, and the
+    headers and payload once variables are substituted in them).
+    """
+    __slots__ = ('template', 'id', 'url', 'proxies', 'response', 'assertions', 'suite', 'tags',
+                 'headers', 'json', 'data')
+
+    def __init__(self, attributes, variables=None):
+        logger.debug("Initializing Request")
+        self.template = RequestTemplate(attributes)
+        self.id = None
+        self.url = self.replace_variables(attributes['url'], variables)
+        self.proxies = attributes.get('proxy', None)
+        self.response = {}
+        self.assertions = []
+
+    @classmethod
+    def expand(cls, template, url, proxies=None):
+        """
+        Create a request of an expansion, sharing the template instead of copying its attributes
+        :param template: RequestTemplate
+        :param url: the url of this request
+        :param proxies:
+        :return:
+        """
+        request = cls.__new__(cls)
+        request.template = template
+        request.id = None
+        request.url = url
+        request.proxies = proxies
+        request.response = {}
+        request.assertions = []
+        return request
+
+    def __getattr__(self, name):
+        # Only called for the attributes not set on the request itself
+        if name == 'template' or name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.template, name)
+
+    def invoke(self, read_body=None, deadline=None):
+        """
+        Send the request, again while its retry policy allows it, and store the outcome
+        :param deadline: time.monotonic() after which nothing is sent anymore
+        :return:
+        """
+        outcome = self.send(read_body, deadline)
+        retries = 0
+        lost_ms = 0.0
+        while self.retry and self.retry.should_retry(self.method, outcome, retries):
+            delay = self.retry.delay(retries)
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                break
+            logger.warning("Request %s failed (%s), retrying in %.2fs", self.id, outcome['error'] or outcome['status_code'], delay)
+            time.sleep(delay)
+            lost_ms += outcome['elapsed_ms'] + delay * 1000
+            retries += 1
+            outcome = self.send(read_body, deadline)
+
+        outcome['retries'] = retries
+        outcome['retry_ms'] = round(lost_ms, 3)
+        self.response = outcome
+
+    def send(self, read_body=None, deadline=None):
+        """
+        Send the request and return its outcome, without storing it on the request
+        :param read_body: download the body even if no assertion needs it (True) or never (False)
+        :param deadline: time.monotonic() the timeouts are cut to
+        :return:
+        """
+        logger.info("Sending %s request to %s", self.method, self.url)
+        reset_timings()
+        start = time.perf_counter()
+        timeout = self.timeout
+        total_timeout = self.total_timeout
+        if deadline is not None:
+            remaining = max(deadline - time.monotonic(), 0.001)
+            timeout = tuple(min(value, remaining) for value in timeout)
+            total_timeout = min(total_timeout or remaining, remaining)
         try:
-            response = requests.request(
+            headers = self.resolve_headers()
+            cache = HttpCache()
+            cached = cache.lookup(self.method, self.url, headers)
+            if cached:
+                headers = conditional_headers(headers, cached)
+
+            session = SessionPool().get(self.url, self.verify, self.cert, self.proxies)
+            response = session.request(
                 method=self.method,
                 url=self.url,
                 json=self.json if self.json else None,
                 data=self.data if self.data else None,
-                headers=self.headers,
+                headers=headers,
                 verify=self.verify,
                 cert=tuple(self.cert),
-                proxies=self.proxies
+                proxies=self.proxies,
+                timeout=timeout,
+                stream=True
             )
+            # Headers are in, the body is only downloaded if an assertion needs it
+            ttfb = time.perf_counter() - start
+            error = ""
+            if cached and response.status_code == 304:
+                # Not modified, answer as if the cached response had been sent again
+                logger.debug("Request %s served from the HTTP cache", self.id)
+                release(response)
+                response_headers = CaseInsensitiveDict({**cached.headers, **response.headers})
+                return self.cached_outcome(cached, response_headers, start, ttfb)
+            if read_body is None:
+                read_body = needs_body(self.plan) or bool(self.capture and self.capture.needs_body)
+            if read_body:
+                content, size, error = self.read_body(response, start, total_timeout)
+                if content is None:
+                    logger.error("Request %s: %s", self.id, error)
+                else:
+                    cache.store(self.method, self.url, headers, response, content)
+            else:
+                content = None
+                size = int(response.headers.get('content-length', 0) or 0)
+                release(response)
+            elapsed = time.perf_counter() - start
             # response.raise_for_status()
-            logger.info(f"Request successful. Status code: {response.status_code}")
-
-            try:
-                response_body = response.json()
-            except ValueError:
-                response_body = response.text
+            logger.info("Request successful. Status code: %s", response.status_code)
 
             outcome = {
-                "body": response_body,
+                "body": parse_body(content, response.encoding) if content is not None else "",
                 "headers": response.headers,
                 "status_code": response.status_code,
-                "error": ""
+                "error": error,
+                "elapsed_ms": round(elapsed * 1000, 3),
+                "ttfb_ms": round(ttfb * 1000, 3),
+                "size_bytes": size,
             }
         except requests.exceptions.RequestException as e:
-            logger.error(f"Request failed: {str(e)}")
+            logger.error("Request failed: %s", e)
             outcome = {
                 "body": "",
                 "headers": {},
                 "status_code": "",
-                "error": str(e)
+                "error": str(e),
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+                "ttfb_ms": None,
+                "size_bytes": 0,
             }
 
-        self.response = outcome
+        outcome.update({key: round(value, 3) for key, value in last_timings().items()})
+        return outcome
+
+    def cached_outcome(self, cached, headers, start, ttfb):
+        outcome = {
+            "body": parse_body(cached.body, cached.encoding),
+            "headers": headers,
+            "status_code": cached.status_code,
+            "error": "",
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 3),
+            "ttfb_ms": round(ttfb * 1000, 3),
+            "size_bytes": len(cached.body),
+        }
+        outcome.update({key: round(value, 3) for key, value in last_timings().items()})
+        return outcome
+
+    def resolve_headers(self):
+        if not self.auth_provider:
+            return self.headers
+        return {**self.headers, 'authorization': f"Bearer {TokenStore().get(self.auth_provider)}"}
+
+    def read_body(self, response, start=None, total_timeout=None):
+        """
+        Read the body in chunks, giving up as soon as it grows past max_body_bytes or the
+        request takes longer than its total timeout
+        :param start: time.perf_counter() when the request was sent
+        :return: the body as bytes (None if it was not read entirely), the number of bytes read
+        and the reason it was not read entirely
+        """
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            size += len(chunk)
+            if self.max_body_bytes and size > self.max_body_bytes:
+                response.close()
+                return None, size, f"Response body exceeds max_body_bytes ({self.max_body_bytes})"
+            if total_timeout and time.perf_counter() - start > total_timeout:
+                response.close()
+                return None, size, f"Response not received within the total timeout ({total_timeout}s)"
+            chunks.append(chunk)
+        return b"".join(chunks), size, ""
 
     def replace_variables(self, url, variables):
+        """
+        Substitute the variables referenced as $name in the url, e.g. /orders/$order_id?cursor=$cursor
+        Values are encoded in the query string, and inserted as they are before it, so a captured
+        path or url can be used, e.g. https://api$order_path. Unknown names are left as they are.
+        """
         if not variables:
             return url
+        path, separator, query = url.partition('?')
+        return substitute(path, variables) + separator + substitute(query, variables, lambda value: quote(str(value), safe=''))
+
+    def bind(self, variables):
+        """
+        Substitute the variables captured from other responses in the url, headers and payload
+        of this request. The template is not modified, the results are set on the request.
+        :param variables: dict of name -> value
+        """
+        self.url = self.replace_variables(self.url, variables)
+        headers = self.template.headers
+        if any(isinstance(value, str) and '$' in value for value in headers.values()):
+            self.headers = {key: substitute(value, variables) if isinstance(value, str) else value
+                            for key, value in headers.items()}
+        if self.template.json is not None:
+            self.json = substitute_json(self.template.json, variables)
+        elif isinstance(self.template.data, str):
+            self.data = substitute(self.template.data, variables)
+
+
+def substitute(text, variables, encode=str):
+    return VARIABLE.sub(lambda match: encode(variables[match.group(1)]) if match.group(1) in variables
+                        else match.group(0), text)
+
+
+def substitute_json(value, variables):
+    """
+    Substitute the variables in the strings of a JSON document. A string that is only a
+    reference, e.g. "$order_id", takes the captured value as it is, numbers included.
+    """
+    if isinstance(value, str):
+        match = VARIABLE.fullmatch(value)
+        if match and match.group(1) in variables:
+            return variables[match.group(1)]
+        return substitute(value, variables)
+    if isinstance(value, dict):
+        return {key: substitute_json(item, variables) for key, item in value.items()}
+    if isinstance(value, list):
+        return [substitute_json(item, variables) for item in value]
+    return value
+
+
+def parse_timeout(timeout):
+    """
+    :param timeout: seconds for both the connect and read timeouts, or a dict with optional
+    `connect`, `read` and `total` keys. The read timeout applies to each read from the socket,
+    the total timeout to the whole exchange, body included.
+    :return: (connect, read) as accepted by requests, and the total timeout or None
+    """
+    if isinstance(timeout, dict):
+        unknown = set(timeout) - {'connect', 'read', 'total'}
+        if unknown:
+            raise ValueError(f"Unknown timeout settings: {sorted(unknown)}")
+        read = float(timeout.get('read', DEFAULT_TIMEOUT))
+        connect = float(timeout.get('connect', read))
+        total = float(timeout['total']) if timeout.get('total') is not None else None
+    else:
+        connect = read = float(timeout)
+        total = None
+    if connect <= 0 or read <= 0 or (total is not None and total <= 0):
+        raise ValueError(f"Timeouts must be positive: {timeout}")
+    return (connect, read), total
+
+
+def parse_body(content, encoding=None):
+    text = content.decode(encoding or 'utf-8', errors='replace')
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
 
-        parsed_url = urlparse(url)
-        query_params = parse_qs(parsed_url.query)
 
-        for key, value in query_params.items():
-            if value[0].startswith('$'):
-                var_name = value[0][1:]
-                if var_name in variables:
-                    query_params[key] = [variables[var_name]]
+def conditional_headers(headers, cached):
+    headers = dict(headers)
+    if cached.etag:
+        headers['if-none-match'] = cached.etag
+    if cached.last_modified:
+        headers['if-modified-since'] = cached.last_modified
+    return headers
 
-        new_query = urlencode(query_params, doseq=True)
-        return parsed_url._replace(query=new_query).geturl()
 
+def release(response):
+    length = response.headers.get('content-length')
+    if length and length.isdigit() and int(length) <= DRAIN_LIMIT:
+        response.content
+    response.close()
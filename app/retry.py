@@ -0,0 +1,57 @@
+import random
+
+# Methods that can be sent again without changing the outcome
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'TRACE')
+# 429 and 503 are left to the rate limiter, which pauses the whole host
+DEFAULT_STATUSES = (502, 504)
+DEFAULT_ATTEMPTS = 3
+DEFAULT_BACKOFF = 0.5
+DEFAULT_MAX_BACKOFF = 10.0
+
+
+class RetryPolicy:
+    """
+    Send idempotent requests again after a connection error, a timeout or one of the
+    retryable statuses, waiting an exponential backoff with full jitter in between
+    """
+    __slots__ = ('attempts', 'backoff', 'max_backoff', 'jitter', 'statuses', 'methods')
+
+    def __init__(self, attempts=DEFAULT_ATTEMPTS, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF,
+                 jitter=True, statuses=DEFAULT_STATUSES, methods=IDEMPOTENT_METHODS):
+        self.attempts = int(attempts)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.jitter = bool(jitter)
+        self.statuses = tuple(int(status) for status in statuses)
+        self.methods = tuple(method.upper() for method in methods)
+        if self.attempts < 1 or self.backoff < 0 or self.max_backoff < 0:
+            raise ValueError("Retry attempts must be at least 1 and backoffs cannot be negative")
+
+    def should_retry(self, method, outcome, retries):
+        """
+        :param outcome: the outcome of the last attempt, as returned by Request.send
+        :param retries: number of retries already done
+        """
+        if retries + 1 >= self.attempts or method.upper() not in self.methods:
+            return False
+        # Transport errors come without a status code
+        return outcome.get('status_code') in self.statuses or (outcome.get('error') and not outcome.get('status_code'))
+
+    def delay(self, retries):
+        delay = min(self.max_backoff, self.backoff * 2 ** retries)
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+def retry_policy(settings):
+    """
+    Build the policy of a `retry` section
+    :param settings: dict with optional `attempts` (including the first one), `backoff`,
+    `max_backoff`, `jitter`, `statuses` and `methods` keys, or None for no retries
+    :return: RetryPolicy or None
+    """
+    if not settings:
+        return None
+    unknown = set(settings) - set(RetryPolicy.__slots__)
+    if unknown:
+        raise ValueError(f"Unknown retry settings: {sorted(unknown)}")
+    return RetryPolicy(**settings)
@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+
+# Connection setup timings of the last request sent from the current thread
+_timings = threading.local()
+
+
+def reset_timings():
+    _timings.connect_ms = 0.0
+    _timings.tls_ms = 0.0
+
+
+def last_timings():
+    """
+    Connection setup timings of the last request sent from the current thread.
+    Both values are 0 when the request reused a pooled connection.
+    :return: dict with `connect_ms` (DNS + TCP) and `tls_ms`
+    """
+    return {
+        "connect_ms": getattr(_timings, 'connect_ms', 0.0),
+        "tls_ms": getattr(_timings, 'tls_ms', 0.0),
+    }
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            _timings.connect_ms = (time.perf_counter() - start) * 1000
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def _new_conn(self):
+        start = time.perf_counter()
+        try:
+            return super()._new_conn()
+        finally:
+            _timings.connect_ms = (time.perf_counter() - start) * 1000
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _timings.tls_ms = max(0.0, (time.perf_counter() - start) * 1000 - getattr(_timings, 'connect_ms', 0.0))
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+# Singleton class
+class SessionPool:
+    """
+    Keep one keep-alive session per (scheme, host, verify, cert, proxy) combination,
+    so requests to the same host reuse their connections instead of opening new ones.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(SessionPool, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self, pool_connections=None, pool_maxsize=None):
+        if not hasattr(self, 'sessions'):
+            self.sessions = {}
+            self.lock = threading.Lock()
+            self.pool_connections = 10
+            self.pool_maxsize = 10
+
+        if pool_connections:
+            self.pool_connections = int(pool_connections)
+        if pool_maxsize:
+            self.pool_maxsize = int(pool_maxsize)
+
+    def configure(self, settings):
+        """
+        Apply the pool settings from the `defaults.request.pool` section
+        :param settings: dict with optional `connections` and `maxsize` keys
+        :return:
+        """
+        settings = settings or {}
+        self.__init__(settings.get('connections'), settings.get('maxsize'))
+
+    def get(self, url, verify=False, cert=(), proxies=None):
+        key = self.key(url, verify, cert, proxies)
+        session = self.sessions.get(key)
+        if session is None:
+            with self.lock:
+                session = self.sessions.get(key)
+                if session is None:
+                    logger.debug("Opening new session for %s://%s", key[0], key[1])
+                    session = requests.Session()
+                    adapter = TimedHTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self.sessions[key] = session
+        return session
+
+    @staticmethod
+    def key(url, verify, cert, proxies):
+        parsed = urlparse(url)
+        proxies_key = tuple(sorted(proxies.items())) if proxies else ()
+        return parsed.scheme, parsed.netloc, verify, tuple(cert or ()), proxies_key
+
+    def stats(self):
+        """
+        Collect connection reuse stats per host from the underlying connection pools
+        :return: dict of host -> {"requests": int, "connections": int, "reused": int}
+        """
+        stats = defaultdict(lambda: {"requests": 0, "connections": 0, "reused": 0})
+        with self.lock:
+            sessions = list(self.sessions.values())
+
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                managers = [adapter.poolmanager, *adapter.proxy_manager.values()]
+                for manager in managers:
+                    for pool_key in manager.pools.keys():
+                        pool = manager.pools.get(pool_key)
+                        if pool is None:
+                            continue
+                        host_stats = stats[pool.host]
+                        host_stats["requests"] += pool.num_requests
+                        host_stats["connections"] += pool.num_connections
+
+        for host_stats in stats.values():
+            host_stats["reused"] = max(0, host_stats["requests"] - host_stats["connections"])
+        return dict(stats)
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
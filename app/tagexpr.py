@@ -0,0 +1,95 @@
+import re
+from functools import lru_cache
+
+OPERATORS = ('and', 'or', 'not', '(', ')')
+TOKENS = re.compile(r"\s*(\(|\)|[^\s()]+)")
+
+
+def from_args(tags):
+    """
+    Build an expression from the --tags arguments. Plain tags must all match, as before,
+    while arguments using operators are read as a single expression.
+    :param tags: e.g. ["smoke", "api"] or ["smoke", "and", "not", "slow"] or ["smoke and not slow"]
+    :return:
+    """
+    if not tags:
+        return None
+    words = [word for tag in tags for word in tokenize(tag)]
+    if any(word in OPERATORS for word in words):
+        return ' '.join(tags)
+    return ' and '.join(tags)
+
+
+def tokenize(expression):
+    return TOKENS.findall(expression)
+
+
+@lru_cache(maxsize=None)
+def compile_expression(expression):
+    """
+    Parse a boolean tag expression like "smoke and not (slow or flaky)" into a tree of
+    ('tag', name), ('not', node), ('and', left, right) and ('or', left, right)
+    """
+    tokens = tokenize(expression)
+    if not tokens:
+        raise ValueError("Empty tag expression")
+    node, position = _parse_or(tokens, 0)
+    if position != len(tokens):
+        raise ValueError(f"Unexpected <{tokens[position]}> in tag expression <{expression}>")
+    return node
+
+
+def _parse_or(tokens, position):
+    node, position = _parse_and(tokens, position)
+    while position < len(tokens) and tokens[position] == 'or':
+        right, position = _parse_and(tokens, position + 1)
+        node = ('or', node, right)
+    return node, position
+
+
+def _parse_and(tokens, position):
+    node, position = _parse_not(tokens, position)
+    while position < len(tokens) and tokens[position] == 'and':
+        right, position = _parse_not(tokens, position + 1)
+        node = ('and', node, right)
+    return node, position
+
+
+def _parse_not(tokens, position):
+    if position < len(tokens) and tokens[position] == 'not':
+        node, position = _parse_not(tokens, position + 1)
+        return ('not', node), position
+    return _parse_atom(tokens, position)
+
+
+def _parse_atom(tokens, position):
+    if position >= len(tokens):
+        raise ValueError("Tag expression ends unexpectedly")
+    token = tokens[position]
+    if token == '(':
+        node, position = _parse_or(tokens, position + 1)
+        if position >= len(tokens) or tokens[position] != ')':
+            raise ValueError("Missing closing parenthesis in tag expression")
+        return node, position + 1
+    if token in OPERATORS:
+        raise ValueError(f"Unexpected <{token}> in tag expression")
+    return ('tag', token), position + 1
+
+
+def select(node, index, universe):
+    """
+    Evaluate an expression with set operations over an inverted index
+    :param node: compiled expression
+    :param index: dict of tag -> set of ids
+    :param universe: set of all ids, needed for `not`
+    :return: set of matching ids
+    """
+    kind = node[0]
+    if kind == 'tag':
+        return index.get(node[1], set())
+    if kind == 'not':
+        return universe - select(node[1], index, universe)
+    left = select(node[1], index, universe)
+    if kind == 'and':
+        return left & select(node[2], index, universe) if left else set()
+    return left | select(node[2], index, universe)
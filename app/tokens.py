@@ -0,0 +1,186 @@
+import base64
+import binascii
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import globals
+
+from logger import setup_logger
+logger = setup_logger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'http-control', 'tokens.json')
+# Lifetime assumed for a token that does not tell its own, when the provider does not configure one
+DEFAULT_TTL = 3600
+# Tokens are refreshed this many seconds before they expire
+DEFAULT_REFRESH_MARGIN = 60
+
+
+# Singleton class
+class TokenStore:
+    """
+    OAuth2 tokens per provider, persisted in a local cache keyed by provider, client_id and scope,
+    and refreshed shortly before they expire
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(TokenStore, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self, providers=None, cache_path=None):
+        if not hasattr(self, 'tokens'):
+            self.providers = {}
+            self.cache_path = DEFAULT_CACHE_PATH
+            self.tokens = {}
+            self.locks = {}
+            self.lock = threading.Lock()
+
+        if providers is not None:
+            previous = self.providers
+            self.providers = {name: details for name, details in providers.items() if details.get('enabled')}
+            self.locks = {name: threading.Lock() for name in self.providers}
+            # Tokens are kept across reloads of the collection, unless their provider changed
+            self.tokens = {name: token for name, token in self.tokens.items()
+                           if self.providers.get(name) == previous.get(name)}
+        if cache_path:
+            self.cache_path = cache_path
+
+    def fetch(self, names):
+        """
+        Make sure there is a valid token for every given provider, reading the cache first and
+        contacting the remaining identity providers concurrently
+        :param names: providers referenced by the requests that are going to run
+        :return:
+        """
+        cache = self.read_cache()
+        missing = []
+        for name in names:
+            if name not in self.providers:
+                raise ValueError(f"Token not found for provider: {name}")
+            token, expires_at = self.tokens.get(name, (None, 0))
+            if token and not self.expiring(name, expires_at):
+                continue
+            entry = cache.get(self.cache_key(name))
+            if entry and not self.expiring(name, entry['expires_at']):
+                logger.debug(f"Using cached token for provider: {name}")
+                self.set(name, entry['token'], entry['expires_at'])
+            else:
+                missing.append(name)
+
+        if not missing:
+            return
+
+        with ThreadPoolExecutor(max_workers=len(missing), thread_name_prefix="oauth2") as pool:
+            # list() surfaces the errors of the identity providers
+            list(pool.map(self.refresh, missing))
+
+    def get(self, name):
+        """
+        Token of a provider, refreshed if it is about to expire. While one thread refreshes,
+        the others keep using the current token as long as it is still valid.
+        """
+        token, expires_at = self.tokens.get(name, (None, 0))
+        if token and not self.expiring(name, expires_at):
+            return token
+
+        lock = self.locks.get(name)
+        if lock is None:
+            raise ValueError(f"Token not found for provider: {name}")
+        if token and time.time() < expires_at:
+            # Still valid, only refresh it if no other thread is already doing so
+            if not lock.acquire(blocking=False):
+                return token
+        else:
+            lock.acquire()
+
+        try:
+            token, expires_at = self.tokens.get(name, (None, 0))
+            if not token or self.expiring(name, expires_at):
+                token = self._refresh(name)
+            return token
+        finally:
+            lock.release()
+
+    def refresh(self, name):
+        with self.locks[name]:
+            return self._refresh(name)
+
+    def _refresh(self, name):
+        # Only needed when a token is not in the cache
+        from light_token_manager import LightTokenManager
+
+        details = self.providers[name]
+        logger.debug(f"Fetching token from provider: {name}")
+        ltm = LightTokenManager(
+            details['token_url'],
+            details['client_id'],
+            details['client_secret'],
+            details['scope'],
+            details['grant_type'],
+        )
+        token = ltm.get_token()
+        self.set(name, token, expires_at(token, getattr(ltm, 'expires_in', None), details.get('ttl', DEFAULT_TTL)))
+        self.write_cache()
+        return token
+
+    def set(self, name, token, expires_at):
+        # write_cache goes through the tokens while holding the lock
+        with self.lock:
+            self.tokens[name] = (token, expires_at)
+        # create new entry in globals, using the provider name as key
+        globals.tokens[name] = token
+
+    def expiring(self, name, expires_at):
+        margin = float(self.providers.get(name, {}).get('refresh_margin', DEFAULT_REFRESH_MARGIN))
+        return time.time() >= expires_at - margin
+
+    def cache_key(self, name):
+        details = self.providers[name]
+        return f"{name}|{details.get('client_id')}|{details.get('scope')}"
+
+    def read_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_cache(self):
+        with self.lock:
+            cache = self.read_cache()
+            now = time.time()
+            cache = {key: entry for key, entry in cache.items() if entry.get('expires_at', 0) > now}
+            for name, (token, expires_at) in self.tokens.items():
+                cache[self.cache_key(name)] = {'token': token, 'expires_at': expires_at}
+
+            try:
+                os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+                temporary = f"{self.cache_path}.tmp"
+                # The cache holds credentials, keep it private to the user
+                with open(os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+                    json.dump(cache, f)
+                os.replace(temporary, self.cache_path)
+            except OSError as e:
+                logger.warning(f"Could not write the token cache {self.cache_path}: {str(e)}")
+
+
+def expires_at(token, expires_in=None, ttl=DEFAULT_TTL):
+    """
+    Expiry of a token: the `exp` claim of a JWT, else the `expires_in` given by the identity
+    provider, else the configured ttl
+    :return: timestamp
+    """
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError, binascii.Error):
+        pass
+    try:
+        return time.time() + float(expires_in)
+    except (TypeError, ValueError):
+        return time.time() + float(ttl)
@@ -0,0 +1,70 @@
+"""
+Synthetic collections for the benchmarks.
+
+    python benchmarks/generate.py 10000 --url http://127.0.0.1:8099 --output /tmp/collection.yaml
+"""
+import argparse
+
+import yaml
+
+EXPECT = {
+    'status_code': [{'equals': 200}],
+    'body.$.status': [{'equals': 'ok'}],
+    'body.$.items[*].id': [{'length': 3}],
+    'headers': [{'includes': {'Content-Type': 'application/json'}}],
+    'elapsed_ms': [{'lower': 5000}],
+}
+
+
+def collection(requests, url="http://127.0.0.1:8099", expansion=10, seed=0):
+    """
+    Build a collection expanding to `requests` requests
+    :param requests: number of requests after the url_values expansion
+    :param url: base url of the stub server
+    :param expansion: number of requests each item expands to
+    :param seed: changes the paths, not the shape of the collection
+    :return: the collection, as loaded from YAML
+    """
+    items = []
+    remaining = requests
+    while remaining > 0:
+        count = min(expansion, remaining)
+        position = len(items)
+        items.append({
+            'name': f"Item {position}",
+            'tags': [f"group-{position % 10}", "even" if position % 2 == 0 else "odd"],
+            'invoke': {
+                'url_values': {
+                    'path': [f"/items/{seed}/{position}/{value}" for value in range(count)],
+                },
+                'method': 'GET',
+                'headers': {'X-Item': str(position)},
+            },
+            'expect': EXPECT,
+        })
+        remaining -= count
+
+    return {
+        'defaults': {
+            'bypass_proxy': ['127.0.0.1', 'localhost'],
+            'request': {
+                'url_template': f"{url}{{path}}",
+                'method': 'GET',
+                'timeout': {'connect': 2, 'read': 10},
+                'pool': {'connections': 10, 'maxsize': 64},
+                'headers': {'Accept': 'application/json'},
+            },
+        },
+        'requests': items,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic collection")
+    parser.add_argument("requests", type=int, help="Number of requests after expansion")
+    parser.add_argument("--url", default="http://127.0.0.1:8099")
+    parser.add_argument("--expansion", type=int, default=10, help="Requests per collection item")
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+    with open(args.output, 'w') as f:
+        yaml.safe_dump(collection(args.requests, args.url, args.expansion), f, sort_keys=False)
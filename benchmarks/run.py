@@ -0,0 +1,226 @@
+"""
+Benchmarks of the collection parsing, the request/assert pipeline and the assertion engine.
+Each scenario runs in its own process, so its peak RSS is not inflated by the others.
+
+    python benchmarks/run.py                   # run and compare with baselines.json
+    python benchmarks/run.py --save            # run and store the results as the new baselines
+    python benchmarks/run.py --quick           # smaller sizes, for a smoke test
+
+The exit status is 1 when a metric is worse than its baseline by more than --tolerance.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'app'))
+
+import globals
+# Only warnings and reports, logged from a background thread
+globals.quiet = True
+
+import generate
+import stub_server
+
+BASELINES = os.path.join(HERE, 'baselines.json')
+# Whether a higher value of a metric is better
+HIGHER_IS_BETTER = {
+    'parse_s': False,
+    'expand_s': False,
+    'requests_per_s': True,
+    'evals_per_s': True,
+    'peak_rss_mb': False,
+}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def bench_parse(requests):
+    """
+    Load a generated YAML collection and expand it, as main does before sending anything
+    """
+    from collection import Collection
+
+    with tempfile.NamedTemporaryFile('w', suffix='.yaml', delete=False) as f:
+        yaml.safe_dump(generate.collection(requests), f, sort_keys=False)
+    try:
+        start = time.perf_counter()
+        with open(f.name) as source:
+            data = yaml.safe_load(source)
+        collection = Collection(data)
+        parsed = time.perf_counter()
+        expanded = sum(1 for _ in collection.iter_requests())
+        end = time.perf_counter()
+    finally:
+        os.unlink(f.name)
+
+    assert expanded == requests, f"{expanded} requests expanded instead of {requests}"
+    return {'parse_s': round(parsed - start, 4), 'expand_s': round(end - parsed, 4)}
+
+
+def bench_assertions(requests):
+    """
+    Evaluate the expectations of every request against a canned response, no network involved
+    """
+    from agent import Agent
+    from collection import Collection
+    from requests.structures import CaseInsensitiveDict
+
+    collection = Collection(generate.collection(requests))
+    agent = Agent()
+    response = {
+        "body": {"id": 1, "status": "ok", "items": [{"id": i} for i in range(3)]},
+        "headers": CaseInsensitiveDict({"Content-Type": "application/json"}),
+        "status_code": 200,
+        "error": "",
+        "elapsed_ms": 12.5,
+        "size_bytes": 256,
+    }
+    evaluated = 0
+    start = time.perf_counter()
+    for request in collection.iter_requests():
+        evaluated += len(agent.evaluate_response(request, response))
+    elapsed = time.perf_counter() - start
+    return {'evals_per_s': round(evaluated / elapsed, 1)}
+
+
+def bench_send(requests, concurrency, latency, payload, statuses):
+    """
+    Send the requests to the stub server through the Executor, assertions included
+    """
+    from agent import Agent
+    from collection import Collection
+    from executor import Executor
+
+    server = stub_server.start(latency=latency, payload=payload, statuses=statuses)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    collection = Collection(generate.collection(requests, url))
+    try:
+        start = time.perf_counter()
+        Executor(Agent(), concurrency, on_result=collection.record).run(collection.iter_requests(), requests)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+
+    assert collection.counters['requests'] == requests
+    return {'requests_per_s': round(requests / elapsed, 1)}
+
+
+BENCHMARKS = {
+    'parse': bench_parse,
+    'assertions': bench_assertions,
+    'send': bench_send,
+}
+
+
+def child(name, kwargs, repeat, results):
+    # The failed assertions of the status mix would flood the output
+    logging.disable(logging.ERROR)
+    # Keep the best value of each metric, the others mostly measure noise
+    metrics = {}
+    for _ in range(repeat):
+        for metric, value in BENCHMARKS[name](**kwargs).items():
+            best = max if HIGHER_IS_BETTER[metric] else min
+            metrics[metric] = best(value, metrics.get(metric, value))
+    metrics['peak_rss_mb'] = peak_rss_mb()
+    results.put(metrics)
+
+
+def run_isolated(name, kwargs, repeat=1):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=child, args=(name, kwargs, repeat, results))
+    process.start()
+    metrics = results.get()
+    process.join()
+    return metrics
+
+
+def scenarios(args):
+    sizes = [1000, 10000] if args.quick else [1000, 10000, 100000]
+    for size in sizes:
+        yield f"parse-{size}", 'parse', {'requests': size}
+        yield f"assertions-{size}", 'assertions', {'requests': size}
+    # Same size in quick mode, so the send pipeline is still compared with its baseline
+    yield f"send-{args.send}-c{args.concurrency}", 'send', {
+        'requests': args.send, 'concurrency': args.concurrency,
+        'latency': args.latency, 'payload': args.payload, 'statuses': args.statuses,
+    }
+
+
+def compare(results, baselines, tolerance):
+    """
+    :return: list of the metrics worse than their baseline by more than the tolerance
+    """
+    regressions = []
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            baseline = baselines.get(scenario, {}).get(metric)
+            if not baseline:
+                continue
+            change = (value - baseline) / baseline
+            if not HIGHER_IS_BETTER[metric]:
+                change = -change
+            if change < -tolerance:
+                regressions.append(f"{scenario} {metric}: {value} vs baseline {baseline} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmarks")
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baselines")
+    parser.add_argument("--quick", action="store_true", help="Skip the largest collections")
+    parser.add_argument("--only", help="Run the scenarios whose name starts with this prefix")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Allowed slowdown before failing, 0.5 is 50%%")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each scenario, the best one is kept")
+    parser.add_argument("--send", type=int, default=2000, help="Requests sent to the stub server")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=2.0, help="Stub server latency, in milliseconds")
+    parser.add_argument("--payload", type=int, default=1024, help="Stub server body padding, in bytes")
+    parser.add_argument("--statuses", default="200:95,500:5", help="Stub server status mix")
+    args = parser.parse_args()
+
+    results = {}
+    for scenario, name, kwargs in scenarios(args):
+        if args.only and not scenario.startswith(args.only):
+            continue
+        results[scenario] = run_isolated(name, kwargs, args.repeat)
+        print(f"{scenario:24} {json.dumps(results[scenario])}")
+
+    if args.save:
+        baselines = {}
+        if os.path.exists(BASELINES):
+            with open(BASELINES) as f:
+                baselines = json.load(f)
+        baselines.update(results)
+        with open(BASELINES, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baselines saved to {BASELINES}")
+        return 0
+
+    if not os.path.exists(BASELINES):
+        print("No baselines to compare with, run with --save first")
+        return 0
+    with open(BASELINES) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
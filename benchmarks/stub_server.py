@@ -0,0 +1,91 @@
+"""
+Local HTTP server answering every GET with a JSON document, for the benchmarks.
+
+    python benchmarks/stub_server.py --port 8099 --latency 5 --payload 2048 --statuses 200:95,500:5
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_statuses(mix):
+    """
+    :param mix: comma separated status:weight pairs, e.g. "200:95,500:5"
+    :return: list of (status, cumulative weight)
+    """
+    cumulative = []
+    total = 0
+    for entry in mix.split(','):
+        status, _, weight = entry.partition(':')
+        total += int(weight or 1)
+        cumulative.append((int(status), total))
+    return cumulative
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, Nagle would delay the body by an ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        settings = self.server.settings
+        if settings['latency']:
+            time.sleep(settings['latency'] / 1000)
+
+        # The status only depends on the path, so runs are reproducible
+        draw = random.Random(self.path).uniform(0, settings['statuses'][-1][1])
+        status = next(status for status, weight in settings['statuses'] if draw <= weight)
+
+        body = json.dumps({
+            "id": zlib.crc32(self.path.encode()) % 100000,
+            "path": self.path,
+            "status": "ok" if status < 400 else "error",
+            "items": [{"id": i, "name": f"item-{i}"} for i in range(3)],
+            "padding": "x" * settings['payload'],
+        }).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_HEAD = do_GET
+
+
+def start(port=0, latency=0.0, payload=256, statuses="200"):
+    """
+    Serve from a background thread
+    :param port: 0 for any free port
+    :param latency: milliseconds to wait before answering
+    :param payload: size of the padding in the body, in bytes
+    :param statuses: status mix, see parse_statuses
+    :return: the server, its port is server.server_address[1]
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.settings = {'latency': latency, 'payload': payload, 'statuses': parse_statuses(statuses)}
+    threading.Thread(target=server.serve_forever, name="stub-server", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub HTTP server for the benchmarks")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="Milliseconds before each response")
+    parser.add_argument("--payload", type=int, default=256, help="Bytes of padding in each body")
+    parser.add_argument("--statuses", default="200", help="Status mix, e.g. 200:95,500:5")
+    args = parser.parse_args()
+    server = start(args.port, args.latency, args.payload, args.statuses)
+    print(f"Listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,42 @@
+import logging
+import unittest
+from unittest.mock import MagicMock
+
+import agent
+from agent import Agent, AssertionResult
+from logger import REPORT
+
+
+class TestAgent(unittest.TestCase):
+
+    def setUp(self):
+        self.level = agent.logger.level
+
+    def tearDown(self):
+        agent.logger.setLevel(self.level)
+
+    def test_passed_check_builds_no_message_in_quiet_mode(self):
+        agent.logger.setLevel(REPORT)
+        check = MagicMock()
+        Agent().record(AssertionResult(True, 'status_code', check, 200))
+        check.message.assert_not_called()
+
+    def test_message_is_built_when_logged(self):
+        agent.logger.setLevel(logging.INFO)
+        check = MagicMock()
+        check.message.return_value = "status_code equals 200"
+        with self.assertLogs(agent.logger, logging.INFO) as logs:
+            Agent().record(AssertionResult(True, 'status_code', check, 200))
+        self.assertEqual(logs.output, ["INFO:agent:Assertion passed: status_code equals 200"])
+
+    def test_failed_message_is_not_repeated(self):
+        agent.logger.setLevel(logging.INFO)
+        check = MagicMock()
+        check.message.return_value = "status_code equals 200"
+        with self.assertLogs(agent.logger, logging.INFO) as logs:
+            Agent().record(AssertionResult(False, 'status_code', check, 404))
+        self.assertEqual(logs.output, ["ERROR:agent:Assertion failed: status_code equals 200"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import json
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agent import Agent
+from archive import Recorder, Replayer
+from collection import Collection
+from executor import Executor
+
+
+class JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = json.dumps({"path": self.path}).encode()
+        self.send_response(404 if self.path.endswith('missing') else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def outcomes(collection):
+    return {request.id: (request.response['status_code'], request.response['body'],
+                         [assertion.status for assertion in request.assertions])
+            for request in collection.get_items().values()}
+
+
+class TestArchive(unittest.TestCase):
+
+    def test_record_and_replay(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), JsonHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        data = {'requests': [
+            {'name': name, 'invoke': {'url': f"{url}/{name}", 'headers': {'Authorization': 'Bearer secret'}},
+             'expect': {'status_code': [{'equals': 200}], 'body.$.path': [{'equals': f"/{name}"}]}}
+            for name in ('a', 'b', 'missing')
+        ]}
+
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                collection = Collection(data)
+                recorder = Recorder(directory)
+                Executor(Agent(), 2, recorder=recorder).run(collection.iter_requests())
+                recorder.close()
+            finally:
+                server.shutdown()
+                server.server_close()
+            recorded = outcomes(collection)
+
+            # The server is gone, the responses come from the archive
+            collection = Collection(data)
+            replayer = Replayer(directory)
+            try:
+                Executor(Agent(), 2, replayer=replayer).run(collection.iter_requests())
+            finally:
+                replayer.close()
+            replayed = outcomes(collection)
+
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(recorded[3], (404, {'path': '/missing'}, [False, True]))
+
+    def test_replay_without_recording(self):
+        with tempfile.TemporaryDirectory() as directory:
+            Recorder(directory).close()
+            replayer = Replayer(directory)
+            try:
+                request = next(Collection({'requests': [{'name': 'a', 'invoke': {'url': 'http://localhost/a'}}]})
+                               .iter_requests())
+                self.assertEqual(replayer.get(request)['error'], "No recorded response")
+            finally:
+                replayer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from checks import compile_plan, compile_check
+
+
+class TestChecks(unittest.TestCase):
+
+    def test_compile_plan(self):
+        plan = compile_plan({
+            'status_code': [{'equals': 200}, {'in_range': '200:299'}],
+            'body': [{'matches': r'\{.*\}'}],
+        })
+        self.assertEqual([(prop, check.name) for prop, check in plan],
+                         [('status_code', 'equals'), ('status_code', 'in_range'), ('body', 'matches')])
+
+    def test_compile_plan_rejects_malformed_expectations(self):
+        with self.assertRaises(ValueError):
+            compile_plan({'status_code': [{'between': 200}]})
+        with self.assertRaises(ValueError):
+            compile_plan({'status_code': [{'in_range': '200-299'}]})
+        with self.assertRaises(ValueError):
+            compile_plan({'body': [{'matches': '('}]})
+        with self.assertRaises(ValueError):
+            compile_plan({'status': [{'equals': 200}]})
+
+    def test_in_range_sorts_numerically(self):
+        check = compile_check('in_range', '100:99')
+        self.assertTrue(check.evaluate(99))
+        self.assertTrue(check.evaluate('100'))
+        self.assertFalse(check.evaluate(101))
+
+    def test_contains(self):
+        self.assertTrue(compile_check('contains', ['id', 'value']).evaluate({'id': 1, 'value': 2}))
+        self.assertTrue(compile_check('contains', {'id': 1}).evaluate({'id': 1, 'value': 2}))
+        self.assertFalse(compile_check('contains', {'id': 2}).evaluate({'id': 1}))
+        self.assertFalse(compile_check('contains', 'id').evaluate(None))
+
+    def test_equals_unordered_option(self):
+        plan = compile_plan({'body': [{'equals': {'ids': [1, 2]}, 'unordered': True}]})
+        (prop, check), = plan
+        self.assertTrue(check.evaluate({'ids': [2, 1]}))
+        self.assertIn("$.ids[0]", check.message(prop, {'ids': [2, 3]}))
+        with self.assertRaises(ValueError):
+            compile_plan({'body': [{'equals': {}, 'ordered': False}]})
+
+    def test_check_name_does_not_depend_on_key_order(self):
+        for test in ({'equals': {'ids': [1, 2]}, 'unordered': True}, {'unordered': True, 'equals': {'ids': [1, 2]}}):
+            (prop, check), = compile_plan({'body': [test]})
+            self.assertEqual(check.name, 'equals')
+            self.assertTrue(check.evaluate({'ids': [2, 1]}))
+        for test in ({'unordered': True, 'ordered': False}, {'equals': 1, 'greater': 0}):
+            with self.assertRaises(ValueError):
+                compile_plan({'body': [test]})
+
+    def test_type(self):
+        self.assertTrue(compile_check('type', 'dict').evaluate({}))
+        self.assertFalse(compile_check('type', 'int').evaluate(True))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,36 +1,10 @@
 import unittest
-from unittest.mock import patch, mock_open, MagicMock
+from unittest.mock import patch, MagicMock
 from app.collection import Collection
+from agent import AssertionResult
 
 class TestCollection(unittest.TestCase):
 
-    @patch('builtins.open', new_callable=mock_open, read_data="key=value\nanother_key=another_value")
-    def test_load_config(self, mock_file):
-        config = load_config('config.yaml')
-        self.assertIsInstance(config, dict)
-
-    @patch('builtins.open', new_callable=mock_open, read_data="key=value\nanother_key=another_value")
-    def test_configure_collection_with_env(self, mock_file):
-        collection = configure_collection('config.yaml', 'env.file', verbose=True)
-        self.assertIsInstance(collection, Collection)
-
-    @patch('builtins.open', new_callable=mock_open, read_data="key=value\nanother_key=another_value")
-    def test_configure_collection_without_env(self, mock_file):
-        collection = configure_collection('config.yaml', verbose=True)
-        self.assertIsInstance(collection, Collection)
-
-    @patch('builtins.open', new_callable=mock_open, read_data="key=value\nanother_key=another_value")
-    def test_setup_logging_to_file(self, mock_file):
-        logger = setup_logging('logfile.log')
-        self.assertEqual(len(logger.handlers), 1)
-        self.assertIsInstance(logger.handlers[0], logging.FileHandler)
-
-    @patch('builtins.open', new_callable=mock_open, read_data="key=value\nanother_key=another_value")
-    def test_setup_logging_to_stdout(self, mock_file):
-        logger = setup_logging()
-        self.assertEqual(len(logger.handlers), 1)
-        self.assertIsInstance(logger.handlers[0], logging.StreamHandler)
-
     def test_collection_append(self):
         collection = Collection()
         request = MagicMock()
@@ -44,6 +18,21 @@ class TestCollection(unittest.TestCase):
         items = collection.get_items()
         self.assertEqual(len(items), 1)
 
+    def test_collection_filter_by_tag_expression(self):
+        collection = Collection({'requests': [
+            {'name': 'a', 'tags': ['smoke'], 'invoke': {'url': 'http://localhost/a'}},
+            {'name': 'b', 'tags': ['smoke', 'slow'], 'invoke': {'url': 'http://localhost/b'}},
+            {'name': 'c', 'tags': 'slow', 'invoke': {'url': 'http://localhost/c'}},
+        ]})
+        self.assertEqual([template['attributes']['name'] for template in collection.select_templates(['smoke and not slow'])], ['a'])
+        self.assertEqual([template['attributes']['name'] for template in collection.select_templates(['smoke', 'slow'])], ['b'])
+        self.assertEqual([template['attributes']['name'] for template in collection.select_templates(suites=['c'])], ['c'])
+
+        requests = list(collection.iter_requests(['slow']))
+        self.assertEqual([request.name for request in requests], ['b', 'c'])
+        self.assertEqual(list(collection.filter_requests(['not smoke'])), [requests[1].id])
+        self.assertEqual(collection.tags, ['slow', 'smoke'])
+
     def test_collection_build_report(self):
         collection = Collection()
         request = MagicMock()
@@ -53,5 +42,73 @@ class TestCollection(unittest.TestCase):
             collection.build_report()
             self.assertTrue(mock_logger.info.called)
 
+    def test_collection_record_updates_report(self):
+        collection = Collection()
+        request = MagicMock()
+        request.assertions = [AssertionResult(True), AssertionResult(False)]
+        collection.append(request)
+        collection.record(request)
+        report = collection.build_report()
+        self.assertEqual(report['total_requests'], 1)
+        self.assertEqual((report['passed_assertions'], report['failed_assertions']), (1, 1))
+        self.assertEqual(report['failing_requests'], {request.id: request.name})
+
+    def test_collection_shards_keep_the_ids(self):
+        data = {'requests': [
+            {'name': name, 'invoke': {'url': f'http://localhost/{name}'}} for name in 'abcdef'
+        ]}
+        ids = {request.id: request.name for request in Collection(data).iter_requests()}
+        sharded = {}
+        for index in range(3):
+            collection = Collection(data)
+            sharded.update({request.id: request.name for request in collection.iter_requests(shard=('suite', index, 3))})
+        self.assertEqual(sharded, ids)
+
+    def test_collection_merge_worker_results(self):
+        collection = Collection()
+        collection.merge({'id': 7, 'name': 'a', 'retries': 2, 'retry_ms': 10.0,
+                          'assertions': [{'check': 'status_code.equals', 'status': False, 'message': 'failed'}]})
+        collection.merge_stats({'localhost': {'requests': 3, 'connections': 1, 'reused': 2}}, {})
+        report = collection.build_report(total=2)
+        self.assertEqual((report['total_requests'], report['failed_assertions'], report['retries']), (1, 1, 2))
+        self.assertEqual(report['failing_requests'], {7: 'a'})
+        self.assertEqual(report['not_sent'], 1)
+        self.assertEqual(report['connections']['localhost']['reused'], 2)
+
+    def test_collection_reset_results_keeps_templates(self):
+        collection = Collection({'requests': [{'name': 'a', 'interval': 30, 'invoke': {'url': 'http://localhost/a'}}]})
+        request = next(collection.iter_requests())
+        request.assertions = [AssertionResult(False)]
+        collection.record(request)
+        collection.reset_results()
+        self.assertEqual((collection.counters['requests'], collection.failing, collection.requests), (0, {}, {}))
+        self.assertEqual(next(collection.iter_requests()).id, 1)
+        self.assertEqual(collection.templates[0]['attributes']['interval'], 30)
+
+    def test_collection_dependencies(self):
+        data = {'requests': [
+            {'name': 'login', 'capture': {'token': 'body.token'}, 'invoke': {'url': 'http://auth/login'}},
+            {'name': 'order', 'depends_on': 'login', 'tags': ['orders'], 'invoke': {'url': 'http://api/orders'}},
+            {'name': 'other', 'invoke': {'url': 'http://api/other'}},
+        ]}
+        collection = Collection(data)
+        self.assertEqual([template['attributes']['name'] for template in collection.select_templates(['orders'])],
+                         ['login', 'order'])
+        graph = collection.graph(['orders'])
+        self.assertEqual((graph.dependencies, graph.remaining, graph.expected),
+                         ({'order': {'login'}}, {'login': 1}, {'login': {'token'}}))
+        self.assertIsNone(collection.graph(suites=['other']))
+
+        # Sharded by host, the two suites still go to the same worker
+        shards = [[request.name for request in Collection(data).iter_requests(shard=('host', index, 2))]
+                  for index in range(2)]
+        self.assertIn(['login', 'order'], [[name for name in shard if name != 'other'] for shard in shards])
+
+        for requests in ([{'name': 'a', 'depends_on': 'b', 'invoke': {'url': 'http://a'}}],
+                         [{'name': 'a', 'depends_on': 'b', 'invoke': {'url': 'http://a'}},
+                          {'name': 'b', 'depends_on': 'a', 'invoke': {'url': 'http://b'}}]):
+            with self.assertRaises(ValueError):
+                Collection({'requests': requests})
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,31 @@
+import unittest
+from compare import first_difference
+
+
+class TestCompare(unittest.TestCase):
+
+    def test_equal_values(self):
+        self.assertIsNone(first_difference({"a": [1, {"b": "x y"}]}, {"a": [1, {"b": "x y"}]}))
+        self.assertIsNone(first_difference(1, 1.0))
+
+    def test_whitespace_inside_strings_matters(self):
+        self.assertEqual(first_difference({"token": "Bearer a"}, {"token": "Bearera"}),
+                         ("$.token", "expected <Bearer a>, got <Bearera>"))
+
+    def test_reports_path_of_first_difference(self):
+        self.assertEqual(first_difference({"a": [{"b": 1}, {"b": 2}]}, {"a": [{"b": 1}, {"b": 3}]})[0], "$.a[1].b")
+        self.assertEqual(first_difference({"a": 1}, {"a": 1, "b": 2}), ("$.b", "unexpected <2>"))
+        self.assertEqual(first_difference({"a": 1, "b": 2}, {"a": 1}), ("$.b", "missing"))
+        self.assertEqual(first_difference([1, 2], [1]), ("$", "expected 2 items, got 1"))
+
+    def test_booleans_are_not_numbers(self):
+        self.assertIsNotNone(first_difference({"a": 1}, {"a": True}))
+
+    def test_unordered_lists(self):
+        self.assertIsNotNone(first_difference([1, 2, 3], [3, 2, 1]))
+        self.assertIsNone(first_difference([1, 2, 3], [3, 2, 1], unordered=True))
+        self.assertIsNone(first_difference([{"id": 1}, {"id": 2}], [{"id": 2}, {"id": 1}], unordered=True))
+        self.assertEqual(first_difference([1, 1, 2], [1, 2, 2], unordered=True), ("$[0]", "no match for <1>"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from compiled import cache_key
+
+
+class TestCompiled(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.collection = os.path.join(self.directory.name, "collection.yaml")
+        self.env = os.path.join(self.directory.name, ".env")
+        with open(self.collection, 'w') as f:
+            f.write("defaults:\n  host: ${HOST}\n")
+        with open(self.env, 'w') as f:
+            f.write("HOST=localhost\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_cache_key_is_stable(self):
+        self.assertEqual(cache_key(self.collection, self.env), cache_key(self.collection, self.env))
+
+    def test_cache_key_follows_the_inputs(self):
+        key = cache_key(self.collection, self.env)
+        with open(self.env, 'a') as f:
+            f.write("PORT=80\n")
+        self.assertNotEqual(cache_key(self.collection, self.env), key)
+
+        key = cache_key(self.collection, self.env)
+        with mock.patch.dict(os.environ, {"HOST": "example.com"}):
+            self.assertNotEqual(cache_key(self.collection, self.env), key)
+
+        with open(self.collection, 'a') as f:
+            f.write("  port: 80\n")
+        self.assertNotEqual(cache_key(self.collection, self.env), key)
+
+    def test_cache_key_follows_the_pickled_modules(self):
+        import retry
+        key = cache_key(self.collection, self.env)
+        getmtime = os.path.getmtime
+        with mock.patch('compiled.os.path.getmtime',
+                        side_effect=lambda path: getmtime(path) + (path == retry.__file__)):
+            self.assertNotEqual(cache_key(self.collection, self.env), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
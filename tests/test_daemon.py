@@ -0,0 +1,124 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from collection import Collection
+from daemon import Daemon, RELOAD_CHECK_INTERVAL
+from tokens import TokenStore
+
+
+def collection_data(*suites):
+    """
+    :param suites: (name, interval) pairs, None for the default interval
+    """
+    return {'requests': [{'name': name, 'interval': interval, 'invoke': {'url': f"http://localhost/{name}"}}
+                         for name, interval in suites]}
+
+
+class Clock:
+    """
+    time.monotonic of the daemon, only moving forward when the daemon waits or runs suites
+    """
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        TokenStore._instance = None
+        self.clock = Clock()
+        self.mtimes = (1.0, 1.0)
+        self.loaded = [collection_data(('a', 10), ('b', None))]
+        self.runs = []
+        self.loads = 0
+        patches = [
+            patch('daemon.time.monotonic', self.clock),
+            patch('daemon.signal.signal'),
+            patch('daemon.load_collection', side_effect=self.load_collection),
+            patch.object(Daemon, 'file_mtimes', lambda daemon: self.mtimes),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.daemon = Daemon("collection.yaml", interval=30)
+
+    def tearDown(self):
+        TokenStore._instance = None
+
+    def load_collection(self, *args):
+        self.loads += 1
+        data = self.loaded.pop(0) if len(self.loaded) > 1 else self.loaded[0]
+        return {}, Collection(data)
+
+    def run_until(self, end, on_run=None):
+        """
+        Run the daemon until the clock reaches end, the runs of suites taking no time unless on_run says so
+        """
+        def run_suites(suites):
+            self.runs.append((self.clock.now, suites))
+            if on_run:
+                on_run()
+            if self.clock.now >= end:
+                self.daemon.stop()
+
+        def wait(timeout):
+            self.clock.now += timeout
+            if self.clock.now >= end:
+                self.daemon.stop()
+            return self.daemon.stopping.is_set()
+
+        self.daemon.stopping.wait = wait
+        with patch.object(self.daemon, 'run_suites', side_effect=run_suites):
+            self.daemon.run()
+
+    def test_each_suite_runs_on_its_own_interval(self):
+        self.run_until(60)
+        self.assertEqual(self.runs, [(0.0, ['a', 'b']), (10.0, ['a']), (20.0, ['a']), (30.0, ['a', 'b']),
+                                     (40.0, ['a']), (50.0, ['a'])])
+
+    def test_missed_runs_are_skipped(self):
+        # The first run takes 25s, the runs of <a> at 10s and 20s are skipped rather than caught up
+        def slow_first_run():
+            if len(self.runs) == 1:
+                self.clock.now += 25
+        self.run_until(45, on_run=slow_first_run)
+        self.assertEqual(self.runs, [(0.0, ['a', 'b']), (30.0, ['a', 'b']), (40.0, ['a'])])
+
+    def test_reload_when_the_files_change(self):
+        self.loaded = [collection_data(('a', 10), ('b', None)), collection_data(('a', 10), ('c', 20))]
+
+        def change():
+            self.mtimes = (2.0, 1.0)
+        self.run_until(30, on_run=change)
+        # Checked every RELOAD_CHECK_INTERVAL, <a> keeps its next run, <c> starts right away
+        self.assertEqual(self.runs[:3], [(0.0, ['a', 'b']), (RELOAD_CHECK_INTERVAL, ['c']), (10.0, ['a'])])
+        self.assertEqual(set(self.daemon.schedule), {'a', 'c'})
+        self.assertEqual((self.loads, self.daemon.mtimes), (2, (2.0, 1.0)))
+
+    def test_no_reload_without_changes(self):
+        self.run_until(30)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(set(self.daemon.schedule), {'a', 'b'})
+
+    def test_invalid_collection_keeps_the_previous_one(self):
+        # The second version has a request without url, it fails half way through the parsing
+        self.loaded = [collection_data(('a', 10), ('b', None)), {'requests': [{'name': 'c', 'invoke': {}}]}]
+        writer = MagicMock()
+        self.daemon.writer = writer
+        self.daemon.reload()
+        schedule = dict(self.daemon.schedule)
+
+        self.mtimes = (2.0, 1.0)
+        with self.assertLogs('daemon', 'ERROR'):
+            self.daemon.safe_reload()
+        self.assertEqual(self.daemon.schedule, schedule)
+        self.assertEqual([template['attributes']['name'] for template in self.daemon.collection.templates], ['a', 'b'])
+        self.assertEqual(self.daemon.collection.writers, [writer])
+        self.assertEqual(self.daemon.collection.count(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
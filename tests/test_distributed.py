@@ -0,0 +1,37 @@
+import queue
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+from distributed import MAX_SHARD_ATTEMPTS, Coordinator, remote_spec
+
+
+class TestDistributed(unittest.TestCase):
+
+    def test_runner_reports_a_failing_shard(self):
+        coordinator = Coordinator({'by': 'suite'}, shards=1)
+        pending, finished = queue.Queue(), queue.Queue()
+        pending.put((0, 1))
+        run = MagicMock(side_effect=RuntimeError("Rate limits do not allow any request to be sent"))
+
+        runner = threading.Thread(target=coordinator.runner, args=(run, pending, finished, MagicMock()), daemon=True)
+        runner.start()
+        # Tried again, then reported as lost rather than killing the runner
+        self.assertEqual(finished.get(timeout=5), (0, None))
+        self.assertEqual(run.call_count, MAX_SHARD_ATTEMPTS)
+        pending.put(None)
+        runner.join(timeout=5)
+        self.assertFalse(runner.is_alive())
+
+    def test_remote_spec_ignores_local_paths(self):
+        spec = remote_spec({'collection': '/etc/passwd', 'env': '/root/.env', 'cache_dir': '/tmp/evil',
+                            'collection_text': 'requests: []', 'tags': ['smoke'], 'index': 1, 'count': 2})
+        self.assertEqual((spec['collection'], spec['env'], spec['cache_dir']), ('collection.yaml', None, None))
+        self.assertEqual((spec['collection_text'], spec['tags'], spec['index']), ('requests: []', ['smoke'], 1))
+        for spec in ({'collection': '/etc/passwd'}, ['collection_text']):
+            with self.assertRaises(ValueError):
+                remote_spec(spec)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agent import Agent
+from collection import Collection
+from executor import Executor
+
+
+class DelayedHandler(BaseHTTPRequestHandler):
+    """
+    Answer /<delay ms>/<status> after that delay, so responses come back out of order
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        delay, status = self.path.strip('/').split('/')
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.highest = max(self.server.highest, self.server.in_flight)
+        time.sleep(int(delay) / 1000)
+        with self.server.lock:
+            self.server.in_flight -= 1
+        body = json.dumps({"status": int(status)}).encode()
+        self.send_response(int(status))
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), DelayedHandler)
+        self.server.lock = threading.Lock()
+        self.server.in_flight = self.server.highest = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        # The first requests are the slowest, every third one fails
+        self.data = {'requests': [
+            {'name': f"r{index}", 'invoke': {'url': f"{url}/{(8 - index) * 40}/{404 if index % 3 == 0 else 200}"},
+             'expect': {'status_code': [{'equals': 200}], 'body.$.status': [{'equals': 200}]}}
+            for index in range(8)
+        ]}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run_collection(self, concurrency):
+        collection = Collection(self.data)
+        finished = []
+
+        def on_result(request):
+            finished.append((request.id, [assertion.status for assertion in request.assertions]))
+            collection.record(request)
+
+        Executor(Agent(), concurrency, on_result=on_result).run(collection.iter_requests())
+        return finished, collection.build_report(len(self.data['requests']))
+
+    def test_results_do_not_depend_on_the_completion_order(self):
+        sequential, sequential_report = self.run_collection(1)
+        concurrent, concurrent_report = self.run_collection(4)
+
+        self.assertEqual([request_id for request_id, _ in sequential], list(range(1, 9)))
+        # The responses did come back out of order
+        self.assertNotEqual([request_id for request_id, _ in concurrent], list(range(1, 9)))
+        self.assertEqual(sorted(concurrent), sequential)
+
+        self.assertEqual(concurrent_report['failing_requests'], {1: 'r0', 4: 'r3', 7: 'r6'})
+        self.assertEqual(list(concurrent_report['failing_requests']), [1, 4, 7])
+        for key in ('total_requests', 'total_assertions', 'failed_assertions', 'passed_assertions',
+                    'failing_requests', 'not_sent'):
+            self.assertEqual(concurrent_report[key], sequential_report[key])
+
+    def test_concurrency_is_bounded(self):
+        _, report = self.run_collection(3)
+        self.assertEqual(self.server.highest, 3)
+        self.assertEqual(report['total_requests'], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+
+from graph import WAITING, DependencyGraph, ancestors, compile_captures, flows_of
+from request import Request, RequestTemplate, substitute_json
+
+
+def request(suite, request_id, url='http://localhost/', capture=None):
+    template = RequestTemplate({'suite': suite, 'capture': capture, 'headers': {'authorization': 'Bearer $token'},
+                                'payload': '{"order": "$order_id", "note": "for $token"}'})
+    expanded = Request.expand(template, url)
+    expanded.id = request_id
+    return expanded
+
+
+class TestGraph(unittest.TestCase):
+
+    def test_compile_captures(self):
+        self.assertIsNone(compile_captures(None))
+        captures = compile_captures({'order_id': 'body.id', 'first': 'body.$.items[0]', 'location': 'headers.Location',
+                                     'status': 'status_code'})
+        self.assertTrue(captures.needs_body)
+        response = {'body': {'id': 7, 'items': ['a']}, 'headers': {'location': '/orders/7'}, 'status_code': 201}
+        self.assertEqual(captures.resolve(response),
+                         {'order_id': 7, 'first': 'a', 'location': '/orders/7', 'status': 201})
+        self.assertEqual(captures.resolve({'body': '', 'headers': {}, 'status_code': ''}), {})
+        self.assertFalse(compile_captures({'location': 'headers.location'}).needs_body)
+        for capture in ({'id': 'body.items['}, {'id': 'cookies'}, {'order id': 'body.id'}, ['body.id']):
+            with self.assertRaises(ValueError):
+                compile_captures(capture)
+
+    def test_ancestors_and_flows(self):
+        dependencies = {'order': {'login'}, 'invoice': {'order', 'login'}, 'other': {'setup'}}
+        self.assertEqual(ancestors(dependencies, 'invoice'), ['login', 'order'])
+        self.assertEqual(flows_of(dependencies), {'order': 'invoice', 'login': 'invoice', 'invoice': 'invoice',
+                                                  'other': 'other', 'setup': 'other'})
+
+    def test_schedule(self):
+        graph = DependencyGraph({'order': {'login'}}, {'login': 2}, {'login': {'token'}})
+        login = [request('login', 1, capture={'token': 'body.token'}), request('login', 2, capture={'token': 'body.token'})]
+        order = request('order', 3, 'http://localhost/orders?token=$token')
+        other = request('other', 4)
+
+        scheduled = graph.schedule([order, *login, other])
+        self.assertEqual(next(scheduled), login[0])
+        self.assertEqual(next(scheduled), login[1])
+        self.assertEqual(next(scheduled), other)
+        self.assertIs(next(scheduled), WAITING)
+        for position, item in enumerate(login):
+            item.response = {'body': {'token': f'abc{position}'}}
+            graph.done(item)
+        graph.done(other)
+        # The last request of the expansion wins
+        self.assertEqual(next(scheduled), order)
+        self.assertEqual(order.url, 'http://localhost/orders?token=abc1')
+        self.assertEqual(order.headers, {'authorization': 'Bearer abc1'})
+        self.assertEqual(order.json, {'order': '$order_id', 'note': 'for abc1'})
+        self.assertEqual(login[0].headers, {'authorization': 'Bearer $token'})
+        self.assertEqual(list(scheduled), [])
+
+    def test_schedule_skips_the_dependents_of_a_failure(self):
+        graph = DependencyGraph({'order': {'login'}, 'invoice': {'order'}}, {'login': 1, 'order': 1},
+                                {'login': {'token'}, 'order': set()})
+        login = request('login', 1, capture={'token': 'body.token'})
+        scheduled = graph.schedule([request('invoice', 3), request('order', 2), login])
+        self.assertEqual(next(scheduled), login)
+        login.response = {'body': {}}
+        graph.done(login)
+        self.assertEqual(list(scheduled), [])
+        self.assertEqual(graph.failed, {'login', 'order', 'invoice'})
+
+    def test_schedule_waits_for_a_dependency_done_during_the_release(self):
+        graph = DependencyGraph({'order': {'login'}}, {'login': 1}, {'login': {'token'}})
+        login = request('login', 1, capture={'token': 'body.token'})
+        order = request('order', 2, 'http://localhost/orders?token=$token')
+        release = graph.release
+
+        def release_then_finish_login(parked):
+            released = list(release(parked))
+            if parked and not graph.finished:
+                # The worker thread finishes the dependency right after the release check
+                login.response = {'body': {'token': 'abc'}}
+                graph.done(login)
+            return released
+
+        graph.release = release_then_finish_login
+        scheduled = graph.schedule([login, order])
+        self.assertEqual(next(scheduled), login)
+        self.assertIs(next(scheduled), WAITING)
+        self.assertEqual(next(scheduled), order)
+        self.assertEqual(order.url, 'http://localhost/orders?token=abc')
+        self.assertEqual(graph.failed, set())
+
+    def test_replace_variables(self):
+        variables = {'order_path': '/orders/7', 'cursor': 'a b&c'}
+        url = request('order', 1).replace_variables('http://localhost$order_path?cursor=$cursor&other=$unknown', variables)
+        self.assertEqual(url, 'http://localhost/orders/7?cursor=a%20b%26c&other=$unknown')
+
+    def test_substitute_json(self):
+        document = {'id': '$order_id', 'items': [{'ref': 'order-$order_id'}], 'other': '$unknown', 'n': 1}
+        self.assertEqual(substitute_json(document, {'order_id': 7}),
+                         {'id': 7, 'items': [{'ref': 'order-7'}], 'other': '$unknown', 'n': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
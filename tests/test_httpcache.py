@@ -0,0 +1,133 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from requests.structures import CaseInsensitiveDict
+
+from httpcache import HttpCache
+from request import Request
+
+
+def response(etag='"v1"', vary=None, status_code=200):
+    headers = CaseInsensitiveDict({'ETag': etag, 'Content-Type': 'application/json'})
+    if vary:
+        headers['Vary'] = vary
+    return SimpleNamespace(status_code=status_code, headers=headers, encoding='utf-8')
+
+
+class EtagHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        # One representation per language when the server varies on it
+        language = self.headers.get('accept-language') if self.server.vary else None
+        etag = f'"v1-{language}"' if language else '"v1"'
+        self.server.conditional.append(self.headers.get('if-none-match'))
+        if self.headers.get('if-none-match') == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"id": 1, "language": language}).encode() if language else b'{"id": 1}'
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        if self.server.vary:
+            self.send_header("Vary", "Accept-Language")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestHttpCache(unittest.TestCase):
+
+    def setUp(self):
+        HttpCache._instance = None
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = HttpCache()
+        self.cache.configure({'max_entries': 2}, os.path.join(self.directory.name, 'cache.sqlite'))
+
+    def tearDown(self):
+        self.cache.close()
+        HttpCache._instance = None
+        self.directory.cleanup()
+
+    def test_store_and_lookup(self):
+        self.cache.store('GET', 'http://api/a', {}, response(), b'{"id": 1}')
+        entry = self.cache.lookup('GET', 'http://api/a', {})
+        self.assertEqual((entry.status_code, entry.body, entry.etag), (200, b'{"id": 1}', '"v1"'))
+        self.assertIsNone(self.cache.lookup('GET', 'http://api/b', {}))
+        self.assertIsNone(self.cache.lookup('POST', 'http://api/a', {}))
+
+    def test_not_stored(self):
+        self.cache.store('GET', 'http://api/a', {}, response(etag=None), b'')
+        self.cache.store('GET', 'http://api/b', {}, response(status_code=404), b'')
+        self.cache.store('POST', 'http://api/c', {}, response(), b'')
+        self.cache.store('GET', 'http://api/d', {}, response(vary='*'), b'')
+        self.assertEqual(self.cache.entries, 0)
+
+    def test_vary(self):
+        self.cache.store('GET', 'http://api/a', {'Accept-Language': 'en'}, response(vary='Accept-Language'), b'en')
+        self.assertIsNotNone(self.cache.lookup('GET', 'http://api/a', {'accept-language': 'en'}))
+        self.assertIsNone(self.cache.lookup('GET', 'http://api/a', {'accept-language': 'fr'}))
+
+    def test_variants_are_kept_side_by_side(self):
+        self.cache.store('GET', 'http://api/a', {'Accept-Language': 'en'}, response('"en"', 'Accept-Language'), b'en')
+        self.cache.store('GET', 'http://api/a', {'Accept-Language': 'fr'}, response('"fr"', 'Accept-Language'), b'fr')
+        self.assertEqual(self.cache.lookup('GET', 'http://api/a', {'Accept-Language': 'en'}).body, b'en')
+        self.assertEqual(self.cache.lookup('GET', 'http://api/a', {'Accept-Language': 'fr'}).body, b'fr')
+        self.assertIsNone(self.cache.lookup('GET', 'http://api/a', {'Accept-Language': 'de'}))
+        self.assertEqual(self.cache.entries, 2)
+
+    def test_least_recently_used_is_evicted(self):
+        with patch('httpcache.time.time', side_effect=range(1, 100)):
+            self.cache.store('GET', 'http://api/a', {}, response(), b'a')
+            self.cache.store('GET', 'http://api/b', {}, response(), b'b')
+            self.cache.lookup('GET', 'http://api/a', {})
+            self.cache.store('GET', 'http://api/c', {}, response(), b'c')
+        self.assertIsNotNone(self.cache.lookup('GET', 'http://api/a', {}))
+        self.assertIsNone(self.cache.lookup('GET', 'http://api/b', {}))
+        self.assertIsNotNone(self.cache.lookup('GET', 'http://api/c', {}))
+        self.assertEqual(self.cache.entries, 2)
+
+    def serve(self, vary=False):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), EtagHandler)
+        server.conditional = []
+        server.vary = vary
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, f"http://127.0.0.1:{server.server_address[1]}/a"
+
+    def send(self, url, headers=None):
+        request = Request({'url': url, 'headers': headers or {}, 'expected': {}})
+        request.invoke(read_body=True)
+        return request.response
+
+    def test_revalidated_with_304(self):
+        server, url = self.serve()
+        outcomes = [self.send(url) for _ in range(2)]
+
+        self.assertEqual(server.conditional, [None, '"v1"'])
+        self.assertEqual([outcome['status_code'] for outcome in outcomes], [200, 200])
+        self.assertEqual(outcomes[1]['body'], {'id': 1})
+
+    def test_each_variant_is_revalidated(self):
+        server, url = self.serve(vary=True)
+        outcomes = [self.send(url, {'Accept-Language': language}) for _ in range(2) for language in ('en', 'fr')]
+
+        self.assertEqual(server.conditional, [None, None, '"v1-en"', '"v1-fr"'])
+        self.assertEqual([outcome['body']['language'] for outcome in outcomes], ['en', 'fr', 'en', 'fr'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from jsonpath import compile_path, PathSet
+
+
+class TestJsonPath(unittest.TestCase):
+
+    def test_compile_path(self):
+        self.assertEqual(compile_path("$.items[*].id"), (('key', 'items'), ('wildcard', None), ('key', 'id')))
+        self.assertEqual(compile_path("$['a b'][0]"), (('key', 'a b'), ('index', 0)))
+        with self.assertRaises(ValueError):
+            compile_path("items.id")
+        with self.assertRaises(ValueError):
+            compile_path("$.items[")
+
+    def test_resolve_in_one_pass(self):
+        paths = PathSet()
+        for expression in ("$.id", "$.items[*].id", "$.items[-1].name", "$.missing", "$.meta.*"):
+            paths.add(expression)
+
+        document = {"id": 7, "items": [{"id": 1}, {"id": 2, "name": "b"}], "meta": {"a": 1, "b": 2}}
+        self.assertEqual(paths.resolve(document), {
+            "$.id": 7,
+            "$.items[*].id": [1, 2],
+            "$.items[-1].name": "b",
+            "$.missing": None,
+            "$.meta.*": [1, 2],
+        })
+
+    def test_resolve_non_json_body(self):
+        paths = PathSet()
+        paths.add("$.id")
+        self.assertEqual(paths.resolve("plain text"), {"$.id": None})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from loadtest import LoadRunner, percentile
+
+
+class FakeRequest:
+
+    def __init__(self, request_id, suite, error="", delay=0.0, raises=False):
+        self.id = request_id
+        self.suite = suite
+        self.error = error
+        self.delay = delay
+        self.raises = raises
+        self.sent = 0
+        self.in_flight = None
+
+    def send(self):
+        self.sent += 1
+        if self.in_flight:
+            self.in_flight.enter()
+        time.sleep(self.delay)
+        if self.in_flight:
+            self.in_flight.leave()
+        if self.raises:
+            raise RuntimeError("connection refused")
+        return {'error': self.error}
+
+
+class InFlight:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 0
+        self.highest = 0
+
+    def enter(self):
+        with self.lock:
+            self.current += 1
+            self.highest = max(self.highest, self.current)
+
+    def leave(self):
+        with self.lock:
+            self.current -= 1
+
+
+def agent(statuses=True):
+    agent = MagicMock()
+    agent.evaluate_response.return_value = [SimpleNamespace(status=statuses)]
+    return agent
+
+
+class TestLoadRunner(unittest.TestCase):
+
+    def test_iterations(self):
+        requests = [FakeRequest(1, 'a'), FakeRequest(2, 'b')]
+        report = LoadRunner(agent(), 1000, iterations=3).run(requests)
+        self.assertEqual([request.sent for request in requests], [3, 3])
+        self.assertEqual((report['a']['requests'], report['b']['requests'], report['all']['requests']), (3, 3, 6))
+        self.assertEqual(report['all']['error_rate'], 0.0)
+
+    def test_single_iteration_by_default(self):
+        requests = [FakeRequest(1, 'a')]
+        LoadRunner(agent(), 1000).run(requests)
+        self.assertEqual(requests[0].sent, 1)
+
+    def test_errors(self):
+        requests = [FakeRequest(1, 'ok'), FakeRequest(2, 'error', error="timeout"), FakeRequest(3, 'raises', raises=True)]
+        report = LoadRunner(agent(), 1000, iterations=2).run(requests)
+        self.assertEqual(report['ok']['error_rate'], 0.0)
+        self.assertEqual(report['error']['error_rate'], 1.0)
+        self.assertEqual(report['raises']['error_rate'], 1.0)
+        self.assertAlmostEqual(report['all']['error_rate'], 4 / 6)
+
+        report = LoadRunner(agent(statuses=False), 1000).run([FakeRequest(1, 'failed')])
+        self.assertEqual(report['failed']['error_rate'], 1.0)
+
+    def test_arrival_rate(self):
+        # 20 requests at 100 req/s are spread over about 0.2s, however fast they are answered
+        requests = [FakeRequest(1, 'a')]
+        start = time.perf_counter()
+        report = LoadRunner(agent(), 100, iterations=20).run(requests)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.19)
+        self.assertEqual(report['all']['requests'], 20)
+
+    def test_duration(self):
+        report = LoadRunner(agent(), 100, duration=0.1).run([FakeRequest(1, 'a')])
+        self.assertEqual(report['all']['requests'], 10)
+
+    def test_max_in_flight(self):
+        in_flight = InFlight()
+        requests = [FakeRequest(1, 'a', delay=0.05)]
+        requests[0].in_flight = in_flight
+        report = LoadRunner(agent(), 1000, iterations=12, max_in_flight=3).run(requests)
+        self.assertEqual(in_flight.highest, 3)
+        # Waiting for a free slot counts in the latency
+        self.assertGreater(report['all']['max'], 150)
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ValueError):
+            LoadRunner(agent(), 0)
+
+    def test_nothing_to_send(self):
+        self.assertEqual(LoadRunner(agent(), 10).run([]), {})
+
+
+class TestPercentile(unittest.TestCase):
+
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 90), 90)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile([3.5], 99), 3.5)
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+
+    def test_empty(self):
+        self.assertEqual(percentile([], 50), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import io
+import json
+import logging
+import unittest
+from unittest.mock import patch
+
+import globals
+import logger
+from logger import REPORT, DeferredQueueHandler, StructuredFormatter, setup_logger, stop_logging
+
+
+class TestLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.output = io.StringIO()
+        # The stdout handler is created with the listener, so it writes to the patched stdout
+        patches = [
+            patch('sys.stdout', self.output),
+            patch.object(globals, 'quiet', False),
+            patch.object(globals, 'structured', False),
+            patch.object(globals, 'verbose', 0),
+            patch.object(logger, '_listener', None),
+            patch.object(logger, '_queue', None),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(stop_logging)
+
+    def logger(self, name):
+        log = setup_logger(f"test_logger.{self._testMethodName}.{name}")
+        self.addCleanup(log.handlers.clear)
+        return log
+
+    def lines(self):
+        stop_logging()
+        return self.output.getvalue().splitlines()
+
+    def test_quiet_drops_info_and_keeps_reports(self):
+        globals.quiet = True
+        log = self.logger('quiet')
+        log.debug("debug")
+        log.info("info")
+        log.warning("warning")
+        log.log(REPORT, "report")
+        lines = self.lines()
+        self.assertEqual([line.split(' - ', 1)[1] for line in lines], ["WARNING - warning", "REPORT - report"])
+        self.assertIsInstance(log.handlers[0], DeferredQueueHandler)
+
+    def test_structured_records_are_json_lines(self):
+        globals.structured = True
+        log = self.logger('structured')
+        log.info("sent %s requests", 3)
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            log.exception("failed")
+        records = [json.loads(line) for line in self.lines()]
+        self.assertEqual([(record['level'], record['logger'], record['msg']) for record in records],
+                         [('INFO', log.name, "sent 3 requests"), ('ERROR', log.name, "failed")])
+        self.assertIn("ValueError: boom", records[1]['exc'])
+        self.assertNotIn('exc', records[0])
+
+    def test_quiet_and_structured_share_one_listener(self):
+        globals.quiet = True
+        globals.structured = True
+        first, second = self.logger('first'), self.logger('second')
+        self.assertIs(first.handlers[0].queue, second.handlers[0].queue)
+        first.log(REPORT, "one")
+        second.info("dropped")
+        second.error("two")
+        self.assertEqual([json.loads(line)['msg'] for line in self.lines()], ["one", "two"])
+
+    def test_records_are_formatted_by_the_listener(self):
+        handler = DeferredQueueHandler(None)
+        record = logging.LogRecord('name', logging.INFO, __file__, 1, "value %s", ('a',), None)
+        # QueueHandler.prepare would render the message in the thread that logs it
+        self.assertIs(handler.prepare(record), record)
+        self.assertEqual((record.msg, record.args), ("value %s", ('a',)))
+
+    def test_stop_logging_flushes_and_can_be_called_twice(self):
+        globals.quiet = True
+        log = self.logger('stop')
+        for index in range(100):
+            log.log(REPORT, "line %s", index)
+        stop_logging()
+        stop_logging()
+        self.assertEqual(len(self.output.getvalue().splitlines()), 100)
+        self.assertIsNone(logger._listener)
+
+    def test_levels(self):
+        self.assertEqual(self.logger('default').level, logging.INFO)
+        globals.verbose = 1
+        self.assertEqual(self.logger('verbose').level, logging.DEBUG)
+        globals.quiet = True
+        self.assertEqual(self.logger('quiet').level, REPORT)
+
+    def test_structured_formatter(self):
+        record = logging.LogRecord('agent', logging.WARNING, __file__, 1, "%s%%", (50,), None)
+        record.created = 1.23456
+        self.assertEqual(json.loads(StructuredFormatter().format(record)),
+                         {"ts": 1.235, "level": "WARNING", "logger": "agent", "msg": "50%"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import threading
+import unittest
+
+from urllib.request import urlopen
+
+from metrics import Metrics, format_labels, serve_metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        Metrics._instance = None
+        self.metrics = Metrics()
+
+    def tearDown(self):
+        Metrics._instance = None
+
+    def test_counters(self):
+        self.metrics.record('orders', ['smoke', ''], 'http://api/orders', 200, 12.0, 2,
+                            [('equals', True), ('length', False)])
+        output = self.metrics.render()
+        self.assertIn('http_control_requests_total{suite="orders",status="200"} 1', output)
+        self.assertIn('http_control_retries_total{suite="orders"} 2', output)
+        self.assertIn('http_control_assertions_total{suite="orders",check="length",result="failed"} 1', output)
+        self.assertIn('http_control_tag_assertions_total{tag="smoke",result="passed"} 1', output)
+        self.assertNotIn('tag=""', output)
+        self.assertIn('# TYPE http_control_requests_total counter', output)
+
+    def test_histogram(self):
+        for elapsed_ms in (3, 40, 40, 20000):
+            self.metrics.record('orders', [], 'http://api:8080/orders', 200, elapsed_ms, 0, [])
+        self.metrics.record('orders', [], 'http://api:8080/orders', None, None, 0, [])
+        lines = self.metrics.render().splitlines()
+        self.assertIn('http_control_request_duration_seconds_bucket{host="api:8080",le="0.005"} 1', lines)
+        self.assertIn('http_control_request_duration_seconds_bucket{host="api:8080",le="0.05"} 3', lines)
+        self.assertIn('http_control_request_duration_seconds_bucket{host="api:8080",le="10.0"} 3', lines)
+        self.assertIn('http_control_request_duration_seconds_bucket{host="api:8080",le="+Inf"} 4', lines)
+        self.assertIn('http_control_request_duration_seconds_sum{host="api:8080"} 20.083', lines)
+        self.assertIn('http_control_request_duration_seconds_count{host="api:8080"} 4', lines)
+        self.assertIn('http_control_requests_total{suite="orders",status="error"} 1', lines)
+
+    def test_threads(self):
+        def work():
+            for _ in range(1000):
+                self.metrics.inc('http_control_requests_total', (('suite', 's'), ('status', '200')))
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        work()
+        self.assertIn('http_control_requests_total{suite="s",status="200"} 5000', self.metrics.render())
+        # The shards of the finished threads are folded, and not counted twice
+        self.assertEqual(len(self.metrics.shards), 1)
+        self.assertIn('http_control_requests_total{suite="s",status="200"} 5000', self.metrics.render())
+
+    def test_format_labels(self):
+        self.assertEqual(format_labels(()), '')
+        self.assertEqual(format_labels((('tag', 'a"b\\c\nd'),)), '{tag="a\\"b\\\\c\\nd"}')
+
+    def test_serve_on_loopback_by_default(self):
+        server = serve_metrics(":0")
+        try:
+            host, port = server.server_address
+            self.assertEqual(host, '127.0.0.1')
+            with urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+                self.assertEqual(response.status, 200)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
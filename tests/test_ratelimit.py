@@ -0,0 +1,68 @@
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from executor import Executor
+from ratelimit import RateLimiter, TokenBucket, retry_after
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = RateLimiter()
+        self.request = SimpleNamespace(id=1, url="http://localhost:8080/a", suite="a")
+
+    def tearDown(self):
+        self.limiter.configure(None)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        now = bucket.updated
+        for _ in range(2):
+            self.assertEqual(bucket.delay(now), 0)
+            bucket.take()
+        self.assertAlmostEqual(bucket.delay(now), 0.1)
+        self.assertEqual(bucket.delay(now + 0.11), 0)
+
+    def test_retry_after(self):
+        self.assertEqual(retry_after({'Retry-After': '3'}), 3.0)
+        self.assertIsNone(retry_after({}))
+        self.assertEqual(retry_after({'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'}), 0.0)
+
+    def test_max_in_flight(self):
+        self.limiter.configure({'per_host': {'max_in_flight': 1}})
+        self.assertEqual(self.limiter.try_acquire(self.request), 0)
+        self.assertIsNone(self.limiter.try_acquire(self.request))
+        self.assertIsNone(self.limiter.release(self.request, {'status_code': 200}))
+        self.assertEqual(self.limiter.try_acquire(self.request), 0)
+
+    def test_throttled_responses_pause_the_host(self):
+        self.limiter.configure({'per_host': {}, 'backoff': 2, 'retries': 1})
+        self.assertEqual(self.limiter.try_acquire(self.request), 0)
+        self.assertEqual(self.limiter.release(self.request, {'status_code': 503}), 2)
+        self.assertGreater(self.limiter.try_acquire(self.request), 1)
+        self.assertEqual(self.limiter.stats(), {'localhost:8080': 1})
+        # No more retries left
+        self.assertIsNone(self.limiter.release(self.request, {'status_code': 429, 'headers': {'Retry-After': '1'}}, attempt=1))
+
+    def test_dispatch_waits_for_the_rate_limit(self):
+        self.limiter.configure({'per_host': {'rate': 10, 'burst': 1}})
+        requests = [SimpleNamespace(id=i, url="http://localhost:8080/a", suite="a", name="a", response={})
+                    for i in range(4)]
+
+        def fetch(request, total=None):
+            request.response = {'status_code': 200}
+
+        executor = Executor(SimpleNamespace(evaluate_response=lambda request: []), concurrency=2,
+                            limiter=self.limiter)
+        start = time.monotonic()
+        with patch.object(executor, 'fetch', fetch), \
+                patch.object(self.limiter, 'try_acquire', wraps=self.limiter.try_acquire) as try_acquire:
+            executor.run(requests)
+        # 3 requests wait for a token each, instead of polling the limiter in a loop
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+        self.assertLess(try_acquire.call_count, 20)
+
+if __name__ == '__main__':
+    unittest.main()
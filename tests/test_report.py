@@ -0,0 +1,59 @@
+import json
+import os
+import tempfile
+import unittest
+import xml.etree.ElementTree as ElementTree
+
+from report import JsonLinesWriter, JUnitWriter
+
+
+def result(request_id, passed=True, name="café", message="status_code: expected 200, got 500 — ✗"):
+    return {
+        "id": request_id, "name": name, "suite": "orders", "tags": ["smoke"], "method": "GET",
+        "url": f"http://localhost/{request_id}?q=a&b", "status_code": 200 if passed else 500, "error": "",
+        "elapsed_ms": 250.0, "retries": 0, "retry_ms": 0.0, "passed": passed,
+        "assertions": [{"check": "status_code.equals", "status": passed, "message": None if passed else message}],
+    }
+
+
+class TestReport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_json_lines(self):
+        path = os.path.join(self.directory.name, 'results.jsonl')
+        writer = JsonLinesWriter(path)
+        writer.write(result(1))
+        writer.write(result(2, passed=False))
+        writer.close({"total_requests": 2})
+
+        with open(path, encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line.get("id") for line in lines], [1, 2, None])
+        self.assertEqual(lines[0]["name"], "café")
+        self.assertEqual(lines[2], {"summary": {"total_requests": 2}})
+
+    def test_junit(self):
+        path = os.path.join(self.directory.name, 'results.xml')
+        writer = JUnitWriter(path)
+        writer.write(result(1))
+        writer.write(result(2, passed=False, name="naïve <order>"))
+        writer.close()
+
+        with open(path, 'rb') as f:
+            suite = ElementTree.fromstring(f.read()).find('testsuite')
+        self.assertEqual({key: suite.get(key) for key in ('tests', 'failures', 'errors', 'time')},
+                         {'tests': '2', 'failures': '1', 'errors': '0', 'time': '0.500'})
+        cases = suite.findall('testcase')
+        self.assertEqual(cases[0].get('name'), "(1) café GET http://localhost/1?q=a&b")
+        self.assertIsNone(cases[0].find('failure'))
+        self.assertEqual(cases[1].get('name'), "(2) naïve <order> GET http://localhost/2?q=a&b")
+        self.assertEqual(cases[1].find('failure').get('message'), "status_code: expected 200, got 500 — ✗")
+
+
+if __name__ == '__main__':
+    unittest.main()
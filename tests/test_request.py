@@ -0,0 +1,94 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agent import Agent
+from collection import Collection
+from executor import Executor
+from session import SessionPool
+
+
+class SizedHandler(BaseHTTPRequestHandler):
+    """
+    Answer /<size> with a JSON body of about that many bytes, on keep-alive connections
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.clients.add(self.client_address)
+        body = json.dumps({"data": "x" * int(self.path.strip('/'))}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the connection instead of reading the body
+            pass
+
+
+class TestRequest(unittest.TestCase):
+
+    def setUp(self):
+        SessionPool._instance = None
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), SizedHandler)
+        self.server.clients = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        SessionPool().close()
+        SessionPool._instance = None
+        self.server.shutdown()
+        self.server.server_close()
+
+    def requests(self, size, expect, count=1, **item):
+        data = {'requests': [{'name': f"r{index}", 'invoke': {'url': f"{self.url}/{size}"}, 'expect': expect, **item}
+                             for index in range(count)]}
+        return list(Collection(data).iter_requests())
+
+    def test_body_is_read_when_asserted(self):
+        request, = self.requests(1000, {'body.$.data': [{'equals': "x" * 1000}]}, max_body_bytes=2000)
+        request.invoke()
+        self.assertEqual(request.response['body'], {"data": "x" * 1000})
+        self.assertEqual(request.response['error'], "")
+
+    def test_body_over_max_body_bytes(self):
+        request, = self.requests(200000, {'body.$.data': [{'equals': ""}]}, max_body_bytes=100000)
+        request.invoke()
+        self.assertEqual(request.response['body'], "")
+        self.assertEqual(request.response['error'], "Response body exceeds max_body_bytes (100000)")
+        self.assertEqual(request.response['status_code'], 200)
+
+    def test_body_is_not_read_for_status_only_plans(self):
+        requests = self.requests(1000, {'status_code': [{'equals': 200}]}, count=3)
+        for request in requests:
+            request.invoke()
+            self.assertEqual(request.response['body'], "")
+            self.assertEqual(request.response['size_bytes'], len(json.dumps({"data": "x" * 1000})))
+        # Small unread bodies are drained, so the connection is used again
+        self.assertEqual(len(self.server.clients), 1)
+
+    def test_large_unread_body_closes_the_connection(self):
+        for request in self.requests(200000, {'status_code': [{'equals': 200}]}, count=2):
+            request.invoke()
+            self.assertEqual(request.response['status_code'], 200)
+        self.assertEqual(len(self.server.clients), 2)
+
+    def test_finished_requests_are_not_kept(self):
+        data = {'requests': [{'name': 'r', 'invoke': {'url': f"{self.url}/1000"},
+                              'expect': {'body.$.data': [{'equals': "x" * 1000}]}}]}
+        collection = Collection(data)
+        Executor(Agent(), 2, on_result=collection.record).run(collection.iter_requests())
+        self.assertEqual(collection.requests, {})
+        self.assertEqual(collection.filter_requests(), {})
+        self.assertEqual((collection.counters['requests'], collection.counters['passed']), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
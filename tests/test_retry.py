@@ -0,0 +1,35 @@
+import unittest
+
+from request import parse_timeout
+from retry import RetryPolicy, retry_policy
+
+
+class TestRetry(unittest.TestCase):
+
+    def test_retry_policy(self):
+        self.assertIsNone(retry_policy(None))
+        with self.assertRaises(ValueError):
+            retry_policy({'tries': 3})
+
+        policy = retry_policy({'attempts': 3, 'backoff': 1, 'max_backoff': 3, 'jitter': False})
+        self.assertEqual([policy.delay(retries) for retries in range(4)], [1, 2, 3, 3])
+        self.assertTrue(0 <= RetryPolicy(backoff=1).delay(5) <= 10)
+
+    def test_should_retry(self):
+        policy = RetryPolicy(attempts=2)
+        self.assertTrue(policy.should_retry('GET', {'status_code': 502}, 0))
+        self.assertTrue(policy.should_retry('GET', {'status_code': '', 'error': 'Read timed out'}, 0))
+        self.assertFalse(policy.should_retry('GET', {'status_code': 502}, 1))
+        self.assertFalse(policy.should_retry('GET', {'status_code': 500, 'error': ''}, 0))
+        self.assertFalse(policy.should_retry('POST', {'status_code': 502}, 0))
+
+    def test_parse_timeout(self):
+        self.assertEqual(parse_timeout(5), ((5.0, 5.0), None))
+        self.assertEqual(parse_timeout({'connect': 1, 'read': 4, 'total': 20}), ((1.0, 4.0), 20.0))
+        self.assertEqual(parse_timeout({'read': 4}), ((4.0, 4.0), None))
+        for timeout in (0, {'connect': -1}, {'write': 3}):
+            with self.assertRaises(ValueError):
+                parse_timeout(timeout)
+
+if __name__ == '__main__':
+    unittest.main()
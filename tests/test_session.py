@@ -0,0 +1,88 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agent import Agent
+from collection import Collection
+from session import SessionPool
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.clients.add(self.client_address)
+        body = b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestSessionPool(unittest.TestCase):
+
+    def setUp(self):
+        SessionPool._instance = None
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        self.server.clients = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.host = f"127.0.0.1:{self.server.server_address[1]}"
+
+    def tearDown(self):
+        SessionPool().close()
+        SessionPool._instance = None
+        self.server.shutdown()
+        self.server.server_close()
+
+    def requests(self, count, defaults=None, expect=None):
+        data = {'defaults': {'request': defaults or {}},
+                'requests': [{'name': f"r{index}", 'invoke': {'url': f"http://{self.host}/{index}"},
+                              'expect': expect or {'status_code': [{'equals': 200}]}} for index in range(count)]}
+        return list(Collection(data).iter_requests())
+
+    def test_one_session_per_scheme_host_verify_cert_and_proxy(self):
+        pool = SessionPool()
+        session = pool.get("http://api/a")
+        self.assertIs(pool.get("http://api/b?page=2"), session)
+        self.assertIsNot(pool.get("https://api/a"), session)
+        self.assertIsNot(pool.get("http://other/a"), session)
+        self.assertIsNot(pool.get("http://api/a", verify=True), session)
+        self.assertIsNot(pool.get("http://api/a", cert=('client.pem',)), session)
+        self.assertIsNot(pool.get("http://api/a", proxies={'http': 'http://proxy:3128'}), session)
+        self.assertEqual(len(pool.sessions), 6)
+
+    def test_pool_settings(self):
+        self.requests(1, {'pool': {'connections': 3, 'maxsize': 7}})
+        pool = SessionPool()
+        self.assertEqual((pool.pool_connections, pool.pool_maxsize), (3, 7))
+        adapter = pool.get(f"http://{self.host}/").get_adapter(f"http://{self.host}/")
+        self.assertEqual((adapter._pool_connections, adapter._pool_maxsize), (3, 7))
+
+    def test_connections_are_reused(self):
+        for request in self.requests(5):
+            request.invoke()
+            self.assertEqual(request.response['status_code'], 200)
+        self.assertEqual(len(self.server.clients), 1)
+        self.assertEqual(SessionPool().stats(), {'127.0.0.1': {'requests': 5, 'connections': 1, 'reused': 4}})
+
+
+    def test_timings(self):
+        expect = {'elapsed_ms': [{'lower': 5000}], 'ttfb_ms': [{'lower': 5000}], 'size_bytes': [{'equals': 12}]}
+        first, second = self.requests(2, expect=expect)
+        for request in (first, second):
+            request.invoke()
+            self.assertGreater(request.response['ttfb_ms'], 0)
+            self.assertGreaterEqual(request.response['elapsed_ms'], request.response['ttfb_ms'])
+            self.assertEqual(request.response['tls_ms'], 0)
+            self.assertEqual([assertion.status for assertion in Agent().evaluate_response(request)], [True] * 3)
+        self.assertGreater(first.response['connect_ms'], 0)
+        # Nothing to set up on a reused connection
+        self.assertEqual(second.response['connect_ms'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
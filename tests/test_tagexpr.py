@@ -0,0 +1,33 @@
+import unittest
+from tagexpr import compile_expression, from_args, select
+
+
+class TestTagExpr(unittest.TestCase):
+
+    def test_from_args(self):
+        self.assertEqual(from_args(["smoke", "api"]), "smoke and api")
+        self.assertEqual(from_args(["smoke", "and", "not", "slow"]), "smoke and not slow")
+        self.assertEqual(from_args(["smoke and not slow"]), "smoke and not slow")
+        self.assertIsNone(from_args(None))
+
+    def test_precedence(self):
+        self.assertEqual(compile_expression("a or b and not c"),
+                         ('or', ('tag', 'a'), ('and', ('tag', 'b'), ('not', ('tag', 'c')))))
+        self.assertEqual(compile_expression("(a or b) and c"),
+                         ('and', ('or', ('tag', 'a'), ('tag', 'b')), ('tag', 'c')))
+
+    def test_invalid_expressions(self):
+        for expression in ("", "a and", "(a or b", "a b", "and a"):
+            with self.assertRaises(ValueError):
+                compile_expression(expression)
+
+    def test_select(self):
+        index = {"smoke": {1, 2, 3}, "slow": {3, 4}}
+        universe = {1, 2, 3, 4, 5}
+        self.assertEqual(select(compile_expression("smoke and not slow"), index, universe), {1, 2})
+        self.assertEqual(select(compile_expression("smoke or slow"), index, universe), {1, 2, 3, 4})
+        self.assertEqual(select(compile_expression("not (smoke or slow)"), index, universe), {5})
+        self.assertEqual(select(compile_expression("missing"), index, universe), set())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import base64
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from tokens import TokenStore, expires_at
+
+PROVIDERS = {
+    'idp': {'enabled': True, 'token_url': 'https://idp/token', 'client_id': 'client', 'client_secret': 'secret',
+            'scope': 'read', 'grant_type': 'client_credentials', 'ttl': 600, 'refresh_margin': 60},
+    'disabled': {'enabled': False},
+}
+
+
+class TestTokenStore(unittest.TestCase):
+
+    def setUp(self):
+        TokenStore._instance = None
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, 'tokens.json')
+        self.store = TokenStore(PROVIDERS, self.cache_path)
+        self.manager = MagicMock()
+        self.manager.return_value.get_token.side_effect = lambda: f"token-{self.manager.call_count}"
+        self.manager.return_value.expires_in = None
+        # The identity provider client is only imported when a token is not in the cache
+        self.modules = patch.dict(sys.modules, {'light_token_manager': SimpleNamespace(LightTokenManager=self.manager)})
+        self.modules.start()
+
+    def tearDown(self):
+        self.modules.stop()
+        self.directory.cleanup()
+        TokenStore._instance = None
+
+    def test_fetch_refreshes_and_writes_the_cache(self):
+        self.store.fetch({'idp'})
+        self.assertEqual(self.store.get('idp'), 'token-1')
+        self.manager.assert_called_once_with('https://idp/token', 'client', 'secret', 'read', 'client_credentials')
+        with open(self.cache_path) as f:
+            cache = json.load(f)
+        self.assertEqual(cache['idp|client|read']['token'], 'token-1')
+        self.assertEqual(os.stat(self.cache_path).st_mode & 0o777, 0o600)
+
+    def test_fetch_uses_the_cache(self):
+        with open(self.cache_path, 'w') as f:
+            json.dump({'idp|client|read': {'token': 'cached', 'expires_at': time.time() + 600}}, f)
+        self.store.fetch({'idp'})
+        self.assertEqual(self.store.get('idp'), 'cached')
+        self.manager.assert_not_called()
+
+    def test_expiring_token_is_refreshed(self):
+        self.store.set('idp', 'old', time.time() + 30)
+        self.assertEqual(self.store.get('idp'), 'token-1')
+        self.store.set('idp', 'expired', time.time() - 1)
+        self.assertEqual(self.store.get('idp'), 'token-2')
+
+    def test_unknown_provider(self):
+        with self.assertRaises(ValueError):
+            self.store.fetch({'disabled'})
+        with self.assertRaises(ValueError):
+            self.store.get('missing')
+
+    def test_set_waits_for_the_cache_writer(self):
+        # write_cache goes through the tokens while holding the lock, set must not add one meanwhile
+        with self.store.lock:
+            setter = threading.Thread(target=self.store.set, args=('idp', 'token', time.time() + 600))
+            setter.start()
+            setter.join(timeout=0.1)
+            self.assertTrue(setter.is_alive())
+            self.assertNotIn('idp', self.store.tokens)
+        setter.join(timeout=5)
+        self.assertEqual(self.store.tokens['idp'][0], 'token')
+
+
+    def test_expiry_of_a_jwt_comes_from_its_claims(self):
+        expiry = int(time.time()) + 300
+        claims = base64.urlsafe_b64encode(json.dumps({'exp': expiry}).encode()).rstrip(b'=').decode()
+        self.manager.return_value.get_token.side_effect = None
+        self.manager.return_value.get_token.return_value = f"header.{claims}.signature"
+        self.store.fetch({'idp'})
+        # Not the 600s ttl of the provider
+        self.assertEqual(self.store.tokens['idp'][1], expiry)
+        with open(self.cache_path) as f:
+            self.assertEqual(json.load(f)['idp|client|read']['expires_at'], expiry)
+
+    def test_expiry(self):
+        now = time.time()
+        with patch('tokens.time.time', return_value=now):
+            self.assertEqual(expires_at('opaque', 300, 600), now + 300)
+            self.assertEqual(expires_at('opaque', None, 600), now + 600)
+            self.assertEqual(expires_at('not.a.jwt', None, 600), now + 600)
+            self.assertEqual(expires_at(None, None, 600), now + 600)
+
+
+if __name__ == '__main__':
+    unittest.main()